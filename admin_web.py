@@ -1,6 +1,8 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
-from model import SessionLocal, Beat, Bundle, BundleBeat, Order, get_database_stats as get_db_stats, get_exclusive_beats_sold
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, Response, stream_with_context
+import click
+from model import SessionLocal, Beat, Bundle, BundleBeat, Order, get_database_stats as get_db_stats, get_exclusive_beats_sold, get_bundles_with_beats, get_beats_page, get_beat_filter_options, get_beats_for_update, bulk_update_beats, invalidate_database_stats, run_schema_migrations
 from sqlalchemy import or_
+from beat_search import search_beats, suggest_beats, catalog_candidate_ids, notify_beats_changed
 import os
 import sys
 import subprocess  # Needed for FFmpeg conversion
@@ -10,16 +12,23 @@ import boto3
 from botocore.config import Config
 import uuid
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import logging
 import re
 import tempfile
 import io
 from pathlib import Path
+from PIL import Image, ImageOps
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.errors import HttpError
 import hashlib
+import random
 import time
+import threading
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 load_dotenv()  # Carica le variabili dal file .env
 
@@ -58,12 +67,31 @@ logging.basicConfig(
     ]
 )
 
-# Progress tracking per operazioni lunghe - versione semplificata per Railway
+# Migrazioni dello schema (tabelle, colonne e indici nuovi) applicate all'avvio,
+# prima che le query ORM selezionino le colonne introdotte dal modello: se una
+# migrazione fallisce l'app non parte, invece di girare su uno schema incompleto
+try:
+    applied_migrations = run_schema_migrations()
+    if applied_migrations:
+        logging.info(f"🔨 Migrazioni dello schema applicate: {', '.join(applied_migrations)}")
+except Exception as e:
+    logging.error(f"❌ Impossibile applicare le migrazioni dello schema: {str(e)}")
+    raise
+
+# Progress tracking per operazioni lunghe
+# Il progresso è salvato in un file SQLite locale condiviso da tutti i worker
+# gunicorn del container, così qualunque worker può rispondere alle richieste
+# di stato; i record più vecchi di PROGRESS_TTL_SECONDS vengono eliminati.
 import time
 import json
+import sqlite3
 
-# Storage per il progresso delle operazioni
-progress_storage = {}
+PROGRESS_DB_PATH = os.environ.get("PROGRESS_DB_PATH", os.path.join(tempfile.gettempdir(), "admin-web-progress.sqlite3"))
+PROGRESS_TTL_SECONDS = int(os.environ.get("PROGRESS_TTL_SECONDS", str(24 * 3600)))
+PROGRESS_CLEANUP_INTERVAL = 300  # secondi tra due pulizie dei record scaduti
+_progress_schema_ready = False
+
+_progress_last_cleanup = 0.0
 
 # --- R2 MANAGER INTEGRATO ---
 SERVICE_ACCOUNT_FILE = Path(__file__).parent / 'pegasus.json'
@@ -78,6 +106,17 @@ SUFFIX_MAP = {
     "_pic.jpeg": "public/images"
 }
 
+# Campo del beat nel database per ciascun suffisso
+MIGRATION_KEY_FIELDS = {
+    "_full.wav": "file_key",
+    "_spoiler.wav": "preview_key",
+    "_pic.jpg": "image_key",
+    "_pic.jpeg": "image_key"
+}
+
+# Metadato R2 con l'impronta del file Drive da cui l'oggetto è stato generato
+R2_SOURCE_METADATA_KEY = "drive-fingerprint"
+
 def extract_beat_name(filename):
     """Estrai il nome pulito del beat dal nome del file"""
     patterns = [
@@ -141,27 +180,260 @@ def get_drive_service():
     logging.error("❌ Nessuna credenziale Google trovata!")
     raise Exception("Credenziali Google non disponibili")
 
+# Pool di elaborazione parallela per la migrazione
+MIGRATION_IO_WORKERS = max(1, int(os.environ.get("MIGRATION_IO_WORKERS", "4")))  # Thread per download/upload
+MIGRATION_CPU_WORKERS = max(1, int(os.environ.get("MIGRATION_CPU_WORKERS", str(os.cpu_count() or 1))))  # Conversioni FFmpeg simultanee
+
+MIGRATION_INSERT_BATCH_SIZE = max(1, int(os.environ.get("MIGRATION_INSERT_BATCH_SIZE", "100")))  # Beat per INSERT in blocco
+
+_cpu_semaphore = threading.BoundedSemaphore(MIGRATION_CPU_WORKERS)
+_drive_thread_local = threading.local()
+
+def get_thread_drive_service(drive_service_factory=None):
+    """Restituisce un servizio Drive dedicato al thread corrente (httplib2 non è thread-safe)"""
+    factory = drive_service_factory or get_drive_service
+    cached = getattr(_drive_thread_local, 'cached', None)
+    if cached is None or cached[0] is not factory:
+        cached = (factory, factory())
+        _drive_thread_local.cached = cached
+    return cached[1]
+
+# Limitatore condiviso delle chiamate Drive (quote per utente del service account)
+DRIVE_RATE_LIMIT_PER_SECOND = float(os.environ.get("DRIVE_RATE_LIMIT_PER_SECOND", "10"))  # Richieste al secondo a regime
+DRIVE_RATE_LIMIT_BURST = max(1, int(os.environ.get("DRIVE_RATE_LIMIT_BURST", "20")))  # Richieste consentite a raffica
+DRIVE_MAX_RETRIES = max(0, int(os.environ.get("DRIVE_MAX_RETRIES", "6")))
+DRIVE_BACKOFF_BASE = float(os.environ.get("DRIVE_BACKOFF_BASE", "1"))  # Secondi, raddoppiati a ogni tentativo
+DRIVE_BACKOFF_MAX = float(os.environ.get("DRIVE_BACKOFF_MAX", "64"))
+DRIVE_CONCURRENCY_RECOVERY = max(1, int(os.environ.get("DRIVE_CONCURRENCY_RECOVERY", "50")))  # Successi prima di aumentare la concorrenza
+
+DRIVE_RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+def is_drive_rate_limit_error(error):
+    """True se l'errore Drive indica throttling (429 o 403 per quota superata).
+
+    Gli errori 5xx non sono throttling: non vengono ritentati qui e non riducono la concorrenza.
+    """
+    if not isinstance(error, HttpError):
+        return False
+    status = getattr(error.resp, 'status', None)
+    if status == 429:
+        return True
+    if status == 403:
+        try:
+            reasons = [item.get('reason') for item in json.loads(error.content).get('error', {}).get('errors', [])]
+        except (ValueError, AttributeError, TypeError):
+            reasons = []
+        return any(reason in DRIVE_RATE_LIMIT_REASONS for reason in reasons)
+    return False
+
+class DriveRateLimiter:
+    """Token bucket condiviso tra i thread per le chiamate Drive, con backoff e concorrenza adattiva.
+
+    Ogni chiamata consuma un token (ricaricati a rate costante fino al burst)
+    e occupa uno slot di concorrenza. Le risposte di throttling vengono
+    ritentate con backoff esponenziale e jitter e dimezzano le chiamate
+    simultanee consentite; dopo una serie di successi la concorrenza risale
+    di uno slot alla volta fino al massimo configurato.
+    """
+
+    def __init__(self, rate=DRIVE_RATE_LIMIT_PER_SECOND, burst=DRIVE_RATE_LIMIT_BURST, max_concurrency=MIGRATION_IO_WORKERS):
+        if rate <= 0:
+            raise ValueError(f"DRIVE_RATE_LIMIT_PER_SECOND deve essere maggiore di 0 (valore: {rate})")
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self._condition = threading.Condition()
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self.concurrency = max_concurrency
+        self._successes = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Azzera le statistiche (all'avvio di ogni migrazione)"""
+        with self._condition:
+            self.stats = {'requests': 0, 'throttled': 0, 'retries': 0, 'wait_seconds': 0.0,
+                          'min_concurrency': self.concurrency}
+
+    def _acquire(self):
+        started = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._in_flight < self.concurrency and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    self.stats['requests'] += 1
+                    self.stats['wait_seconds'] += time.monotonic() - started
+                    return
+                timeout = None if self._in_flight >= self.concurrency else (1 - self._tokens) / self.rate
+                self._condition.wait(timeout)
+
+    def _release(self, throttled):
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self._successes = 0
+                self.concurrency = max(1, self.concurrency // 2)
+                self.stats['throttled'] += 1
+                self.stats['min_concurrency'] = min(self.stats['min_concurrency'], self.concurrency)
+            else:
+                self._successes += 1
+                if self._successes >= DRIVE_CONCURRENCY_RECOVERY and self.concurrency < self.max_concurrency:
+                    self._successes = 0
+                    self.concurrency += 1
+            self._condition.notify_all()
+
+    def call(self, function, *args, **kwargs):
+        """Esegue una chiamata Drive rispettando il limite, ritentando in caso di throttling"""
+        for attempt in range(DRIVE_MAX_RETRIES + 1):
+            self._acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                throttled = is_drive_rate_limit_error(e)
+                self._release(throttled)
+                if not throttled or attempt == DRIVE_MAX_RETRIES:
+                    raise
+                delay = random.uniform(0, min(DRIVE_BACKOFF_MAX, DRIVE_BACKOFF_BASE * (2 ** attempt)))
+                logging.warning(f"⏳ Throttling Drive ({getattr(e.resp, 'status', '?')}), nuovo tentativo tra {delay:.1f}s "
+                                f"(concorrenza {self.concurrency})")
+                with self._condition:
+                    self.stats['retries'] += 1
+                    self.stats['wait_seconds'] += delay
+                time.sleep(delay)
+                continue
+            self._release(False)
+            return result
+
+    def summary(self):
+        """Riepilogo leggibile delle statistiche di throttling"""
+        with self._condition:
+            stats = dict(self.stats)
+        return (f"Drive: {stats['requests']} richieste, {stats['throttled']} limitate, "
+                f"attesa {stats['wait_seconds']:.1f}s, concorrenza minima {stats['min_concurrency']}")
+
+_drive_rate_limiter = DriveRateLimiter()
+
+def execute_drive_request(request):
+    """Esegue una richiesta Drive (list/get/changes) tramite il limitatore condiviso"""
+    return _drive_rate_limiter.call(request.execute)
+
+def next_drive_chunk(downloader):
+    """Scarica il blocco successivo di un downloader Drive tramite il limitatore condiviso"""
+    return _drive_rate_limiter.call(downloader.next_chunk)
+
+# Client R2 condiviso dal processo: creato una volta per PID (i worker gunicorn
+# nascono per fork con preload_app e non devono ereditare connessioni aperte).
+# I client boto3 sono thread-safe; il pool urllib3 interno riusa le connessioni TLS.
+R2_MAX_POOL_CONNECTIONS = max(1, int(os.environ.get("R2_MAX_POOL_CONNECTIONS", "32")))
+R2_CONNECT_TIMEOUT = float(os.environ.get("R2_CONNECT_TIMEOUT", "10"))
+R2_READ_TIMEOUT = float(os.environ.get("R2_READ_TIMEOUT", "60"))
+R2_MAX_ATTEMPTS = max(1, int(os.environ.get("R2_MAX_ATTEMPTS", "3")))
+
+_r2_client_lock = threading.Lock()
+_r2_client_state = {'pid': None, 'client': None}
+_r2_pool_metrics = {'clients_created': 0, 'requests': 0, 'in_flight': 0, 'peak_in_flight': 0, 'errors': 0}
+
+def _r2_request_started(**kwargs):
+    with _r2_client_lock:
+        _r2_pool_metrics['requests'] += 1
+        _r2_pool_metrics['in_flight'] += 1
+        _r2_pool_metrics['peak_in_flight'] = max(_r2_pool_metrics['peak_in_flight'], _r2_pool_metrics['in_flight'])
+
+def _r2_request_finished(response=None, caught_exception=None, **kwargs):
+    with _r2_client_lock:
+        _r2_pool_metrics['in_flight'] = max(0, _r2_pool_metrics['in_flight'] - 1)
+        if caught_exception is not None:
+            _r2_pool_metrics['errors'] += 1
+
 def get_r2_client():
-    """Get Cloudflare R2 client"""
-    return boto3.client(
-        's3',
-        endpoint_url=R2_ENDPOINT_URL,
-        aws_access_key_id=R2_ACCESS_KEY_ID,
-        aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-    )
+    """Client Cloudflare R2 condiviso dal processo (ricreato dopo un fork)"""
+    pid = os.getpid()
+    client = _r2_client_state['client']
+    if client is not None and _r2_client_state['pid'] == pid:
+        return client
+
+    with _r2_client_lock:
+        if _r2_client_state['client'] is None or _r2_client_state['pid'] != pid:
+            client = boto3.session.Session().client(
+                's3',
+                endpoint_url=R2_ENDPOINT_URL,
+                aws_access_key_id=R2_ACCESS_KEY_ID,
+                aws_secret_access_key=R2_SECRET_ACCESS_KEY,
+                region_name='auto',
+                config=Config(
+                    signature_version='s3v4',
+                    max_pool_connections=R2_MAX_POOL_CONNECTIONS,
+                    connect_timeout=R2_CONNECT_TIMEOUT,
+                    read_timeout=R2_READ_TIMEOUT,
+                    tcp_keepalive=True,
+                    retries={'max_attempts': R2_MAX_ATTEMPTS, 'mode': 'standard'}
+                )
+            )
+            # Ogni tentativo HTTP passa da before-send e termina in needs-retry
+            client.meta.events.register('before-send.s3', _r2_request_started)
+            client.meta.events.register('needs-retry.s3', _r2_request_finished)
+            if _r2_client_state['pid'] != pid:
+                _r2_pool_metrics.update(clients_created=0, requests=0, in_flight=0, peak_in_flight=0, errors=0)
+            _r2_pool_metrics['clients_created'] += 1
+            _r2_client_state.update(pid=pid, client=client)
+        return _r2_client_state['client']
+
+def get_r2_pool_metrics():
+    """Metriche del client R2 del processo: richieste, concorrenza e connessioni del pool"""
+    with _r2_client_lock:
+        metrics = dict(_r2_pool_metrics, pid=os.getpid(), max_pool_connections=R2_MAX_POOL_CONNECTIONS)
+        client = _r2_client_state['client'] if _r2_client_state['pid'] == os.getpid() else None
+
+    # Stato dei pool urllib3 (attributi interni di botocore: solo a titolo informativo)
+    pools = []
+    try:
+        manager = client._endpoint.http_session._manager
+        for pool_key in list(manager.pools.keys()):
+            pool = manager.pools.get(pool_key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': pool.host,
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': sum(1 for connection in list(pool.pool.queue) if connection is not None) if pool.pool else 0
+            })
+    except Exception:
+        pass
+    metrics['pools'] = pools
+    return metrics
+
+def drive_media_downloader(service, file_id, fh, chunk_size=None):
+    """Downloader a blocchi (next_chunk) del contenuto di un file Drive, scritto in fh.
+
+    Un servizio che espone media_downloader(file_id, fh, chunk_size) fornisce il
+    proprio downloader: così il flusso di migrazione gira anche contro un
+    servizio Drive finto, le cui richieste get_media non sono HttpRequest.
+    """
+    media_downloader = getattr(service, 'media_downloader', None)
+    if media_downloader is not None:
+        return media_downloader(file_id, fh, chunk_size)
+    request = service.files().get_media(fileId=file_id)
+    if chunk_size is None:
+        return MediaIoBaseDownload(fh, request)
+    return MediaIoBaseDownload(fh, request, chunksize=chunk_size)
 
 def download_drive_file(service, file_id):
     """Scarica file da Drive e restituisce bytes"""
-    request = service.files().get_media(fileId=file_id)
     fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
+    downloader = drive_media_downloader(service, file_id, fh)
     done = False
     while not done:
-        _, done = downloader.next_chunk()
+        _, done = next_drive_chunk(downloader)
     fh.seek(0)
     return fh.read()
 
-def upload_to_r2_direct(s3_client, data, key, content_type):
+def upload_to_r2_direct(s3_client, data, key, content_type, metadata=None):
     """Carica file su Cloudflare R2 direttamente"""
     try:
         acl = 'public-read' if key.startswith('public/') else 'private'
@@ -170,13 +442,113 @@ def upload_to_r2_direct(s3_client, data, key, content_type):
             Key=key,
             Body=data,
             ContentType=content_type,
-            ACL=acl
+            ACL=acl,
+            Metadata=metadata or {}
         )
         return True
     except Exception as e:
         logging.error(f"Errore upload R2 per {key}: {str(e)}")
         return False
 
+# Dimensione delle parti per i multipart upload in streaming (minimo S3/R2: 5MB)
+R2_MULTIPART_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("R2_MULTIPART_PART_SIZE", str(8 * 1024 * 1024))))
+
+class R2MultipartWriter:
+    """File-like in sola scrittura che inoltra i dati a un multipart upload R2.
+
+    I dati vengono bufferizzati fino a una parte di dimensione fissa (R2 richiede
+    parti uguali tranne l'ultima) e caricati appena pronti, quindi la memoria
+    occupata resta nell'ordine di una o due parti qualunque sia la dimensione del file.
+    """
+
+    def __init__(self, s3_client, key, content_type, metadata=None, part_size=R2_MULTIPART_PART_SIZE):
+        self.s3_client = s3_client
+        self.key = key
+        self.content_type = content_type
+        self.metadata = metadata or {}
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            with memoryview(self.buffer) as view:
+                chunk = bytes(view[:self.part_size])
+            del self.buffer[:self.part_size]
+            self._upload_part(chunk)
+        return len(data)
+
+    def _upload_part(self, chunk):
+        if self.upload_id is None:
+            acl = 'public-read' if self.key.startswith('public/') else 'private'
+            response = self.s3_client.create_multipart_upload(
+                Bucket=R2_BUCKET_NAME,
+                Key=self.key,
+                ContentType=self.content_type,
+                ACL=acl,
+                Metadata=self.metadata
+            )
+            self.upload_id = response['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=R2_BUCKET_NAME,
+            Key=self.key,
+            PartNumber=part_number,
+            UploadId=self.upload_id,
+            Body=chunk
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def complete(self):
+        """Chiude l'upload: caricamento singolo se il file non ha superato una parte"""
+        if self.upload_id is None:
+            upload_ok = upload_to_r2_direct(self.s3_client, bytes(self.buffer), self.key, self.content_type, self.metadata)
+            self.buffer = bytearray()
+            if not upload_ok:
+                raise Exception(f"Upload R2 fallito per {self.key}")
+            return
+        if self.buffer:
+            self._upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.s3_client.complete_multipart_upload(
+            Bucket=R2_BUCKET_NAME,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self):
+        """Annulla il multipart upload liberando le parti già caricate"""
+        self.buffer = bytearray()
+        if self.upload_id is None:
+            return
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=R2_BUCKET_NAME, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            logging.warning(f"⚠️ Impossibile annullare il multipart upload di {self.key}: {str(e)}")
+
+def stream_drive_file_to_r2(service, file_id, s3_client, key, content_type, metadata=None):
+    """Trasferisce un file da Drive a R2 in streaming, a blocchi, senza caricarlo tutto in memoria.
+
+    Ogni blocco viene caricato su R2 dopo che next_drive_chunk ha restituito lo
+    slot del limitatore Drive, così l'upload_part non occupa la concorrenza Drive.
+    """
+    writer = R2MultipartWriter(s3_client, key, content_type, metadata)
+    try:
+        for chunk in iter_drive_file_chunks(service, file_id):
+            writer.write(chunk)
+        writer.complete()
+        logging.info(f"📤 Trasferimento in streaming completato: {key} ({writer.bytes_written} bytes, {len(writer.parts)} parti)")
+        return True
+    except Exception as e:
+        writer.abort()
+        logging.error(f"Errore trasferimento in streaming per {key}: {str(e)}")
+        return False
+
 def get_content_type_from_filename(filename):
     """Determina il content type in base all'estensione"""
     if filename.endswith('.wav'): return 'audio/wav'
@@ -185,36 +557,312 @@ def get_content_type_from_filename(filename):
     if filename.endswith('.jpeg'): return 'image/jpeg'
     return 'application/octet-stream'
 
-def convert_wav_to_mp3_direct(wav_data):
-    """Converte audio WAV in MP3 usando FFmpeg"""
+# Timeout e dimensione dei blocchi per la conversione FFmpeg via pipe
+FFMPEG_TIMEOUT = int(os.environ.get("FFMPEG_TIMEOUT", "180"))  # secondi
+FFMPEG_PIPE_CHUNK_SIZE = 1024 * 1024
+# WAV delle preview tenuti in memoria fino a questa dimensione, oltre vengono riversati su disco
+PREVIEW_SPOOL_MAX_MEMORY = int(os.environ.get("PREVIEW_SPOOL_MAX_MEMORY", str(32 * 1024 * 1024)))
+
+def iter_audio_chunks(source, chunk_size=FFMPEG_PIPE_CHUNK_SIZE):
+    """Itera a blocchi su bytes, file-like con read() o iterabile di blocchi"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in source:
+            if chunk:
+                yield chunk
+
+def iter_drive_file_chunks(service, file_id, chunk_size=R2_MULTIPART_PART_SIZE):
+    """Scarica un file da Drive restituendolo a blocchi, senza accumularlo in memoria"""
+    buffer = io.BytesIO()
+    downloader = drive_media_downloader(service, file_id, buffer, chunk_size)
+    done = False
+    while not done:
+        _, done = next_drive_chunk(downloader)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def spool_drive_file(service, file_id, max_memory=PREVIEW_SPOOL_MAX_MEMORY):
+    """Scarica un file da Drive in un buffer limitato (memoria fino a max_memory, poi disco), riavvolto.
+
+    Serve a separare il download (I/O) dalla conversione FFmpeg (CPU): il
+    semaforo CPU viene preso solo a download terminato.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
     try:
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_wav:
-            tmp_wav.write(wav_data)
-            tmp_wav_path = tmp_wav.name
-        
-        tmp_mp3_path = tempfile.mktemp(suffix='.mp3')
-        
-        cmd = [
-            'ffmpeg', '-y', '-i', tmp_wav_path,
-            '-codec:a', 'libmp3lame', '-qscale:a', '2', tmp_mp3_path
-        ]
-        
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        if result.returncode != 0:
-            logging.error(f"Errore FFmpeg: {result.stderr}")
+        for chunk in iter_drive_file_chunks(service, file_id):
+            spool.write(chunk)
+        spool.seek(0)
+        return spool
+    except Exception:
+        spool.close()
+        raise
+
+def convert_wav_to_mp3_direct(wav_source, timeout=FFMPEG_TIMEOUT):
+    """Converte audio WAV in MP3 usando FFmpeg via pipe (stdin → stdout), senza file temporanei.
+
+    wav_source può essere bytes, un file-like o un iterabile di blocchi (es. il
+    download in streaming da Drive): l'input viene pompato a blocchi da un thread
+    dedicato mentre l'MP3 viene letto da stdout. Restituisce i bytes MP3 oppure
+    None in caso di errore o timeout.
+    """
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'wav', '-i', 'pipe:0',
+        '-codec:a', 'libmp3lame', '-qscale:a', '2',
+        '-f', 'mp3', 'pipe:1'
+    ]
+
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception as e:
+        logging.error(f"Errore avvio FFmpeg: {str(e)}")
+        return None
+
+    feed_errors = []
+    stderr_chunks = []
+    timed_out = threading.Event()
+
+    def feed_stdin():
+        try:
+            for chunk in iter_audio_chunks(wav_source):
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # FFmpeg ha chiuso l'input (errore o timeout): l'esito viene gestito dal thread principale
+            pass
+        except Exception as e:
+            feed_errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except Exception:
+                pass
+
+    def drain_stderr():
+        stderr_chunks.append(process.stderr.read())
+
+    def kill_on_timeout():
+        timed_out.set()
+        process.kill()
+
+    feeder = threading.Thread(target=feed_stdin, daemon=True)
+    stderr_reader = threading.Thread(target=drain_stderr, daemon=True)
+    watchdog = threading.Timer(timeout, kill_on_timeout)
+    feeder.start()
+    stderr_reader.start()
+    watchdog.start()
+
+    try:
+        mp3_chunks = []
+        while True:
+            chunk = process.stdout.read(FFMPEG_PIPE_CHUNK_SIZE)
+            if not chunk:
+                break
+            mp3_chunks.append(chunk)
+        process.wait()
+    finally:
+        watchdog.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        # Il feeder termina da solo (BrokenPipe) se è ancora in attesa della sorgente
+        feeder.join(timeout=1)
+        stderr_reader.join()
+        process.stdout.close()
+        process.stderr.close()
+
+    if timed_out.is_set():
+        logging.error(f"Errore FFmpeg: conversione interrotta dopo {timeout}s")
+        return None
+    if feed_errors:
+        logging.error(f"Errore lettura sorgente WAV: {str(feed_errors[0])}")
+        return None
+    if process.returncode != 0:
+        stderr_text = b''.join(stderr_chunks).decode('utf-8', errors='replace')
+        logging.error(f"Errore FFmpeg: {stderr_text}")
+        return None
+
+    return b''.join(mp3_chunks)
+
+# Forma d'onda precalcolata delle preview: pochi KB di picchi al posto del decode dell'MP3 lato client
+try:
+    import numpy as np  # Opzionale: senza NumPy le forme d'onda non vengono generate
+except ImportError:
+    np = None
+
+WAVEFORM_PEAKS_POINTS = max(1, int(os.environ.get("WAVEFORM_PEAKS_POINTS", "800")))  # Campioni della forma d'onda
+WAVEFORM_SAMPLE_RATE = 8000  # Hz del PCM mono decodificato per il calcolo dei picchi
+
+def get_waveform_key(preview_key):
+    """Chiave R2 della forma d'onda, accanto alla preview MP3"""
+    return f"{preview_key.rsplit('.', 1)[0]}.peaks.json"
+
+def compute_waveform_peaks(mp3_data, points=WAVEFORM_PEAKS_POINTS, timeout=FFMPEG_TIMEOUT):
+    """Calcola i picchi della forma d'onda di una preview MP3.
+
+    L'MP3 viene decodificato da FFmpeg in PCM mono 16 bit a WAVEFORM_SAMPLE_RATE;
+    i campioni sono divisi in `points` finestre e per ognuna si prende il
+    picco assoluto, normalizzato a 0-255. Restituisce il JSON (bytes) da
+    salvare su R2 oppure None se NumPy non è disponibile o la decodifica fallisce.
+    """
+    if np is None:
+        logging.warning("⚠️ NumPy non installato: forma d'onda non generata")
+        return None
+
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'mp3', '-i', 'pipe:0',
+        '-ac', '1', '-ar', str(WAVEFORM_SAMPLE_RATE),
+        '-f', 's16le', 'pipe:1'
+    ]
+    try:
+        result = subprocess.run(cmd, input=mp3_data, capture_output=True, timeout=timeout)
+    except Exception as e:
+        logging.error(f"Errore FFmpeg (forma d'onda): {str(e)}")
+        return None
+    if result.returncode != 0:
+        logging.error(f"Errore FFmpeg (forma d'onda): {result.stderr.decode('utf-8', errors='replace')}")
+        return None
+
+    samples = np.frombuffer(result.stdout, dtype='<i2')
+    if not samples.size:
+        return None
+
+    points = min(points, samples.size)
+    window = samples.size // points
+    magnitudes = np.abs(samples[:window * points].astype(np.int32)).reshape(points, window).max(axis=1)
+    loudest = int(magnitudes.max()) or 1
+    peaks = np.rint(magnitudes * (255 / loudest)).astype(np.uint8)
+
+    return json.dumps({
+        "version": 1,
+        "duration": round(samples.size / WAVEFORM_SAMPLE_RATE, 2),
+        "peaks": peaks.tolist()
+    }, separators=(',', ':')).encode('utf-8')
+
+def upload_waveform_peaks(s3_client, mp3_data, waveform_key, metadata=None):
+    """Calcola e carica su R2 la forma d'onda di una preview; restituisce True se caricata"""
+    # Il semaforo CPU copre solo la decodifica FFmpeg, non l'upload su R2
+    with _cpu_semaphore:
+        peaks_data = compute_waveform_peaks(mp3_data)
+    if peaks_data is None:
+        return False
+    return upload_to_r2_direct(s3_client, peaks_data, waveform_key, 'application/json', metadata)
+
+def backfill_waveform_peaks(s3_client, preview_key, waveform_key):
+    """Genera la forma d'onda di una preview già su R2 (preview precedenti alle forme d'onda o copiate)"""
+    try:
+        mp3_data = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=preview_key)['Body'].read()
+    except Exception as e:
+        logging.error(f"Errore lettura preview {preview_key} da R2: {str(e)}")
+        return False
+    return upload_waveform_peaks(s3_client, mp3_data, waveform_key)
+
+# Derivati delle immagini (beat e bundle): versioni ridimensionate WebP/JPEG senza metadati
+IMAGE_DERIVATIVE_SIZES = {"thumb": 160, "card": 480, "full": 1280}  # Lato massimo in pixel
+IMAGE_DERIVATIVE_FORMATS = {"webp": ("WEBP", "image/webp"), "jpg": ("JPEG", "image/jpeg")}
+IMAGE_DERIVATIVE_QUALITY = {"webp": 80, "jpg": 85}
+IMAGE_CDN_BASE_URL = os.environ.get("IMAGE_CDN_BASE_URL", "https://beats-cdn.pegasus-beats.workers.dev")
+_image_derivative_pattern = re.compile(rf"_({'|'.join(IMAGE_DERIVATIVE_SIZES)})\.({'|'.join(IMAGE_DERIVATIVE_FORMATS)})$")
+
+def image_derivative_key(image_key, size_name, extension):
+    """Chiave R2 di un derivato: accanto all'originale, con taglia ed estensione nel nome"""
+    return f"{image_key.rsplit('.', 1)[0]}_{size_name}.{extension}"
+
+def image_derivative_keys(image_key):
+    """Tutte le chiavi dei derivati di un'immagine originale"""
+    return [image_derivative_key(image_key, size_name, extension)
+            for size_name in IMAGE_DERIVATIVE_SIZES for extension in IMAGE_DERIVATIVE_FORMATS]
+
+def is_image_derivative_key(key):
+    """True se la chiave è un derivato generato (e non un'immagine originale)"""
+    return bool(_image_derivative_pattern.search(key))
+
+def generate_image_derivatives(image_data):
+    """Genera i derivati ridimensionati di un'immagine (bytes o file): {(taglia, estensione): bytes}.
+
+    L'orientamento EXIF viene applicato ai pixel e i metadati non vengono
+    copiati nei derivati; le immagini non vengono mai ingrandite. Per i JPEG
+    la decodifica avviene già in scala ridotta (draft) quando possibile.
+    """
+    source_file = io.BytesIO(image_data) if isinstance(image_data, (bytes, bytearray)) else image_data
+    with Image.open(source_file) as source:
+        largest = max(IMAGE_DERIVATIVE_SIZES.values())
+        source.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(source)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    derivatives = {}
+    # Dalla taglia più grande alla più piccola, ridimensionando ogni volta il risultato precedente
+    for size_name, max_side in sorted(IMAGE_DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+        image = image.copy() if max(image.size) <= max_side else image.resize(
+            _fit_within(image.size, max_side), Image.Resampling.LANCZOS)
+        for extension, (pil_format, _) in IMAGE_DERIVATIVE_FORMATS.items():
+            output = io.BytesIO()
+            if pil_format == 'JPEG':
+                flattened = image
+                if image.mode == 'RGBA':
+                    flattened = Image.new('RGB', image.size, (255, 255, 255))
+                    flattened.paste(image, mask=image.getchannel('A'))
+                flattened.save(output, pil_format, quality=IMAGE_DERIVATIVE_QUALITY[extension], optimize=True, progressive=True)
+            else:
+                image.save(output, pil_format, quality=IMAGE_DERIVATIVE_QUALITY[extension], method=4)
+            derivatives[(size_name, extension)] = output.getvalue()
+    return derivatives
+
+def _fit_within(size, max_side):
+    width, height = size
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def upload_image_derivatives(s3_client, image_key, image_data, metadata=None):
+    """Genera e carica su R2 i derivati di un'immagine; restituisce la lista delle chiavi o None in caso di errore"""
+    try:
+        with _cpu_semaphore:
+            derivatives = generate_image_derivatives(image_data)
+    except Exception as e:
+        logging.error(f"Errore generazione derivati di {image_key}: {str(e)}")
+        return None
+
+    uploaded_keys = []
+    for (size_name, extension), data in derivatives.items():
+        derivative_key = image_derivative_key(image_key, size_name, extension)
+        if not upload_to_r2_direct(s3_client, data, derivative_key, IMAGE_DERIVATIVE_FORMATS[extension][1], metadata):
             return None
-        
-        with open(tmp_mp3_path, 'rb') as f:
-            mp3_data = f.read()
-        
-        os.unlink(tmp_wav_path)
-        os.unlink(tmp_mp3_path)
-        
-        return mp3_data
+        uploaded_keys.append(derivative_key)
+    return uploaded_keys
+
+def backfill_image_derivatives(s3_client, image_key):
+    """Genera i derivati di un'immagine già su R2 leggendo l'originale"""
+    try:
+        image_data = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=image_key)['Body'].read()
     except Exception as e:
-        logging.error(f"Errore conversione WAV in MP3: {str(e)}")
+        logging.error(f"Errore lettura immagine {image_key} da R2: {str(e)}")
         return None
+    return upload_image_derivatives(s3_client, image_key, image_data)
+
+@app.template_global()
+def image_url(image_key, size_name=None, extension="jpg"):
+    """URL pubblico di un'immagine o di un suo derivato"""
+    if size_name:
+        image_key = image_derivative_key(image_key, size_name, extension)
+    return f"{IMAGE_CDN_BASE_URL}/{image_key}"
+
+@app.template_global()
+def image_srcset(image_key, extension):
+    """srcset con tutti i derivati di un formato: il browser sceglie il più piccolo adatto"""
+    return ", ".join(f"{image_url(image_key, size_name, extension)} {max_side}w"
+                     for size_name, max_side in IMAGE_DERIVATIVE_SIZES.items())
 
 def r2_key_exists_check(s3_client, key):
     """Controlla se una chiave esiste già su R2"""
@@ -224,6 +872,56 @@ def r2_key_exists_check(s3_client, key):
     except Exception:
         return False
 
+class R2KeyIndex:
+    """Inventario in memoria delle chiavi presenti su R2 sotto un insieme di prefissi.
+
+    Costruito una sola volta con list_objects_v2 paginato, sostituisce le HEAD
+    per singolo file; è thread-safe e viene aggiornato man mano che gli upload
+    vengono completati.
+    """
+
+    def __init__(self, s3_client, prefixes):
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._keys_by_etag = {}
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for prefix in prefixes:
+            for page in paginator.paginate(Bucket=R2_BUCKET_NAME, Prefix=f"{prefix.rstrip('/')}/"):
+                for obj in page.get('Contents', []):
+                    self._objects[obj['Key']] = obj
+                    etag = obj.get('ETag', '').strip('"')
+                    if etag and '-' not in etag:
+                        self._keys_by_etag.setdefault((obj['Key'].rsplit('/', 1)[0], etag), obj['Key'])
+        logging.info(f"📦 Inventario R2: {len(self._objects)} oggetti in {', '.join(prefixes)}")
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._objects
+
+    def __len__(self):
+        with self._lock:
+            return len(self._objects)
+
+    def get(self, key):
+        """Restituisce i metadati dell'oggetto (Key, Size, ETag, ...) o None"""
+        with self._lock:
+            return self._objects.get(key)
+
+    def keys(self):
+        """Istantanea delle chiavi presenti"""
+        with self._lock:
+            return list(self._objects)
+
+    def find_by_etag(self, prefix, etag):
+        """Chiave di un oggetto sotto il prefisso caricato in un'unica parte con l'ETag (MD5) indicato, o None"""
+        with self._lock:
+            return self._keys_by_etag.get((prefix.rstrip('/'), etag))
+
+    def add(self, key, **metadata):
+        """Registra una chiave appena caricata"""
+        with self._lock:
+            self._objects[key] = dict(metadata, Key=key)
+
 def reset_database_integrated():
     """Reset completo del database integrato"""
     try:
@@ -233,8 +931,10 @@ def reset_database_integrated():
         Base.metadata.drop_all(engine)
         logging.info("✅ Tabelle eliminate")
         
+        # Lo schema viene ricreato dalle migrazioni, così include anche gli indici non dichiarati nel modello
         logging.info("🔨 Ricreazione schema database...")
-        Base.metadata.create_all(engine)
+        run_schema_migrations()
+        notify_beats_changed(rebuild=True)
         logging.info("✅ Schema database ricreato")
         
         return True, "Database reset completato con successo"
@@ -243,33 +943,371 @@ def reset_database_integrated():
         logging.error(f"❌ {error_msg}")
         return False, error_msg
 
-def update_progress(operation_id, progress, status, details=None):
-    """Aggiorna il progresso di un'operazione - versione semplificata"""
-    progress_storage[operation_id] = {
-        'progress': progress,
-        'status': status,
-        'details': details,
-        'timestamp': time.time()
-    }
+def _progress_connection():
+    """Apre una connessione allo storage condiviso del progresso, creando la tabella se serve"""
+    global _progress_schema_ready
+    connection = sqlite3.connect(PROGRESS_DB_PATH, timeout=10, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS operation_progress (
+            operation_id TEXT PRIMARY KEY,
+            progress INTEGER NOT NULL,
+            status TEXT,
+            details TEXT,
+            state TEXT NOT NULL,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            timestamp REAL NOT NULL,
+            job_name TEXT
+        )
+    """)
+    if not _progress_schema_ready:
+        # Storage creato da una versione precedente, senza il nome del job
+        columns = {row['name'] for row in connection.execute("PRAGMA table_info(operation_progress)")}
+        if 'job_name' not in columns:
+            try:
+                connection.execute("ALTER TABLE operation_progress ADD COLUMN job_name TEXT")
+            except sqlite3.OperationalError:
+                pass  # Aggiunta nel frattempo da un altro processo
+        _progress_schema_ready = True
+    return connection
+
+def _cleanup_expired_progress(connection):
+    """Elimina i record di progresso scaduti (al massimo una volta ogni PROGRESS_CLEANUP_INTERVAL)"""
+    global _progress_last_cleanup
+    now = time.time()
+    if now - _progress_last_cleanup < PROGRESS_CLEANUP_INTERVAL:
+        return
+    _progress_last_cleanup = now
+    connection.execute("DELETE FROM operation_progress WHERE timestamp < ?", (now - PROGRESS_TTL_SECONDS,))
+
+def update_progress(operation_id, progress, status, details=None, state=None):
+    """Aggiorna il progresso di un'operazione mantenendo stato del job e richiesta di annullamento"""
+    with closing(_progress_connection()) as connection:
+        connection.execute("""
+            INSERT INTO operation_progress (operation_id, progress, status, details, state, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(operation_id) DO UPDATE SET
+                progress = excluded.progress,
+                status = excluded.status,
+                details = excluded.details,
+                state = COALESCE(?, operation_progress.state),
+                timestamp = excluded.timestamp
+        """, (operation_id, int(progress), status, details, state or 'running', time.time(), state))
+        _cleanup_expired_progress(connection)
+
+def queue_operation(operation_id, job_name):
+    """Registra un'operazione in coda, con il nome del job che la eseguirà"""
+    with closing(_progress_connection()) as connection:
+        connection.execute("""
+            INSERT OR REPLACE INTO operation_progress (operation_id, progress, status, details, state, timestamp, job_name)
+            VALUES (?, 0, ?, NULL, 'queued', ?, ?)
+        """, (operation_id, "Operazione in coda...", time.time(), job_name))
 
 def get_progress(operation_id):
-    """Ottiene il progresso di un'operazione"""
-    return progress_storage.get(operation_id, {
-        'progress': 0,
-        'status': 'Non trovato',
-        'details': None,
-        'timestamp': time.time()
-    })
+    """Ottiene il progresso di un'operazione (cancellable: il job controlla le richieste di annullamento)"""
+    with closing(_progress_connection()) as connection:
+        row = connection.execute(
+            "SELECT progress, status, details, state, cancel_requested, timestamp, job_name FROM operation_progress WHERE operation_id = ?",
+            (operation_id,)
+        ).fetchone()
+    if row is None:
+        return {
+            'progress': 0,
+            'status': 'Non trovato',
+            'details': None,
+            'state': 'unknown',
+            'cancel_requested': False,
+            'timestamp': time.time(),
+            'job_name': None,
+            'cancellable': False
+        }
+    return dict(row, cancel_requested=bool(row['cancel_requested']), cancellable=row['job_name'] in CANCELLABLE_JOBS)
 
-# SSE route removed - operations are now synchronous
+def request_cancel(operation_id):
+    """Richiede l'annullamento di un'operazione; restituisce False se non esiste, è già terminata o non è annullabile"""
+    if not CANCELLABLE_JOBS:
+        return False
+    with closing(_progress_connection()) as connection:
+        cursor = connection.execute(f"""
+            UPDATE operation_progress SET cancel_requested = 1
+            WHERE operation_id = ? AND state IN ('queued', 'running')
+            AND job_name IN ({", ".join("?" * len(CANCELLABLE_JOBS))})
+        """, (operation_id, *sorted(CANCELLABLE_JOBS)))
+        return cursor.rowcount > 0
+
+def is_cancel_requested(operation_id):
+    """True se per l'operazione è stato richiesto l'annullamento"""
+    return get_progress(operation_id).get('cancel_requested', False)
+
+# --- JOB IN BACKGROUND PER OPERAZIONI LUNGHE ---
+# Le operazioni sul database (migrazione, reset, riconciliazione) girano in un
+# processo dedicato (comando CLI run-database-job): la richiesta HTTP
+# restituisce subito l'operation_id e il job sopravvive al riciclo dei worker
+# gunicorn (max_requests, graceful_timeout). Un lock su file garantisce che,
+# tra tutti i processi, sia in esecuzione una sola operazione alla volta: il
+# worker lo acquisisce e lo passa al processo del job, che lo tiene fino alla
+# fine (il sistema lo rilascia anche se il processo muore). Il calcolo del
+# piano di migrazione, in sola lettura, ha un lock proprio.
+try:
+    import fcntl  # Non disponibile su Windows: in quel caso il lock vale solo nel processo
+except ImportError:
+    fcntl = None
+
+ADMIN_JOB_LOCK_FILE = os.environ.get("ADMIN_JOB_LOCK_FILE", os.path.join(tempfile.gettempdir(), "admin-web-db-job.lock"))
+# Il piano di migrazione legge soltanto: ha un proprio lock e non blocca le altre operazioni
+MIGRATION_PLAN_LOCK_FILE = os.environ.get("MIGRATION_PLAN_LOCK_FILE", os.path.join(tempfile.gettempdir(), "admin-web-migration-plan.lock"))
+JOB_FINAL_STATES = ('completed', 'failed', 'cancelled')
+SSE_POLL_INTERVAL = 1  # secondi tra due letture del progresso condiviso
+SSE_HEARTBEAT_INTERVAL = 15
+# Ogni stream SSE occupa un thread del worker: gli stream sono limitati per processo e
+# chiusi dopo SSE_STREAM_MAX_SECONDS (il client si riconnette); oltre il limite il client usa il polling
+SSE_MAX_STREAMS_PER_WORKER = max(0, int(os.environ.get("SSE_MAX_STREAMS_PER_WORKER", "1")))
+SSE_STREAM_MAX_SECONDS = max(1, int(os.environ.get("SSE_STREAM_MAX_SECONDS", "60")))
+
+_sse_stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS_PER_WORKER) if SSE_MAX_STREAMS_PER_WORKER else None
+
+_job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="admin-job")  # Solo senza fcntl
+
+class DatabaseJobLock:
+    """Lock su file che consente una sola operazione alla volta, tra tutti i processi.
+
+    Il worker lo acquisisce e lo passa al processo del job, che lo tiene fino
+    alla fine (il sistema lo rilascia anche se il processo muore). Il file
+    contiene operation_id e PID del processo che esegue l'operazione, letti
+    dagli altri worker senza prendere il lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, operation_id):
+        """Acquisisce il lock (non bloccante); restituisce False se è già tenuto"""
+        if not self._thread_lock.acquire(blocking=False):
+            return False
+        if fcntl is None:
+            return True
+        lock_file = open(self.path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            self._thread_lock.release()
+            return False
+        self._file = lock_file
+        self.set_owner(operation_id, os.getpid())
+        return True
 
-def run_database_migration_direct(operation_id):
+    def set_owner(self, operation_id, pid):
+        """Registra per gli altri worker l'operazione attiva e il processo che la esegue"""
+        if self._file is None:
+            return
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(f"{operation_id} {pid}")
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def detach(self):
+        """Chiude la copia del lock di questo processo senza rilasciarlo: resta al processo del job"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def adopt(self, lock_fd):
+        """Prende in carico il lock già acquisito dal worker che ha avviato questo processo"""
+        self._thread_lock.acquire()
+        self._file = os.fdopen(lock_fd, 'a+')
+
+    def release(self):
+        if self._file is not None:
+            self._file.truncate(0)
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def active_operation_id(self):
+        """operation_id dell'operazione in corso (anche in un altro processo) o None, senza prendere il lock"""
+        try:
+            with open(self.path, 'r') as lock_file:
+                owner = lock_file.read().split()
+        except OSError:
+            return None
+        if not owner or (len(owner) > 1 and not _process_alive(int(owner[1]))):
+            # Processo terminato senza rilasciare: l'operazione orfana viene chiusa dal prossimo avvio
+            return None
+        operation_id = owner[0]
+        if get_progress(operation_id)['state'] not in ('queued', 'running'):
+            return None
+        return operation_id
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Esiste, ma appartiene a un altro utente
+    return True
+
+_db_job_lock = DatabaseJobLock(ADMIN_JOB_LOCK_FILE)
+_migration_plan_lock = DatabaseJobLock(MIGRATION_PLAN_LOCK_FILE)
+
+# Operazioni eseguibili in background, per nome: il processo del job le riceve dalla riga di comando
+DATABASE_JOBS = {}
+DATABASE_JOB_LOCKS = {}
+CANCELLABLE_JOBS = set()
+
+class OperationCancelled(Exception):
+    """Sollevata da un job annullabile quando si ferma per una richiesta di annullamento"""
+
+def database_job(name, lock=_db_job_lock, cancellable=False):
+    """Registra un'operazione avviabile con submit_database_job(name, ...).
+
+    Le operazioni che modificano dati usano il lock esclusivo condiviso; quelle
+    in sola lettura possono indicarne uno proprio. Solo i job cancellable
+    accettano richieste di annullamento: le controllano con is_cancel_requested
+    e, se si fermano, sollevano OperationCancelled.
+    """
+    def register(job_function):
+        DATABASE_JOBS[name] = job_function
+        DATABASE_JOB_LOCKS[name] = lock
+        if cancellable:
+            CANCELLABLE_JOBS.add(name)
+        return job_function
+    return register
+
+def get_active_db_job_id():
+    """Restituisce l'operation_id dell'operazione esclusiva in corso (anche in un altro processo) o None"""
+    return _db_job_lock.active_operation_id()
+
+def _fail_orphaned_operations_locked(lock):
+    """Segna come fallite le operazioni del lock rimaste in coda o in esecuzione (il chiamante tiene il lock).
+
+    Il lock è tenuto dal processo del job finché è vivo: chi lo tiene sa che
+    nessuna di quelle operazioni è davvero in corso.
+    """
+    job_names = [name for name, job_lock in DATABASE_JOB_LOCKS.items() if job_lock is lock]
+    # Le operazioni registrate senza nome del job (versioni precedenti) erano tutte esclusive
+    unnamed = " OR job_name IS NULL" if lock is _db_job_lock else ""
+    with closing(_progress_connection()) as connection:
+        orphaned = connection.execute(f"""
+            UPDATE operation_progress SET progress = 100, status = ?, details = ?, state = 'failed', timestamp = ?
+            WHERE state IN ('queued', 'running')
+            AND (job_name IN ({", ".join("?" * len(job_names))}){unnamed})
+        """, ("Operazione interrotta", "Il processo dell'operazione è terminato prima del completamento",
+              time.time(), *job_names)).rowcount
+    if orphaned:
+        logging.warning(f"⚠️ {orphaned} operazioni interrotte segnate come fallite")
+    return orphaned
+
+def fail_orphaned_operations(lock):
+    """Chiude le operazioni orfane del lock, se nessun processo lo tiene; restituisce quante"""
+    if fcntl is None or not lock.acquire(""):
+        return 0
+    try:
+        return _fail_orphaned_operations_locked(lock)
+    finally:
+        lock.release()
+
+def run_database_job(operation_id, job_name, job_kwargs):
+    """Esegue un'operazione registrata e ne salva lo stato finale; rilascia il lock al termine"""
+    try:
+        update_progress(operation_id, 0, "Avvio operazione...", state='running')
+        success, message = DATABASE_JOBS[job_name](operation_id, **job_kwargs)
+        # Lo stato finale riflette l'esito del job: un annullamento richiesto ma non onorato non conta
+        if success:
+            update_progress(operation_id, 100, "Operazione completata", message, state='completed')
+        else:
+            update_progress(operation_id, 100, "Operazione fallita", message, state='failed')
+    except OperationCancelled as e:
+        update_progress(operation_id, 100, "Operazione annullata", str(e), state='cancelled')
+    except Exception as e:
+        error_msg = f"Errore interno: {str(e)}"
+        logging.error(f"❌ Job {operation_id}: {error_msg}")
+        update_progress(operation_id, 100, "Operazione fallita", error_msg, state='failed')
+    finally:
+        DATABASE_JOB_LOCKS[job_name].release()
+        if DATABASE_JOB_LOCKS[job_name] is _db_job_lock:
+            # Le operazioni esclusive modificano database e storage: statistiche e piano non sono più attuali
+            invalidate_database_stats()
+            invalidate_migration_plan()
+
+def _spawn_database_job_process(operation_id, job_name, job_kwargs, lock):
+    """Avvia il processo del job passandogli il descrittore del lock già acquisito e ne registra il PID"""
+    lock_fd = lock.fileno()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "flask", "--app", "admin_web", "run-database-job",
+         job_name, operation_id, "--kwargs", json.dumps(job_kwargs)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, ADMIN_JOB_LOCK_FD=str(lock_fd)),
+        pass_fds=(lock_fd,),
+        stdin=subprocess.DEVNULL,
+        start_new_session=True  # Non riceve i segnali inviati da gunicorn al gruppo del worker
+    )
+    lock.set_owner(operation_id, process.pid)
+    # Raccoglie l'exit status, così il processo terminato non resta zombie nel worker
+    threading.Thread(target=process.wait, daemon=True).start()
+
+def submit_database_job(job_name, **job_kwargs):
+    """Avvia in background un'operazione registrata con @database_job.
+
+    La funzione del job riceve operation_id come primo argomento più job_kwargs
+    (serializzabili in JSON) e restituisce (successo, messaggio). Restituisce
+    l'operation_id, oppure None se un'altra operazione con lo stesso lock è già in corso.
+    """
+    lock = DATABASE_JOB_LOCKS[job_name]
+    operation_id = str(uuid.uuid4())
+    if not lock.acquire(operation_id):
+        return None
+    
+    try:
+        if fcntl is not None:
+            # Con il lock in mano, le operazioni ancora "in corso" sono rimaste da un processo terminato
+            _fail_orphaned_operations_locked(lock)
+        queue_operation(operation_id, job_name)
+    except Exception:
+        lock.release()
+        raise
+    
+    if fcntl is None:
+        # Senza flock il lock vale solo nel processo: il job gira in un thread di questo worker
+        try:
+            _job_executor.submit(run_database_job, operation_id, job_name, job_kwargs)
+        except Exception:
+            lock.release()
+            raise
+        return operation_id
+    
+    try:
+        _spawn_database_job_process(operation_id, job_name, job_kwargs, lock)
+    except Exception as e:
+        update_progress(operation_id, 100, "Operazione fallita", f"Impossibile avviare il processo del job: {str(e)}", state='failed')
+        lock.release()
+        raise
+    lock.detach()
+    return operation_id
+
+@database_job("reset-database")
+def run_database_reset_job(operation_id):
+    """Job di reset del database"""
+    update_progress(operation_id, 10, "Reset database in corso...")
+    return reset_database_integrated()
+
+@database_job("update-database", cancellable=True)
+def run_database_migration_direct(operation_id, incremental=True):
     """Esegue la migrazione database direttamente senza script esterni"""
     try:
         update_progress(operation_id, 0, "Inizializzazione migrazione...")
         
         # Esegui la migrazione integrata
-        success, result_message = migrate_to_r2_integrated(operation_id)
+        success, result_message = migrate_to_r2_integrated(operation_id, incremental=incremental)
         
         if success:
             update_progress(operation_id, 100, "Migrazione completata con successo!", result_message)
@@ -278,6 +1316,8 @@ def run_database_migration_direct(operation_id):
             update_progress(operation_id, 100, "Errore durante la migrazione", result_message)
             return False, result_message
             
+    except OperationCancelled:
+        raise
     except Exception as e:
         error_msg = f"Errore interno durante la migrazione: {str(e)}"
         update_progress(operation_id, 100, "Errore interno", error_msg)
@@ -297,14 +1337,7 @@ def upload_to_r2(file_content, file_key):
             print(f"R2_BUCKET_NAME: {'✅' if R2_BUCKET_NAME else 'Œ'}")
             return False
         
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=R2_ENDPOINT_URL,
-            aws_access_key_id=R2_ACCESS_KEY_ID,
-            aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-            config=Config(signature_version='s3v4'),
-            region_name='auto'
-        )
+        s3_client = get_r2_client()
         
         # Determine content type based on file extension
         content_type = 'application/octet-stream'
@@ -338,253 +1371,303 @@ def delete_from_r2(file_key):
             print("Error: Missing R2 environment variables for deletion")
             return False
         
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=R2_ENDPOINT_URL,
-            aws_access_key_id=R2_ACCESS_KEY_ID,
-            aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-            config=Config(signature_version='s3v4'),
-            region_name='auto'
-        )
-        
-        # Check if file exists before attempting deletion
-        try:
-            s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=file_key)
-            file_exists = True
-        except:
-            file_exists = False
+        s3_client = get_r2_client()
         
-        if file_exists:
-            s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=file_key)
-            print(f"Successfully deleted {file_key} from R2")
-            return True
-        else:
-            print(f"File {file_key} not found in R2, skipping deletion")
-            return True  # Consider this a success since the file doesn't exist
+        # DELETE è idempotente: una chiave inesistente non è un errore, nessuna HEAD preventiva
+        s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=file_key)
+        print(f"Successfully deleted {file_key} from R2")
+        return True
             
     except Exception as e:
         print(f"Error deleting from R2: {e}")
         return False
 
+def delete_image_with_derivatives(image_key):
+    """Elimina da R2 un'immagine e i suoi derivati con un'unica delete_objects"""
+    if not all([R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_ENDPOINT_URL, R2_BUCKET_NAME]):
+        print("Error: Missing R2 environment variables for deletion")
+        return False
+    
+    try:
+        _, errors = delete_r2_keys_batched(get_r2_client(), [image_key] + image_derivative_keys(image_key))
+    except Exception as e:
+        print(f"Error deleting from R2: {e}")
+        return False
+    for error in errors:
+        print(f"Error deleting {error.get('Key')} from R2: {error.get('Message')}")
+    return not any(error.get('Key') == image_key for error in errors)
+
+# Catalogo beat paginato per id (keyset): ogni pagina costa O(BEATS_PAGE_SIZE) qualunque sia la dimensione del catalogo
+BEATS_PAGE_SIZE = int(os.environ.get("BEATS_PAGE_SIZE", "50"))
+
+def parse_beat_filters(args):
+    """Filtri del catalogo dalla query string: solo quelli indicati e validi"""
+    filters = {}
+    for name in ("q", "genre", "mood"):
+        value = args.get(name, "").strip()
+        if value:
+            filters[name] = value
+    for name in ("exclusive", "discounted", "available"):
+        value = args.get(name, "")
+        if value in ("0", "1"):
+            filters[name] = int(value)
+    for name in ("min_price", "max_price"):
+        value = args.get(name, type=float)
+        if value is not None:
+            filters[name] = value
+    return filters
+
+def beat_to_view(beat, cached=None):
+    """Dati di un beat per la scheda del catalogo (cached: valori inviati dal form non salvati)"""
+    view = {
+        "id": beat.id,
+        "title": beat.title,
+        "genre": beat.genre,
+        "mood": beat.mood,
+        "price": beat.price,
+        "is_exclusive": beat.is_exclusive,
+        "is_discounted": beat.is_discounted,
+        "discount_percent": beat.discount_percent,
+        "original_price": beat.original_price if beat.original_price is not None else beat.price,
+        "discounted_price": beat.price if beat.is_discounted else '',
+    }
+    if cached:
+        view.update(cached)
+    return view
+
+def parse_beat_price_form(form):
+    """Modifiche di prezzo inviate dal form della pagina principale: {beat_id: valori}"""
+    changes = {}
+    for key in form:
+        # Salta i campi hidden
+        if key.startswith("original_price_hidden_") or not key.startswith("original_price_"):
+            continue
+        # Solo se la chiave NON contiene 'hidden'
+        suffix = key.replace("original_price_", "")
+        if not suffix.isdigit():
+            continue
+        beat_id = int(suffix)
+        is_exclusive_list = form.getlist(f"is_exclusive_{beat_id}")
+        is_discounted_list = form.getlist(f"is_discounted_{beat_id}")
+        changes[beat_id] = {
+            "original_price": form.get(f"original_price_{beat_id}", type=float),
+            "discounted_price": form.get(f"discounted_price_{beat_id}", type=float),
+            "is_exclusive": int(is_exclusive_list[-1]) if is_exclusive_list else 0,
+            "is_discounted": int(is_discounted_list[-1]) if is_discounted_list else 0,
+            "discount_percent": form.get(f"discount_percent_{beat_id}", type=int) or 0,
+        }
+    return changes
+
+def validate_beat_price_form(changes, beats_by_id):
+    """Valida in un'unica passata le modifiche del form.
+
+    Restituisce (righe per bulk_update_beats, errori per beat_id); i beat non
+    più presenti nel database vengono ignorati.
+    """
+    rows = []
+    errors = {}
+    for beat_id, change in changes.items():
+        beat = beats_by_id.get(beat_id)
+        if beat is None:
+            continue
+        original_price = change["original_price"]
+        discounted_price = change["discounted_price"]
+        is_discounted = change["is_discounted"]
+        discount_percent = change["discount_percent"]
+        
+        if discounted_price is not None and discounted_price > 0 and not is_discounted:
+            errors[beat_id] = f"Spunta 'Scontato' per applicare il prezzo scontato al beat '{beat.title}'!"
+            continue
+        if is_discounted and (discounted_price is None or discounted_price <= 0):
+            errors[beat_id] = f"Inserisci un prezzo scontato valido (> 0) per il beat '{beat.title}'!"
+            continue
+        if is_discounted and original_price is not None and discounted_price > original_price:
+            errors[beat_id] = f"Il prezzo scontato non puÃ² essere maggiore del prezzo originale per il beat '{beat.title}'!"
+            continue
+        if is_discounted and discount_percent < 0:
+            errors[beat_id] = f"La percentuale di sconto non puÃ² essere negativa per il beat '{beat.title}'!"
+            continue
+        if is_discounted and discount_percent == 0:
+            try:
+                discount_percent = int(round(100 - (discounted_price / original_price * 100)))
+            except Exception:
+                errors[beat_id] = f"Errore nel calcolo dello sconto per il beat '{beat.title}'!"
+                continue
+            if discount_percent <= 0:
+                errors[beat_id] = f"Inserisci una percentuale di sconto valida (> 0) per il beat '{beat.title}'!"
+                continue
+        if discount_percent > 0 and not is_discounted:
+            errors[beat_id] = f"Spunta 'Scontato' per applicare lo sconto al beat '{beat.title}'!"
+            continue
+        
+        # Aggiorna il prezzo originale solo se indicato
+        if original_price is None:
+            original_price = beat.original_price
+        rows.append({
+            "id": beat_id,
+            "original_price": original_price,
+            # Se scontato vale il prezzo scontato, altrimenti si torna al prezzo originale
+            "price": discounted_price if is_discounted else (original_price if original_price is not None else beat.price),
+            "is_discounted": 1 if is_discounted else 0,
+            "discount_percent": discount_percent if is_discounted else 0,
+            "is_exclusive": change["is_exclusive"],
+        })
+    return rows, errors
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     error = None
-    error_beat_id = None
+    beat_errors = {}
     if not session.get("logged_in"):
-        # Mostra errore solo se non associato a un beat specifico
         return render_template(
             "admin_web.html",
             beats=[],
-            error=error if error_beat_id is None else None,
-            error_beat_id=error_beat_id
+            error=error,
+            beat_errors=beat_errors
         )
 
-    with SessionLocal() as db:
-        if request.method == "POST":
-            print("DEBUG FORM DATA:", dict(request.form))  # <--- AGGIUNTO
-            form_cache = {}
-            for key in request.form:
-                # Salta i campi hidden
-                if key.startswith("original_price_hidden_"):
-                    continue
-                if key.startswith("original_price_"):
-                    # Solo se la chiave NON contiene 'hidden'
-                    suffix = key.replace("original_price_", "")
-                    if not suffix.isdigit():
-                        continue
-                    beat_id = int(suffix)
-                    original_price = request.form.get(f"original_price_{beat_id}", type=float)
-                    discounted_price = request.form.get(f"discounted_price_{beat_id}", type=float)
-                    # Cambiato qui:
-                    is_exclusive_list = request.form.getlist(f"is_exclusive_{beat_id}")
-                    is_exclusive = int(is_exclusive_list[-1]) if is_exclusive_list else 0
-
-                    is_discounted_list = request.form.getlist(f"is_discounted_{beat_id}")
-                    is_discounted = int(is_discounted_list[-1]) if is_discounted_list else 0
-
-                    discount_percent = request.form.get(f"discount_percent_{beat_id}", type=int) or 0
-
-                    beat = db.query(Beat).filter_by(id=beat_id).first()
-                    if not beat:
-                        continue
-
-                    # Aggiorna il prezzo originale solo se cambia
-                    if original_price is not None and (beat.original_price is None or beat.original_price != original_price):
-                        beat.original_price = original_price
-
-                    form_cache[beat_id] = {
-                        "original_price": original_price,
-                        "discounted_price": discounted_price,
-                        "is_exclusive": is_exclusive,
-                        "is_discounted": is_discounted,
-                        "discount_percent": discount_percent,
-                    }
+    form_cache = {}
+    if request.method == "POST":
+        print("DEBUG FORM DATA:", dict(request.form))  # <--- AGGIUNTO
+        # Una query per tutti i beat del form, validazione completa, un solo UPDATE executemany
+        form_cache = parse_beat_price_form(request.form)
+        beats_by_id = get_beats_for_update(list(form_cache))
+        rows, beat_errors = validate_beat_price_form(form_cache, beats_by_id)
+        if not beat_errors:
+            print("Salvataggio dati:", form_cache)  # DEBUG: mostra cosa viene salvato
+            _, update_error = bulk_update_beats(rows)
+            if update_error:
+                error = f"Errore durante il salvataggio: {update_error}"
+
+    beat_filters = parse_beat_filters(request.args)
+    after_id = request.args.get("after", type=int)
+    if beat_errors:
+        # La pagina riparte dai beat con errori, così restano visibili anche se caricati con lo scroll
+        after_id = min(beat_errors) - 1
+    candidate_ids = catalog_candidate_ids(beat_filters["q"]) if beat_filters.get("q") else None
+    beats_page, next_after = get_beats_page(beat_filters, after_id, BEATS_PAGE_SIZE, candidate_ids)
+    beats = [beat_to_view(beat, form_cache.get(beat.id) if beat_errors else None) for beat in beats_page]
+
+    return render_template(
+        "admin_web.html",
+        beats=beats,
+        next_after=next_after,
+        beat_filters=beat_filters,
+        filter_options=get_beat_filter_options(),
+        error=error,
+        beat_errors=beat_errors
+    )
 
-                    if (discounted_price is not None and discounted_price != '' and discounted_price > 0) and not is_discounted:
-                        error = f"Spunta 'Scontato' per applicare il prezzo scontato al beat '{beat.title}'!"
-                        error_beat_id = beat.id
-                        break
-
-                    if is_discounted and (discounted_price is None or discounted_price <= 0):
-                        error = f"Inserisci un prezzo scontato valido (> 0) per il beat '{beat.title}'!"
-                        error_beat_id = beat.id
-                        break
-
-                    if is_discounted and original_price is not None and discounted_price is not None and discounted_price > original_price:
-                        error = f"Il prezzo scontato non puÃ² essere maggiore del prezzo originale per il beat '{beat.title}'!"
-                        error_beat_id = beat.id
-                        break
-
-                    if is_discounted and discount_percent < 0:
-                        error = f"La percentuale di sconto non puÃ² essere negativa per il beat '{beat.title}'!"
-                        error_beat_id = beat.id
-                        break
-
-                    if is_discounted and discount_percent == 0:
-                        try:
-                            calc_percent = int(round(100 - (discounted_price / original_price * 100)))
-                            if calc_percent <= 0:
-                                error = f"Inserisci una percentuale di sconto valida (> 0) per il beat '{beat.title}'!"
-                                error_beat_id = beat.id
-                                break
-                            discount_percent = calc_percent
-                        except Exception:
-                            error = f"Errore nel calcolo dello sconto per il beat '{beat.title}'!"
-                            error_beat_id = beat.id
-                            break
-
-                    if discount_percent > 0 and not is_discounted:
-                        error = f"Spunta 'Scontato' per applicare lo sconto al beat '{beat.title}'!"
-                        error_beat_id = beat.id
-                        break
-
-                    if not is_discounted and beat.is_discounted:
-                        beat.price = beat.original_price
-                        beat.is_discounted = 0
-                        beat.discount_percent = 0
-                        discounted_price = ''
-                    elif not is_discounted:
-                        # Se non scontato, resetta il prezzo al prezzo originale
-                        beat.price = beat.original_price
-                        beat.is_discounted = 0
-                        beat.discount_percent = 0
-                    else:
-                        # Se scontato, aggiorna il prezzo con il prezzo scontato
-                        beat.price = discounted_price
-                        beat.is_discounted = 1
-                        beat.discount_percent = discount_percent
-
-                    beat.is_exclusive = is_exclusive
-            if not error:
-                print("Salvataggio dati:", form_cache)  # DEBUG: mostra cosa viene salvato
-                db.commit()
+@app.route("/api/beats")
+def api_beats():
+    """Pagina successiva del catalogo (after=ultimo id ricevuto), con gli stessi filtri della pagina principale"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    beat_filters = parse_beat_filters(request.args)
+    limit = min(max(request.args.get("limit", BEATS_PAGE_SIZE, type=int), 1), 200)
+    candidate_ids = catalog_candidate_ids(beat_filters["q"]) if beat_filters.get("q") else None
+    beats_page, next_after = get_beats_page(beat_filters, request.args.get("after", type=int), limit, candidate_ids)
+    beats = [beat_to_view(beat) for beat in beats_page]
+    
+    return jsonify({
+        "success": True,
+        "beats": beats,
+        "next_after": next_after,
+        # Schede già renderizzate, da accodare alla lista senza duplicare il markup lato client
+        "html": "".join(render_template("beat_card.html", beat=beat, beat_filters=beat_filters, beat_errors={})
+                        for beat in beats)
+    })
 
-        # Dopo la gestione POST, filtra i beat per ricerca se serve
-        query = db.query(Beat).order_by(Beat.id.asc())
-        search_q = request.args.get("q", "").strip()
-        if search_q:
-            query = query.filter(Beat.title.ilike(f"%{search_q}%"))
-        beats_db = query.all()
-
-        beats = []
-        for b in beats_db:
-            if request.method == "POST" and error and b.id in form_cache:
-                cached = form_cache[b.id]
-                beats.append({
-                    "id": b.id,
-                    "title": b.title,
-                    "genre": b.genre,
-                    "mood": b.mood,
-                    "price": b.price,
-                    "is_exclusive": cached["is_exclusive"],
-                    "is_discounted": cached["is_discounted"],
-                    "discount_percent": cached["discount_percent"],
-                    "original_price": cached["original_price"],
-                    "discounted_price": cached["discounted_price"],
-                })
-            else:
-                beats.append({
-                    "id": b.id,
-                    "title": b.title,
-                    "genre": b.genre,
-                    "mood": b.mood,
-                    "price": b.price,
-                    "is_exclusive": b.is_exclusive,
-                    "is_discounted": b.is_discounted,
-                    "discount_percent": b.discount_percent,
-                    "original_price": b.original_price if b.original_price is not None else b.price,
-                    "discounted_price": b.price if b.is_discounted else '',
-                })
 
-        return render_template(
-            "admin_web.html",
-            beats=beats,
-            error=error if error_beat_id is None else None,
-            error_beat_id=error_beat_id
-        )
+@app.route("/api/beats/search")
+def api_search_beats():
+    """Ricerca dei beat per titolo, genere, mood e cartella, ordinata per rilevanza"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 1000)
+    return jsonify({"success": True, "results": search_beats(request.args.get("q", ""), limit)})
 
+@app.route("/api/beats/suggest")
+def api_suggest_beats():
+    """Autocompletamento della ricerca beat: testi completi per il prefisso digitato"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    limit = min(max(request.args.get("limit", 10, type=int), 1), 50)
+    return jsonify({"success": True, "suggestions": suggest_beats(request.args.get("q", ""), limit)})
 
 @app.route("/bundles")
 def bundles():
     if not session.get("logged_in"):
         return redirect(url_for("index"))
     
-    with SessionLocal() as db:
-        bundles = db.query(Bundle).order_by(Bundle.created_at.desc()).all()
-        bundle_list = []
-        
-        for bundle in bundles:
-            # Recupera i beat del bundle con informazioni complete
-            beats = db.query(Beat).join(BundleBeat).filter(
-                BundleBeat.bundle_id == bundle.id
-            ).all()
-            
-            # Crea lista beat con informazioni estese
-            beats_info = []
-            for beat in beats:
-                beats_info.append({
-                    "id": beat.id,
-                    "title": beat.title,
-                    "price": beat.price,
-                    "original_price": beat.original_price,
-                    "is_exclusive": beat.is_exclusive,
-                    "is_discounted": beat.is_discounted,
-                    "genre": beat.genre,
-                    "mood": beat.mood
-                })
-            
-            bundle_list.append({
-                "id": bundle.id,
-                "name": bundle.name,
-                "description": bundle.description,
-                "individual_price": bundle.individual_price,
-                "bundle_price": bundle.bundle_price,
-                "discount_percent": bundle.discount_percent,
-                "is_active": bundle.is_active,
-                "created_at": bundle.created_at,
-                "image_key": bundle.image_key,
-                "beats_count": len(beats),
-                "beats": beats_info
-            })
+    return render_template("bundles.html", bundles=get_bundles_with_beats())
+
+@app.route("/api/bundles")
+def api_bundles():
+    """Elenco JSON dei bundle con i rispettivi beat"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
     
-    return render_template("bundles.html", bundles=bundle_list)
+    bundle_list = get_bundles_with_beats()
+    for bundle in bundle_list:
+        bundle["created_at"] = bundle["created_at"].isoformat() if bundle["created_at"] else None
+    return jsonify({"success": True, "bundles": bundle_list})
+
+
+# Immagini bundle: tipi ammessi e limiti comuni all'upload via server e all'upload diretto
+BUNDLE_IMAGE_PREFIX = "public/bundle_images/"
+BUNDLE_IMAGE_MAX_BYTES = int(os.environ.get("BUNDLE_IMAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+BUNDLE_IMAGE_FORM_OVERHEAD = 64 * 1024  # Margine per intestazioni e campi del form multipart
+BUNDLE_IMAGE_STREAM_CHUNK_SIZE = 256 * 1024
+BUNDLE_IMAGE_UPLOAD_URL_EXPIRES = 300  # Secondi di validità dell'URL presigned
+BUNDLE_IMAGE_CONTENT_TYPES = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+BUNDLE_IMAGE_SIGNATURES = {
+    "image/jpeg": lambda head: head.startswith(b"\xff\xd8\xff"),
+    "image/png": lambda head: head.startswith(b"\x89PNG\r\n\x1a\n"),
+    "image/gif": lambda head: head.startswith((b"GIF87a", b"GIF89a")),
+    "image/webp": lambda head: head.startswith(b"RIFF") and head[8:12] == b"WEBP",
+}
 
+def bundle_image_too_large_response():
+    return jsonify({
+        "success": False,
+        "error": f"Il file è troppo grande. Massimo {BUNDLE_IMAGE_MAX_BYTES // (1024 * 1024)}MB consentiti."
+    }), 413
 
 @app.route("/api/upload-bundle-image", methods=["POST"])
 def upload_bundle_image():
-    """API endpoint for uploading bundle images"""
+    """API endpoint for uploading bundle images.
+
+    Il file (già ricevuto da werkzeug nel suo spool) viene letto a blocchi
+    verificando firma, dimensione massima e hash senza conservarne i byte, poi
+    lo stesso stream riavvolto viene passato a put_object: nessuna copia
+    dell'immagine in memoria oltre a quella di werkzeug.
+    """
     if not session.get("logged_in"):
         return jsonify({"success": False, "error": "Non autorizzato"}), 401
     
-    if 'image' not in request.files:
+    # Rifiuta le richieste troppo grandi prima di leggerne il corpo
+    request.max_content_length = BUNDLE_IMAGE_MAX_BYTES + BUNDLE_IMAGE_FORM_OVERHEAD
+    if request.content_length is not None and request.content_length > request.max_content_length:
+        return bundle_image_too_large_response()
+    try:
+        files = request.files
+    except RequestEntityTooLarge:
+        return bundle_image_too_large_response()
+    
+    if 'image' not in files:
         return jsonify({"success": False, "error": "Nessun file ricevuto"}), 400
     
-    file = request.files['image']
+    file = files['image']
     if file.filename == '':
         return jsonify({"success": False, "error": "Nessun file selezionato"}), 400
     
-    if not file.content_type.startswith('image/'):
-        return jsonify({"success": False, "error": "Il file deve essere un'immagine"}), 400
+    content_type = (file.content_type or '').lower()
+    if content_type not in BUNDLE_IMAGE_CONTENT_TYPES:
+        return jsonify({"success": False, "error": "Il file deve essere un'immagine JPEG, PNG, WebP o GIF"}), 400
     
     # Check if R2 is properly configured
     if not all([R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_ENDPOINT_URL, R2_BUCKET_NAME]):
@@ -593,102 +1676,163 @@ def upload_bundle_image():
             "error": "Configurazione R2 mancante. Controlla le variabili d'ambiente."
         }), 500
     
-    # Check for previous image to delete (optional parameter)
+    session_id = session.get('session_id', 'unknown')
+    file_key = f"{BUNDLE_IMAGE_PREFIX}bundle_{session_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}.{BUNDLE_IMAGE_CONTENT_TYPES[content_type]}"
+    
+    s3_client = get_r2_client()
+    file_hash = hashlib.md5()
+    file_size = 0
+    stream = file.stream
+    stream.seek(0)
+    while True:
+        chunk = stream.read(BUNDLE_IMAGE_STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        if not file_size and not BUNDLE_IMAGE_SIGNATURES[content_type](chunk[:16]):
+            return jsonify({"success": False, "error": "Il file non è un'immagine valida"}), 400
+        file_size += len(chunk)
+        if file_size > BUNDLE_IMAGE_MAX_BYTES:
+            return bundle_image_too_large_response()
+        file_hash.update(chunk)
+    
+    if not file_size:
+        return jsonify({"success": False, "error": "Il file è vuoto"}), 400
+    
+    # Caricato direttamente dallo stream riavvolto; l'hash viaggia con l'oggetto come metadato
+    stream.seek(0)
+    if not upload_to_r2_direct(s3_client, stream, file_key, content_type, {"md5": file_hash.hexdigest()}):
+        print(f"Upload failed for file: {file_key}")
+        return jsonify({"success": False, "error": "Errore durante il caricamento su R2"}), 500
+    
+    print(f"Upload successful: {file_key}, size: {file_size} bytes, md5: {file_hash.hexdigest()}")
+    
+    # Check for previous image to delete (optional parameter): solo immagini bundle
     previous_image_key = request.form.get('previous_image_key', '').strip()
-    if previous_image_key:
+    if previous_image_key and previous_image_key != file_key and previous_image_key.startswith(BUNDLE_IMAGE_PREFIX):
         print(f"Deleting previous image: {previous_image_key}")
-        if delete_from_r2(previous_image_key):
+        if delete_image_with_derivatives(previous_image_key):
             print(f"Successfully deleted previous image: {previous_image_key}")
         else:
             print(f"Failed to delete previous image: {previous_image_key}")
     
-    # Read file content first
-    file.seek(0)  # Ensure we're at the beginning of the file
-    file_content = file.read()
+    # Derivati ridimensionati (thumb, card, full) generati dallo stesso stream prima della risposta:
+    # la pagina del bundle li trova già su R2
+    stream.seek(0)
+    if upload_image_derivatives(s3_client, file_key, stream) is None:
+        logging.warning(f"Derivati non generati per {file_key}: le pagine useranno l'originale")
+    
+    return jsonify({
+        "success": True,
+        "image_key": file_key,
+        "image_url": f"{os.environ.get('R2_PUBLIC_BASE_URL')}/{file_key}",
+        "content_hash": file_hash.hexdigest(),
+        "message": "Immagine caricata con successo"
+    })
+
+# Upload diretto browser → R2 delle immagini bundle con URL presigned:
+# il server firma la richiesta e verifica l'oggetto caricato, senza gestirne i byte
+
+@app.route("/api/bundle-image-upload-url", methods=["POST"])
+def bundle_image_upload_url():
+    """Restituisce un URL presigned per caricare un'immagine bundle direttamente su R2"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    content_type = (data.get('content_type') or '').strip().lower()
+    try:
+        size = int(data.get('size') or 0)
+    except (TypeError, ValueError):
+        size = 0
     
-    # Validate file content
-    if not file_content:
+    if content_type not in BUNDLE_IMAGE_CONTENT_TYPES:
+        return jsonify({"success": False, "error": "Formato immagine non supportato (JPEG, PNG, WebP o GIF)"}), 400
+    if size <= 0:
         return jsonify({"success": False, "error": "Il file è vuoto"}), 400
+    if size > BUNDLE_IMAGE_MAX_BYTES:
+        return jsonify({"success": False, "error": f"Il file è troppo grande. Massimo {BUNDLE_IMAGE_MAX_BYTES // (1024 * 1024)}MB consentiti."}), 400
+    if not all([R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_ENDPOINT_URL, R2_BUCKET_NAME]):
+        return jsonify({"success": False, "error": "Configurazione R2 mancante. Controlla le variabili d'ambiente."}), 500
+    
+    image_key = f"{BUNDLE_IMAGE_PREFIX}bundle_{session.get('session_id', 'unknown')}_{int(time.time())}_{uuid.uuid4().hex[:8]}.{BUNDLE_IMAGE_CONTENT_TYPES[content_type]}"
+    try:
+        # Content-Type e Content-Length fanno parte della firma: R2 rifiuta file di tipo o dimensione diversi
+        upload_url = get_r2_client().generate_presigned_url(
+            'put_object',
+            Params={'Bucket': R2_BUCKET_NAME, 'Key': image_key, 'ContentType': content_type, 'ContentLength': size},
+            ExpiresIn=BUNDLE_IMAGE_UPLOAD_URL_EXPIRES
+        )
+    except Exception as e:
+        logging.error(f"Errore generazione URL presigned: {str(e)}")
+        return jsonify({"success": False, "error": "Impossibile preparare il caricamento"}), 500
+    
+    # Solo le chiavi emesse per questa sessione possono essere finalizzate
+    pending_keys = [key for key in session.get('pending_bundle_images', []) if key != image_key][-4:]
+    session['pending_bundle_images'] = pending_keys + [image_key]
+    
+    return jsonify({
+        "success": True,
+        "image_key": image_key,
+        "upload_url": upload_url,
+        "method": "PUT",
+        "headers": {"Content-Type": content_type},
+        "expires_in": BUNDLE_IMAGE_UPLOAD_URL_EXPIRES
+    })
+
+@app.route("/api/finalize-bundle-image", methods=["POST"])
+def finalize_bundle_image():
+    """Verifica l'immagine caricata direttamente su R2 e ne restituisce image_key"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
     
-    print(f"File read successfully, size: {len(file_content)} bytes, filename: {file.filename}")
-    print(f"Content type: {file.content_type}")
+    data = request.get_json(silent=True) or {}
+    image_key = (data.get('image_key') or '').strip()
+    previous_image_key = (data.get('previous_image_key') or '').strip()
     
+    pending_keys = session.get('pending_bundle_images', [])
+    if not image_key.startswith(BUNDLE_IMAGE_PREFIX) or image_key not in pending_keys:
+        return jsonify({"success": False, "error": "Chiave immagine non valida"}), 400
+    
+    s3_client = get_r2_client()
     try:
-        # Generate unique filename with user session and timestamp
-        file_extension = secure_filename(file.filename).split('.')[-1].lower()
-        
-        # Use a more deterministic approach to avoid duplicates
-        # Create a hash based on file content, user session, and timestamp
-        file_hash = hashlib.md5(file_content).hexdigest()[:8]
-        timestamp = int(time.time())
-        session_id = session.get('session_id', 'unknown')
-        
-        unique_filename = f"bundle_{session_id}_{timestamp}_{file_hash}.{file_extension}"
-        file_key = f"public/bundle_images/{unique_filename}"
-        
-        # Check if file already exists (extra safety)
-        try:
-            s3_client = boto3.client(
-                's3',
-                endpoint_url=R2_ENDPOINT_URL,
-                aws_access_key_id=R2_ACCESS_KEY_ID,
-                aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-                config=Config(signature_version='s3v4'),
-                region_name='auto'
-            )
-            
-            s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=file_key)
-            # If we get here, file exists - generate a new name
-            unique_filename = f"bundle_{session_id}_{timestamp}_{file_hash}_{uuid.uuid4().hex[:4]}.{file_extension}"
-            file_key = f"public/bundle_images/{unique_filename}"
-            print(f"File already exists, using new name: {file_key}")
-        except:
-            # File doesn't exist, which is what we want
-            pass
-        
-        # Upload to R2
-        print(f"Uploading file: {file_key}, size: {len(file_content)} bytes")
-        
-        upload_success = False
+        head = s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=image_key)
+    except Exception:
+        return jsonify({"success": False, "error": "Immagine non trovata su R2: caricamento non completato"}), 404
+    
+    # Verifica dimensione, tipo dichiarato e firma dei primi byte del file
+    content_type = (head.get('ContentType') or '').lower()
+    error = None
+    if content_type not in BUNDLE_IMAGE_CONTENT_TYPES or not image_key.endswith(f".{BUNDLE_IMAGE_CONTENT_TYPES[content_type]}"):
+        error = "Formato immagine non valido"
+    elif not 0 < head.get('ContentLength', 0) <= BUNDLE_IMAGE_MAX_BYTES:
+        error = "Dimensione immagine non valida"
+    else:
         try:
-            upload_success = upload_to_r2(file_content, file_key)
-            
-            if upload_success:
-                # Generate public URL
-                public_url = f"{os.environ.get('R2_PUBLIC_BASE_URL')}/{file_key}"
-                
-                print(f"Upload successful! Public URL: {public_url}")
-                
-                return jsonify({
-                    "success": True,
-                    "image_key": file_key,
-                    "image_url": public_url,
-                    "message": "Immagine caricata con successo"
-                })
-            else:
-                print(f"Upload failed for file: {file_key}")
-                # Tenta di pulire l'immagine in caso di fallimento parziale
-                try:
-                    delete_from_r2(file_key)
-                    print(f"Cleaned up failed upload: {file_key}")
-                except Exception as cleanup_error:
-                    print(f"Could not clean up failed upload: {cleanup_error}")
-                
-                return jsonify({"success": False, "error": "Errore durante il caricamento su R2"}), 500
-        except Exception as upload_error:
-            print(f"Upload exception for file: {file_key}, error: {upload_error}")
-            # Tenta di pulire l'immagine in caso di eccezione
-            try:
-                delete_from_r2(file_key)
-                print(f"Cleaned up failed upload after exception: {file_key}")
-            except Exception as cleanup_error:
-                print(f"Could not clean up failed upload after exception: {cleanup_error}")
-            
-            return jsonify({"success": False, "error": f"Errore durante il caricamento: {str(upload_error)}"}), 500
-            
-    except Exception as e:
-        print(f"Upload error: {e}")
-        return jsonify({"success": False, "error": f"Errore interno del server: {str(e)}"}), 500
+            first_bytes = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=image_key, Range='bytes=0-15')['Body'].read()
+        except Exception:
+            first_bytes = b''
+        if not BUNDLE_IMAGE_SIGNATURES[content_type](first_bytes):
+            error = "Il file non è un'immagine valida"
+    
+    session['pending_bundle_images'] = [key for key in pending_keys if key != image_key]
+    if error:
+        delete_from_r2(image_key)
+        return jsonify({"success": False, "error": error}), 400
+    
+    if previous_image_key and previous_image_key != image_key and previous_image_key.startswith(BUNDLE_IMAGE_PREFIX):
+        if not delete_image_with_derivatives(previous_image_key):
+            logging.warning(f"Impossibile eliminare l'immagine precedente: {previous_image_key}")
+    
+    # Il server non ha i byte (caricati dal browser): i derivati si generano dall'originale su R2, prima della risposta
+    if backfill_image_derivatives(s3_client, image_key) is None:
+        logging.warning(f"Derivati non generati per {image_key}: le pagine useranno l'originale")
+    
+    return jsonify({
+        "success": True,
+        "image_key": image_key,
+        "image_url": f"{os.environ.get('R2_PUBLIC_BASE_URL')}/{image_key}",
+        "message": "Immagine caricata con successo"
+    })
 
 @app.route("/bundles/create", methods=["GET", "POST"])
 def create_bundle():
@@ -744,6 +1888,7 @@ def create_bundle():
                 db.add(bundle_beat)
             
             db.commit()
+            invalidate_database_stats()
             
             flash(f"Bundle '{name}' creato con successo!", "success")
             return redirect(url_for("bundles"))
@@ -811,6 +1956,7 @@ def edit_bundle(bundle_id):
                 db.add(bundle_beat)
             
             db.commit()
+            invalidate_database_stats()
             flash(f"Bundle '{bundle.name}' aggiornato con successo!", "success")
             return redirect(url_for("bundles"))
         
@@ -843,6 +1989,7 @@ def toggle_bundle(bundle_id):
         if bundle:
             bundle.is_active = 1 - bundle.is_active  # Toggle 0/1
             db.commit()
+            invalidate_database_stats()
             status = "attivato" if bundle.is_active else "disattivato"
             flash(f"Bundle '{bundle.name}' {status}!", "success")
         else:
@@ -876,11 +2023,12 @@ def delete_bundle(bundle_id):
                 
                 # 4. Commit tutte le modifiche al database
                 db.commit()
+                invalidate_database_stats()
                 
                 # 5. Elimina l'immagine da R2 (se presente)
                 if bundle_image_key:
                     print(f"Attempting to delete image: {bundle_image_key}")
-                    if delete_from_r2(bundle_image_key):
+                    if delete_image_with_derivatives(bundle_image_key):
                         print(f"Successfully deleted image {bundle_image_key} from R2")
                     else:
                         print(f"Failed to delete image {bundle_image_key} from R2")
@@ -912,74 +2060,74 @@ def save_all_beats_api():
         if not data or 'beats' not in data:
             return jsonify({"success": False, "error": "Dati non validi"}), 400
         
-        beats_data = data['beats']
-        updated_count = 0
+        beats_data = [beat_data for beat_data in data['beats'] if beat_data.get('id')]
         errors = []
+        rows = []
         
         print(f"DEBUG: Processando {len(beats_data)} beat")  # Debug
         
-        with SessionLocal() as db:
-            for beat_data in beats_data:
-                try:
-                    beat_id = beat_data.get('id')
-                    if not beat_id:
-                        continue
-                    
-                    beat = db.query(Beat).filter(Beat.id == beat_id).first()
-                    if not beat:
-                        errors.append(f"Beat ID {beat_id} non trovato")
-                        continue
-
-                    # Aggiorna i valori del beat
-                    original_price = beat_data.get('original_price')
-                    discounted_price = beat_data.get('discounted_price')
-                    is_exclusive = beat_data.get('is_exclusive', 0)
-                    is_discounted = beat_data.get('is_discounted', 0)
-                    discount_percent = beat_data.get('discount_percent', 0)
-                    
-                    # Validazione
-                    if is_discounted and (not discounted_price or discounted_price <= 0):
-                        errors.append(f"Prezzo scontato non valido per il beat '{beat.title}'")
-                        continue
-                    
-                    if is_discounted and original_price and discounted_price > original_price:
-                        errors.append(f"Prezzo scontato maggiore del prezzo originale per il beat '{beat.title}'")
-                        continue
-                    
-                    # Aggiorna il beat
-                    if original_price is not None:
-                        beat.original_price = original_price
-                    
-                    beat.is_exclusive = is_exclusive
-                    beat.is_discounted = is_discounted
-                    beat.discount_percent = discount_percent
-                    
-                    if is_discounted and discounted_price:
-                        beat.price = discounted_price
-                    elif original_price:
-                        beat.price = original_price
-                    
-                    updated_count += 1
-                    
-                except Exception as e:
-                    errors.append(f"Errore nell'aggiornamento del beat ID {beat_data.get('id', 'sconosciuto')}: {str(e)}")
+        # Tutti i beat in un'unica query IN; la validazione raccoglie ogni errore prima di scrivere
+        beats_by_id = get_beats_for_update([beat_data['id'] for beat_data in beats_data])
+        for beat_data in beats_data:
+            try:
+                beat_id = beat_data['id']
+                beat = beats_by_id.get(beat_id)
+                if not beat:
+                    errors.append(f"Beat ID {beat_id} non trovato")
                     continue
-            
-            if errors:
-                db.rollback()
-                return jsonify({
-                    "success": False, 
-                    "error": "Errori durante l'aggiornamento", 
-                    "details": errors
-                }), 400
-            
-            db.commit()
-            print(f"DEBUG: Aggiornati {updated_count} beat con successo")  # Debug
+
+                original_price = beat_data.get('original_price')
+                discounted_price = beat_data.get('discounted_price')
+                is_exclusive = beat_data.get('is_exclusive', 0)
+                is_discounted = beat_data.get('is_discounted', 0)
+                discount_percent = beat_data.get('discount_percent', 0)
+                
+                # Validazione
+                if is_discounted and (not discounted_price or discounted_price <= 0):
+                    errors.append(f"Prezzo scontato non valido per il beat '{beat.title}'")
+                    continue
+                
+                if is_discounted and original_price and discounted_price > original_price:
+                    errors.append(f"Prezzo scontato maggiore del prezzo originale per il beat '{beat.title}'")
+                    continue
+                
+                if is_discounted and discounted_price:
+                    price = discounted_price
+                elif original_price:
+                    price = original_price
+                else:
+                    price = beat.price
+                
+                rows.append({
+                    "id": beat_id,
+                    "original_price": original_price if original_price is not None else beat.original_price,
+                    "price": price,
+                    "is_exclusive": is_exclusive,
+                    "is_discounted": is_discounted,
+                    "discount_percent": discount_percent,
+                })
+                
+            except Exception as e:
+                errors.append(f"Errore nell'aggiornamento del beat ID {beat_data.get('id', 'sconosciuto')}: {str(e)}")
+                continue
+        
+        if errors:
             return jsonify({
-                "success": True, 
-                "message": f"{updated_count} beat aggiornati con successo",
-                "updated_count": updated_count
-            })
+                "success": False, 
+                "error": "Errori durante l'aggiornamento", 
+                "details": errors
+            }), 400
+        
+        updated_count, update_error = bulk_update_beats(rows)
+        if update_error:
+            return jsonify({"success": False, "error": f"Errore interno: {update_error}"}), 500
+        
+        print(f"DEBUG: Aggiornati {updated_count} beat con successo")  # Debug
+        return jsonify({
+            "success": True, 
+            "message": f"{updated_count} beat aggiornati con successo",
+            "updated_count": updated_count
+        })
             
     except Exception as e:
         print(f"DEBUG: Errore generale: {str(e)}")  # Debug
@@ -1015,7 +2163,8 @@ def r2_status():
             "R2_ENDPOINT_URL": bool(R2_ENDPOINT_URL),
             "R2_BUCKET_NAME": bool(R2_BUCKET_NAME),
             "R2_PUBLIC_BASE_URL": bool(R2_PUBLIC_BASE_URL)
-        }
+        },
+        "pool": get_r2_pool_metrics()
     })
 
 @app.route("/admin/database", methods=["GET"])
@@ -1049,7 +2198,12 @@ def database_admin():
             logging.error(f"Errore nel recupero dei beat venduti: {sold_exclusive_beats['error']}")
             sold_exclusive_beats = []
         
-        return render_template("database_admin.html", stats=stats, sold_beats=sold_exclusive_beats)
+        return render_template(
+            "database_admin.html",
+            stats=stats,
+            sold_beats=sold_exclusive_beats,
+            active_operation_id=get_active_db_job_id()
+        )
     except Exception as e:
         logging.error(f"Errore nella dashboard database: {str(e)}")
         flash(f"Errore nel caricamento della dashboard: {str(e)}", "error")
@@ -1088,32 +2242,28 @@ def get_database_stats():
 
 @app.route("/admin/update-database", methods=["POST"])
 def update_database():
-    """Avvia l'aggiornamento database da Google Drive - versione sincrona per Railway"""
+    """Accoda l'aggiornamento database da Google Drive e restituisce subito l'operation_id"""
     if not session.get("logged_in"):
         return jsonify({"success": False, "error": "Non autorizzato"}), 401
     
     try:
-        # Genera un ID unico per questa operazione
-        import uuid
-        operation_id = str(uuid.uuid4())
+        # Modalità: "incremental" (default, usa il feed Changes di Drive) oppure "full"
+        data = request.get_json(silent=True) or {}
+        incremental = data.get('mode', 'incremental') != 'full'
         
-        # Esegui la migrazione direttamente (sincrona)
-        success, result_message = run_database_migration_direct(operation_id)
-        
-        if success:
-            return jsonify({
-                "success": True,
-                "operation_id": operation_id,
-                "message": "Aggiornamento completato con successo!",
-                "details": result_message
-            })
-        else:
+        operation_id = submit_database_job("update-database", incremental=incremental)
+        if not operation_id:
             return jsonify({
                 "success": False,
-                "operation_id": operation_id,
-                "error": "Errore durante l'aggiornamento",
-                "details": result_message
-            }), 500
+                "error": "Un'altra operazione sul database è già in corso",
+                "operation_id": get_active_db_job_id()
+            }), 409
+        
+        return jsonify({
+            "success": True,
+            "operation_id": operation_id,
+            "message": "Aggiornamento avviato"
+        }), 202
             
     except Exception as e:
         error_msg = f"Errore interno: {str(e)}"
@@ -1125,24 +2275,24 @@ def update_database():
 
 @app.route("/admin/reset-database", methods=["POST"])
 def reset_database():
-    """Reset database integrato - senza script esterni"""
+    """Accoda il reset del database e restituisce subito l'operation_id"""
     if not session.get("logged_in"):
         return jsonify({"success": False, "error": "Non autorizzato"}), 401
     
     try:
-        # Esegui il reset direttamente
-        success, message = reset_database_integrated()
-        
-        if success:
-            return jsonify({
-                "success": True,
-                "message": message
-            })
-        else:
+        operation_id = submit_database_job("reset-database")
+        if not operation_id:
             return jsonify({
                 "success": False,
-                "error": message
-            }), 500
+                "error": "Un'altra operazione sul database è già in corso",
+                "operation_id": get_active_db_job_id()
+            }), 409
+        
+        return jsonify({
+            "success": True,
+            "operation_id": operation_id,
+            "message": "Reset avviato"
+        }), 202
             
     except Exception as e:
         error_msg = f"Errore interno: {str(e)}"
@@ -1152,18 +2302,602 @@ def reset_database():
             "error": error_msg
         }), 500
 
-def migrate_to_r2_integrated(operation_id):
-    """Migrazione completa da Google Drive a R2 e popolamento DB integrata"""
+@app.route("/admin/operations/<operation_id>", methods=["GET"])
+def operation_status(operation_id):
+    """Stato e progresso di un'operazione in background"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    progress = get_progress(operation_id)
+    if progress['state'] == 'unknown':
+        return jsonify({"success": False, "error": "Operazione non trovata"}), 404
+    
+    return jsonify(dict(progress, success=True, operation_id=operation_id))
+
+@app.route("/admin/operations/<operation_id>/events", methods=["GET"])
+def operation_events(operation_id):
+    """Stream Server-Sent Events con il progresso reale di un'operazione"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    if get_progress(operation_id)['state'] == 'unknown':
+        return jsonify({"success": False, "error": "Operazione non trovata"}), 404
+    
+    if _sse_stream_slots is None or not _sse_stream_slots.acquire(blocking=False):
+        return jsonify({"success": False, "error": "Troppi stream attivi, usare il polling"}), 503
+    
+    def event_stream():
+        last_timestamp = None
+        last_heartbeat = time.time()
+        stream_deadline = time.time() + SSE_STREAM_MAX_SECONDS
+        while True:
+            if time.time() >= stream_deadline:
+                # Libera il thread del worker: il client riapre lo stream (anche su un altro worker)
+                yield "event: reconnect\ndata: {}\n\n"
+                return
+            progress = get_progress(operation_id)
+            if progress['timestamp'] != last_timestamp:
+                last_timestamp = progress['timestamp']
+                last_heartbeat = time.time()
+                yield f"data: {json.dumps(dict(progress, operation_id=operation_id))}\n\n"
+                if progress['state'] in JOB_FINAL_STATES or progress['state'] == 'unknown':
+                    return
+            elif time.time() - last_heartbeat >= SSE_HEARTBEAT_INTERVAL:
+                # Commento SSE per mantenere viva la connessione attraverso i proxy
+                last_heartbeat = time.time()
+                yield ": heartbeat\n\n"
+            time.sleep(SSE_POLL_INTERVAL)
+    
+    response = Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Lo slot viene liberato alla chiusura della risposta, anche se lo stream non è mai partito
+    response.call_on_close(_sse_stream_slots.release)
+    return response
+
+@app.route("/admin/operations/<operation_id>/result", methods=["GET"])
+def operation_result(operation_id):
+    """Risultato finale di un'operazione (202 finché è in corso)"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    progress = get_progress(operation_id)
+    if progress['state'] == 'unknown':
+        return jsonify({"success": False, "error": "Operazione non trovata"}), 404
+    
+    if progress['state'] not in JOB_FINAL_STATES:
+        return jsonify({
+            "success": False,
+            "operation_id": operation_id,
+            "state": progress['state'],
+            "error": "Operazione ancora in corso"
+        }), 202
+    
+    return jsonify({
+        "success": progress['state'] == 'completed',
+        "operation_id": operation_id,
+        "state": progress['state'],
+        "message": progress['status'],
+        "details": progress['details']
+    })
+
+@app.route("/admin/operations/<operation_id>/cancel", methods=["POST"])
+def cancel_operation(operation_id):
+    """Richiede l'annullamento di un'operazione in coda o in esecuzione"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    if not request_cancel(operation_id):
+        progress = get_progress(operation_id)
+        if progress['state'] in ('queued', 'running'):
+            return jsonify({"success": False, "error": "Questa operazione non può essere annullata"}), 409
+        return jsonify({"success": False, "error": "Operazione non trovata o già terminata"}), 404
+    
+    return jsonify({
+        "success": True,
+        "operation_id": operation_id,
+        "message": "Annullamento richiesto"
+    })
+
+def drive_file_fingerprint(drive_file):
+    """Impronta del contenuto di un file Drive: md5Checksum oppure id, data di modifica e dimensione"""
+    if drive_file.get('md5Checksum'):
+        return drive_file['md5Checksum']
+    return f"{drive_file['id']}:{drive_file.get('modifiedTime')}:{drive_file.get('size')}"
+
+def r2_object_matches_source(r2_client, key_index, r2_key, fingerprint, journal_fingerprint, raw_copy):
+    """Verifica se l'oggetto R2 corrisponde ancora al file Drive da cui è stato caricato.
+
+    L'ordine dei controlli evita I/O quando possibile: impronta registrata nel
+    journal, ETag (MD5) per le copie byte per byte caricate in un'unica parte,
+    infine i metadati dell'oggetto con una HEAD (saltata se r2_client è None).
+    Gli oggetti caricati prima dell'introduzione delle impronte, non
+    verificabili, vengono considerati attuali. Restituisce (attuale, impronta_nota).
+    """
+    if journal_fingerprint is not None:
+        return journal_fingerprint == fingerprint, True
+
+    etag = (key_index.get(r2_key) or {}).get('ETag', '').strip('"')
+    if raw_copy and etag and '-' not in etag and len(fingerprint) == 32:
+        return etag == fingerprint, True
+
+    if r2_client is None:
+        return True, False
+
     try:
-        update_progress(operation_id, 5, "Inizializzazione servizi...")
+        metadata = r2_client.head_object(Bucket=R2_BUCKET_NAME, Key=r2_key).get('Metadata', {})
+    except Exception as e:
+        logging.warning(f"⚠️ Impossibile leggere i metadati di {r2_key}: {str(e)}")
+        return True, False
+    if R2_SOURCE_METADATA_KEY in metadata:
+        return metadata[R2_SOURCE_METADATA_KEY] == fingerprint, True
+    return True, False
+
+def copy_r2_object(r2_client, source_key, target_key, content_type, metadata):
+    """Copia lato server un oggetto R2 già presente, senza scaricarlo"""
+    try:
+        acl = 'public-read' if target_key.startswith('public/') else 'private'
+        r2_client.copy_object(
+            Bucket=R2_BUCKET_NAME,
+            Key=target_key,
+            CopySource={'Bucket': R2_BUCKET_NAME, 'Key': source_key},
+            MetadataDirective='REPLACE',
+            Metadata=metadata,
+            ContentType=content_type,
+            ACL=acl
+        )
+        return True
+    except Exception as e:
+        logging.error(f"Errore copia R2 {source_key} → {target_key}: {str(e)}")
+        return False
+
+def match_beat_files(files):
+    """Associa i file di una cartella beat ai suffissi attesi e alle chiavi R2 di destinazione.
+
+    Restituisce (nome_beat, file_riconosciuti, nomi_non_corrispondenti), dove
+    file_riconosciuti è una lista di tuple (file, suffisso, cartella_r2, chiave_r2);
+    nome_beat è None se nessun file ha un nome beat valido.
+    """
+    beat_name = None
+    for file in files:
+        potential_name = extract_beat_name(file['name'])
+        if potential_name:
+            beat_name = sanitize_name(potential_name)
+            break
+
+    if not beat_name:
+        return None, [], []
+
+    matched_files = []
+    mismatched_names = []
+    for file in files:
+        file_name = file['name']
+
+        # Trova suffisso corrispondente
+        matched_suffix = None
+        for suffix in SUFFIX_MAP:
+            if file_name.lower().endswith(suffix.lower()):
+                matched_suffix = suffix
+                break
+
+        if not matched_suffix:
+            continue
+
+        # Verifica corrispondenza nome
+        if not re.match(f"^{re.escape(beat_name)}{matched_suffix}$", file_name, re.IGNORECASE):
+            mismatched_names.append(file_name)
+            continue
+
+        # Genera chiave R2 di destinazione (le preview vengono salvate in MP3)
+        target_dir = SUFFIX_MAP[matched_suffix]
+        r2_key = f"{target_dir}/{beat_name}{matched_suffix}"
+        if matched_suffix == "_spoiler.wav":
+            r2_key = f"{target_dir}/{beat_name}_spoiler.mp3"
+        matched_files.append((file, matched_suffix, target_dir, r2_key))
+
+    return beat_name, matched_files, mismatched_names
+
+def process_beat_folder(genre_name, mood_name, beat_folder, r2_client, key_index, existing_beats, journal_entry,
+                        source_index, drive_service_factory=None):
+    """Elabora una singola cartella beat (download, conversione, upload su R2).
+
+    existing_beats: {(genre, mood, folder, title): drive_folder_id} dei beat già presenti.
+
+    Eseguita dai thread del pool di migrazione con un servizio Drive proprio
+    del thread; l'inserimento nel database avviene a blocchi nel thread
+    principale. Ogni file viene trasferito solo se nuovo o cambiato rispetto a
+    quanto già su R2 (confronto delle impronte md5Checksum di Drive); gli
+    upload completati vengono registrati nel journal della migrazione, così
+    un'esecuzione interrotta riparte dai passi mancanti.
+    Restituisce una tupla (esito, dati) dove esito è 'ready' (dati del beat da
+    inserire), 'updated' (beat esistente con file sostituiti), 'skipped'
+    (nulla da fare) oppure 'failed' (beat incompleto o errore, da ritentare al
+    prossimo aggiornamento).
+    """
+    from model import record_migration_upload, set_beat_waveform_key, set_beat_drive_folder_id
+
+    journal_uploads = journal_entry.get('uploads', {})
+    sanitized_genre = sanitize_name(genre_name).lower().replace(' ', '_')
+    sanitized_mood = sanitize_name(mood_name).lower().replace(' ', '_')
+    beat_folder_name = beat_folder['name']
+    sanitized_folder = sanitize_name(beat_folder_name).lower().replace(' ', '_')
+
+    # File della cartella beat, già elencati dalla scansione batch dell'albero
+    beat_name, matched_files, mismatched_names = match_beat_files(beat_folder['files'])
+
+    if not beat_name:
+        logging.warning(f"⚠️ Nessun nome beat valido trovato in {beat_folder_name}")
+        return 'skipped', None
+
+    # Beat già presente (precaricato con un'unica query): si verificano solo i file cambiati.
+    # Una cartella rinominata non corrisponde per nome: viene trattata come nuova e
+    # l'inserimento aggiorna la riga esistente con lo stesso ID cartella di Drive
+    beat_identity = (genre_name, mood_name, beat_folder_name, beat_name)
+    beat_exists = beat_identity in existing_beats
+
+    # ID unico per il beat
+    beat_id = f"{sanitized_genre}_{sanitized_mood}_{sanitized_folder}"
+    readable_beat_name = beat_name.lower().replace(' ', '_').replace("'", "")
+    beat_id = f"{beat_id}_{readable_beat_name}"
+
+    if beat_exists:
+        logging.info(f"🔎 Beat già presente nel database, verifica modifiche: {beat_name}")
+    else:
+        logging.info(f"🎵 Processando beat: {beat_name} (ID: {beat_id})")
+
+    # Inizializza chiavi R2
+    beat_keys = {}
+    replaced_count = 0
+    waveform_created = False
+    valid_beat = True
+
+    for file_name in mismatched_names:
+        logging.warning(f"⚠️ Nome file non corrisponde: {file_name}")
+        valid_beat = False
+
+    # Processa tutti i file del beat
+    for file, matched_suffix, target_dir, r2_key in matched_files:
+        file_name = file['name']
+        key_field = MIGRATION_KEY_FIELDS[matched_suffix]
+        raw_copy = matched_suffix != "_spoiler.wav"
+        content_type = 'audio/mpeg' if not raw_copy else get_content_type_from_filename(file_name)
+
+        fingerprint = drive_file_fingerprint(file)
+        object_metadata = {R2_SOURCE_METADATA_KEY: fingerprint}
+
+        if r2_key in key_index:
+            is_current, fingerprint_known = r2_object_matches_source(
+                r2_client, key_index, r2_key, fingerprint, journal_uploads.get(r2_key), raw_copy
+            )
+            if is_current:
+                logging.info(f"⏭️ File già presente su R2: {r2_key}")
+                beat_keys[key_field] = r2_key
+                if journal_uploads.get(r2_key) != fingerprint:
+                    # Registra l'impronta così le prossime verifiche non richiedono I/O
+                    record_migration_upload(beat_folder['id'], r2_key, fingerprint)
+                    if not fingerprint_known:
+                        logging.info(f"📌 Oggetto senza impronta adottato come attuale: {r2_key}")
+                continue
+            logging.info(f"🔁 Contenuto cambiato su Drive, sostituisco: {r2_key}")
+        elif not beat_exists:
+            # Stesso contenuto già su R2 con un'altra chiave (es. beat rinominato): copia lato server
+            source_key = source_index.get((target_dir, fingerprint))
+            if not source_key and raw_copy:
+                source_key = key_index.find_by_etag(target_dir, fingerprint)
+            if source_key and source_key in key_index:
+                if copy_r2_object(r2_client, source_key, r2_key, content_type, object_metadata):
+                    logging.info(f"📋 Copiato lato server da {source_key}: {r2_key}")
+                    key_index.add(r2_key)
+                    record_migration_upload(beat_folder['id'], r2_key, fingerprint)
+                    beat_keys[key_field] = r2_key
+                    continue
+
+        # Download file: l'upload sulla stessa chiave sostituisce l'oggetto in modo atomico
+        try:
+            drive_service = get_thread_drive_service(drive_service_factory)
+
+            if matched_suffix == "_full.wav":
+                # Master: trasferimento in streaming Drive → R2 a memoria limitata
+                uploaded = stream_drive_file_to_r2(drive_service, file['id'], r2_client, r2_key, content_type, object_metadata)
+            elif matched_suffix == "_spoiler.wav":
+                # Preview: download fuori dal semaforo CPU, che limita solo la conversione FFmpeg
+                with spool_drive_file(drive_service, file['id']) as wav_file:
+                    with _cpu_semaphore:
+                        mp3_data = convert_wav_to_mp3_direct(wav_file)
+                if mp3_data:
+                    logging.info("🎵 Convertita preview in MP3")
+                    uploaded = upload_to_r2_direct(r2_client, mp3_data, r2_key, content_type, object_metadata)
+                    # Forma d'onda calcolata dall'MP3 appena convertito, accanto alla preview
+                    waveform_key = get_waveform_key(r2_key)
+                    if uploaded:
+                        if upload_waveform_peaks(r2_client, mp3_data, waveform_key, object_metadata):
+                            logging.info(f"📈 Forma d'onda caricata: {waveform_key}")
+                            waveform_created = waveform_key not in key_index
+                            key_index.add(waveform_key)
+                            beat_keys['waveform_key'] = waveform_key
+                else:
+                    logging.error("❌ Conversione preview fallita")
+                    uploaded = False
+            else:
+                file_data = download_drive_file(drive_service, file['id'])
+                uploaded = upload_to_r2_direct(r2_client, file_data, r2_key, content_type, object_metadata)
+                # Derivati ridimensionati dell'immagine (thumb, card, full), rigenerati a ogni sostituzione
+                if uploaded:
+                    derivative_keys = upload_image_derivatives(r2_client, r2_key, file_data, object_metadata)
+                    if derivative_keys:
+                        logging.info(f"🖼️ Derivati immagine caricati: {len(derivative_keys)}")
+                        for derivative_key in derivative_keys:
+                            key_index.add(derivative_key)
+
+            # Upload su R2
+            if uploaded:
+                logging.info(f"✅ Upload completato: {r2_key}")
+                if r2_key in key_index:
+                    replaced_count += 1
+                key_index.add(r2_key)
+                record_migration_upload(beat_folder['id'], r2_key, fingerprint)
+
+                # Salva chiavi per database
+                beat_keys[key_field] = r2_key
+            else:
+                valid_beat = False
+        except Exception as e:
+            logging.error(f"❌ Errore processando {file_name}: {str(e)}")
+            valid_beat = False
+
+    # Forma d'onda mancante per una preview già su R2: generata dall'MP3 esistente
+    preview_key = beat_keys.get('preview_key')
+    if preview_key and 'waveform_key' not in beat_keys:
+        waveform_key = get_waveform_key(preview_key)
+        if waveform_key in key_index:
+            beat_keys['waveform_key'] = waveform_key
+        elif backfill_waveform_peaks(r2_client, preview_key, waveform_key):
+            logging.info(f"📈 Forma d'onda generata per la preview esistente: {waveform_key}")
+            waveform_created = True
+            key_index.add(waveform_key)
+            beat_keys['waveform_key'] = waveform_key
+
+    # Derivati mancanti per un'immagine già su R2: generati dall'originale
+    image_key = beat_keys.get('image_key')
+    derivatives_created = False
+    if image_key and not all(key in key_index for key in image_derivative_keys(image_key)):
+        derivative_keys = backfill_image_derivatives(r2_client, image_key)
+        if derivative_keys:
+            logging.info(f"🖼️ Derivati generati per l'immagine esistente: {image_key}")
+            derivatives_created = True
+            for derivative_key in derivative_keys:
+                key_index.add(derivative_key)
+
+    if beat_exists:
+        if existing_beats[beat_identity] is None:
+            # Beat migrato prima che venisse registrata la cartella di Drive: la si associa ora
+            set_beat_drive_folder_id(genre_name, mood_name, beat_folder_name, beat_name, beat_folder['id'])
+        if waveform_created:
+            set_beat_waveform_key(genre_name, mood_name, beat_folder_name, beat_name, beat_keys['waveform_key'])
+        if not valid_beat:
+            return 'failed', beat_name
+        return ('updated' if replaced_count or waveform_created or derivatives_created else 'skipped'), beat_name
+
+    # Verifica completezza del beat
+    if not all(beat_keys.get(field) for field in ('file_key', 'preview_key', 'image_key')):
+        logging.warning(f"⚠️ Beat incompleto: {beat_name}")
+        valid_beat = False
+
+    if not valid_beat:
+        return 'failed', beat_name
+
+    # Dati per l'inserimento nel database (eseguito a blocchi dal thread principale)
+    beat_data = {
+        'genre': genre_name,
+        'mood': mood_name,
+        'folder': beat_folder_name,
+        'title': beat_name,
+        'preview_key': beat_keys['preview_key'],
+        'file_key': beat_keys['file_key'],
+        'image_key': beat_keys['image_key'],
+        'waveform_key': beat_keys.get('waveform_key'),
+        'price': 19.99,
+        'original_price': None,
+        'is_exclusive': 0,
+        'is_discounted': 0,
+        'discount_percent': 0,
+        'available': 1,
+        'reserved_by_user_id': None,
+        'reserved_at': None,
+        'reservation_expires_at': None,
+        'drive_folder_id': beat_folder['id']
+    }
+
+    return 'ready', beat_data
+
+# Chiave dello stato di sincronizzazione con il page token del feed Changes di Drive
+DRIVE_CHANGES_TOKEN_KEY = "drive_changes_page_token"
+DRIVE_FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+# Numero massimo di parent per singola query "in parents" (limite pratico sulla lunghezza della query)
+DRIVE_LIST_PARENTS_PER_QUERY = 50
+DRIVE_LIST_PAGE_SIZE = 1000
+DRIVE_FILE_FIELDS = "id, name, mimeType, parents, md5Checksum, size, modifiedTime"
+
+def list_drive_children(drive_service, parent_ids, folders_only=False):
+    """Elenca i figli di più cartelle Drive con query multi-parent, seguendo tutta la paginazione.
+
+    Restituisce un dizionario {parent_id: [figli]}; il numero di chiamate è
+    proporzionale al numero di pagine, non al numero di cartelle.
+    """
+    children = {parent_id: [] for parent_id in parent_ids}
+    parent_ids = list(children)
+    
+    for offset in range(0, len(parent_ids), DRIVE_LIST_PARENTS_PER_QUERY):
+        batch = parent_ids[offset:offset + DRIVE_LIST_PARENTS_PER_QUERY]
+        parents_clause = " or ".join(f"'{parent_id}' in parents" for parent_id in batch)
+        query = f"({parents_clause}) and trashed=false"
+        if folders_only:
+            query += f" and mimeType='{DRIVE_FOLDER_MIME_TYPE}'"
+        
+        page_token = None
+        while True:
+            response = execute_drive_request(drive_service.files().list(
+                q=query,
+                fields=f"nextPageToken, files({DRIVE_FILE_FIELDS})",
+                pageSize=DRIVE_LIST_PAGE_SIZE,
+                pageToken=page_token
+            ))
+            for item in response.get('files', []):
+                for parent_id in item.get('parents') or []:
+                    if parent_id in children:
+                        children[parent_id].append(item)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+    
+    return children
+
+def attach_beat_folder_files(drive_service, beat_folders):
+    """Aggiunge a ogni cartella beat la lista 'files' con un'unica scansione batch"""
+    files_by_folder = list_drive_children(drive_service, [folder['id'] for folder in beat_folders])
+    for folder in beat_folders:
+        folder['files'] = files_by_folder.get(folder['id'], [])
+    return beat_folders
+
+def build_drive_tree(drive_service):
+    """Costruisce in memoria l'albero generi → mood → cartelle beat → file, un livello per volta"""
+    genres = list_drive_children(drive_service, [DRIVE_ROOT_FOLDER_ID], folders_only=True)[DRIVE_ROOT_FOLDER_ID]
+    logging.info(f"📊 Trovati {len(genres)} generi")
+    
+    moods_by_genre = list_drive_children(drive_service, [genre['id'] for genre in genres], folders_only=True)
+    moods = [mood for genre in genres for mood in moods_by_genre[genre['id']]]
+    
+    folders_by_mood = list_drive_children(drive_service, [mood['id'] for mood in moods], folders_only=True)
+    beat_folders = [folder for mood in moods for folder in folders_by_mood[mood['id']]]
+    attach_beat_folder_files(drive_service, beat_folders)
+    
+    tree = []
+    for genre in genres:
+        genre_moods = []
+        for mood in moods_by_genre[genre['id']]:
+            mood_folders = sorted(folders_by_mood[mood['id']], key=lambda x: x['name'].strip().lower())
+            genre_moods.append({'id': mood['id'], 'name': mood['name'], 'beat_folders': mood_folders})
+        tree.append({'id': genre['id'], 'name': genre['name'], 'moods': genre_moods})
+    
+    logging.info(f"📊 Albero Drive: {len(genres)} generi, {len(moods)} mood, {len(beat_folders)} cartelle beat")
+    return tree
+
+def list_beat_folder_jobs(drive_service):
+    """Scansione completa di Drive: restituisce le tuple (genere, mood, cartella beat) da elaborare"""
+    return [
+        (genre['name'], mood['name'], beat_folder)
+        for genre in build_drive_tree(drive_service)
+        for mood in genre['moods']
+        for beat_folder in mood['beat_folders']
+    ]
+
+def _resolve_drive_path(drive_service, file_id, metadata_cache):
+    """Risale i parent di un elemento Drive fino a DRIVE_ROOT_FOLDER_ID.
+
+    Restituisce la lista dei metadati dal livello sotto la root fino all'elemento
+    (es. [genere, mood, cartella beat]) oppure None se l'elemento non è nell'albero.
+    """
+    path = []
+    current_id = file_id
+    while current_id != DRIVE_ROOT_FOLDER_ID:
+        if len(path) > 4:
+            return None
+        if current_id not in metadata_cache:
+            metadata_cache[current_id] = execute_drive_request(drive_service.files().get(
+                fileId=current_id,
+                fields="id, name, mimeType, parents, trashed"
+            ))
+        metadata = metadata_cache[current_id]
+        parents = metadata.get('parents') or []
+        if metadata.get('trashed') or not parents:
+            return None
+        path.insert(0, metadata)
+        current_id = parents[0]
+    return path
+
+def list_changed_beat_folder_jobs(drive_service, page_token):
+    """Elenca le sole cartelle beat toccate dal feed Changes di Drive a partire da page_token.
+
+    Restituisce None quando serve una scansione completa: token non valido o
+    modifiche a cartelle di genere/mood (rinomina, spostamento, eliminazione).
+    """
+    changes = []
+    try:
+        while page_token:
+            response = execute_drive_request(drive_service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                includeRemoved=True,
+                pageSize=1000,
+                fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, trashed))"
+            ))
+            changes.extend(response.get('changes', []))
+            page_token = response.get('nextPageToken')
+    except HttpError as e:
+        logging.warning(f"⚠️ Page token del feed Changes non valido, necessaria scansione completa: {str(e)}")
+        return None
+    
+    logging.info(f"📊 {len(changes)} modifiche su Drive dall'ultimo aggiornamento")
+    
+    metadata_cache = {}
+    beat_folders = {}
+    for change in changes:
+        changed_file = change.get('file')
+        if change.get('removed') or not changed_file:
+            # Elemento eliminato definitivamente: non è più possibile risalire alla cartella
+            logging.info(f"⏭️ Modifica ignorata, elemento rimosso: {change.get('fileId')}")
+            continue
+        
+        if changed_file.get('mimeType') == DRIVE_FOLDER_MIME_TYPE:
+            metadata_cache[changed_file['id']] = changed_file
+            path = _resolve_drive_path(drive_service, changed_file['id'], metadata_cache)
+            if path is None and DRIVE_ROOT_FOLDER_ID in (changed_file.get('parents') or []):
+                # Genere eliminato o spostato fuori dall'albero
+                return None
+            if path is not None and len(path) < 3:
+                # Genere o mood modificato: impatta tutte le cartelle sottostanti
+                return None
+            candidate_paths = [path]
+        else:
+            candidate_paths = [
+                _resolve_drive_path(drive_service, parent_id, metadata_cache)
+                for parent_id in changed_file.get('parents') or []
+            ]
+        
+        for path in candidate_paths:
+            if path is None or len(path) < 3:
+                continue
+            genre, mood, beat_folder = path[0], path[1], path[2]
+            beat_folders[beat_folder['id']] = (genre['name'], mood['name'], {'id': beat_folder['id'], 'name': beat_folder['name']})
+    
+    return sorted(
+        beat_folders.values(),
+        key=lambda job: (job[0], job[1], job[2]['name'].strip().lower())
+    )
+
+def migrate_to_r2_integrated(operation_id, incremental=False, drive_service_factory=None):
+    """Migrazione da Google Drive a R2 e popolamento DB integrata.
+
+    In modalità incrementale elabora solo le cartelle beat toccate dal feed
+    Changes di Drive dall'ultimo aggiornamento; se il page token manca o non è
+    valido esegue la scansione completa. Le cartelle fallite vengono registrate
+    nel journal e ritentate alle migrazioni successive.
+    """
+    try:
+        from model import (get_sync_value, set_sync_value, get_existing_beat_keys,
+                           bulk_insert_migrated_beats, load_migration_journal, record_migration_inserted,
+                           record_migration_failures)
         
-        # Test connessione database
-        from model import get_session, create_beat_from_migration
-        session = get_session()
+        update_progress(operation_id, 5, "Inizializzazione servizi...")
+        drive_service_factory = drive_service_factory or get_drive_service
+        _drive_rate_limiter.reset_stats()
         
         # Inizializza servizi
         update_progress(operation_id, 10, "Connessione a Google Drive...")
-        drive_service = get_drive_service()
+        drive_service = drive_service_factory()
         
         update_progress(operation_id, 15, "Connessione a Cloudflare R2...")
         r2_client = get_r2_client()
@@ -1176,214 +2910,178 @@ def migrate_to_r2_integrated(operation_id):
             raise Exception(f"Errore connessione Cloudflare R2: {str(e)}")
         
         processed_count = 0
+        updated_count = 0
         skipped_count = 0
+        failed_count = 0
+        
+        # Il token viene letto prima della scansione: le modifiche fatte durante la migrazione verranno riviste
+        new_page_token = execute_drive_request(drive_service.changes().getStartPageToken()).get('startPageToken')
+        
+        beat_jobs = None
+        if incremental:
+            update_progress(operation_id, 20, "Lettura modifiche da Google Drive...")
+            stored_page_token = get_sync_value(DRIVE_CHANGES_TOKEN_KEY)
+            if stored_page_token:
+                beat_jobs = list_changed_beat_folder_jobs(drive_service, stored_page_token)
+            if beat_jobs is None:
+                logging.info("🔁 Aggiornamento incrementale non disponibile, eseguo la scansione completa")
+        
+        # Journal dei passi già completati da migrazioni precedenti (anche interrotte)
+        journal = load_migration_journal()
+        logging.info(f"📒 Journal migrazione: {len(journal)} cartelle beat con passi registrati")
+        
+        # Cartelle fallite nelle migrazioni precedenti: ritentate anche se il feed Changes non le riporta
+        previously_failed = {folder_id: entry['failed'] for folder_id, entry in journal.items() if entry.get('failed')}
+        
+        if beat_jobs is None:
+            incremental = False
+            update_progress(operation_id, 20, "Scansione albero Google Drive...")
+            beat_jobs = list_beat_folder_jobs(drive_service)
+        else:
+            attach_beat_folder_files(drive_service, [beat_folder for _, _, beat_folder in beat_jobs])
         
-        update_progress(operation_id, 20, "Scansione generi musicali...")
+        scheduled_ids = {beat_folder['id'] for _, _, beat_folder in beat_jobs}
+        retry_jobs = [
+            (folder['genre'], folder['mood'], {'id': folder_id, 'name': folder['name']})
+            for folder_id, folder in previously_failed.items() if folder_id not in scheduled_ids
+        ]
+        if retry_jobs:
+            logging.info(f"🔁 {len(retry_jobs)} cartelle fallite in precedenza da ritentare")
+            attach_beat_folder_files(drive_service, [beat_folder for _, _, beat_folder in retry_jobs])
+            beat_jobs = beat_jobs + retry_jobs
         
-        # Elenca tutti i generi
-        genres = drive_service.files().list(
-            q=f"'{DRIVE_ROOT_FOLDER_ID}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
-            fields="files(id, name)",
-            pageSize=1000
-        ).execute().get('files', [])
+        # Inventario delle chiavi R2 esistenti: i controlli di esistenza diventano lookup in memoria
+        update_progress(operation_id, 22, "Inventario file su Cloudflare R2...")
+        key_index = R2KeyIndex(r2_client, sorted(set(SUFFIX_MAP.values())))
         
-        total_genres = len(genres)
-        logging.info(f"📊 Trovati {total_genres} generi")
+        # Beat già presenti caricati in un'unica query; l'indice univoco rende sicuri i rerun.
+        # Le migrazioni dello schema rimaste in sospeso (es. indice univoco rimandato per duplicati) vengono ritentate
+        try:
+            run_schema_migrations()
+        except Exception as e:
+            logging.warning(f"⚠️ Migrazioni dello schema in sospeso non applicate: {str(e)}")
+        existing_beats = get_existing_beat_keys()
+        pending_beats = []
+        # Esiti per cartella, registrati nel journal a fine migrazione
+        failed_folders = {}
+        completed_folder_ids = set()
+        
+        # (prefisso, impronta Drive) → chiave R2 già caricata, per copiare lato server i contenuti identici
+        source_index = {
+            (r2_key.rsplit('/', 1)[0], fingerprint): r2_key
+            for entry in journal.values()
+            for r2_key, fingerprint in entry.get('uploads', {}).items()
+        }
         
-        for genre_idx, genre in enumerate(genres):
-            genre_name = genre['name']
-            sanitized_genre = sanitize_name(genre_name).lower().replace(' ', '_')
-            
-            progress_base = 20 + (genre_idx / total_genres) * 60  # 20-80% per i generi
-            update_progress(operation_id, int(progress_base), f"Elaborazione genere: {genre_name}")
-            logging.info(f"🎵 Elaborazione genere: {genre_name}")
-            
-            # Elenca mood per questo genere
-            moods = drive_service.files().list(
-                q=f"'{genre['id']}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
-                fields="files(id, name)",
-                pageSize=1000
-            ).execute().get('files', [])
-            
-            for mood in moods:
-                mood_name = mood['name']
-                sanitized_mood = sanitize_name(mood_name).lower().replace(' ', '_')
+        def flush_pending_beats():
+            nonlocal processed_count, skipped_count, failed_count
+            if not pending_beats:
+                return
+            inserted, message = bulk_insert_migrated_beats(pending_beats)
+            if inserted is None:
+                logging.error(f"❌ Errore inserimento database di {len(pending_beats)} beat: {message}")
+                failed_count += len(pending_beats)
+                for beat_data in pending_beats:
+                    failed_folders[beat_data['drive_folder_id']] = {
+                        'genre': beat_data['genre'], 'mood': beat_data['mood'], 'name': beat_data['folder']
+                    }
+            else:
+                logging.info(f"✅ Salvati nel database: {message}")
+                processed_count += inserted
+                skipped_count += len(pending_beats) - inserted
+                record_migration_inserted([beat_data['drive_folder_id'] for beat_data in pending_beats])
+                notify_beats_changed()
+            pending_beats.clear()
+        
+        if is_cancel_requested(operation_id):
+            raise OperationCancelled("Migrazione annullata prima dell'elaborazione dei beat")
+        
+        total_jobs = len(beat_jobs)
+        logging.info(f"📊 Trovate {total_jobs} cartelle beat, elaborazione con {MIGRATION_IO_WORKERS} thread "
+                     f"(max {MIGRATION_CPU_WORKERS} conversioni in parallelo)")
+        update_progress(operation_id, 25, f"Elaborazione di {total_jobs} cartelle beat...")
+        
+        # Elabora le cartelle beat in parallelo, aggregando i risultati nel thread principale
+        cancelled = False
+        with ThreadPoolExecutor(max_workers=MIGRATION_IO_WORKERS, thread_name_prefix="migration") as executor:
+            futures = {
+                executor.submit(process_beat_folder, genre_name, mood_name, beat_folder, r2_client, key_index, existing_beats,
+                                journal.get(beat_folder['id'], {}), source_index, drive_service_factory): (genre_name, mood_name, beat_folder)
+                for genre_name, mood_name, beat_folder in beat_jobs
+            }
+            for completed, future in enumerate(as_completed(futures), start=1):
+                genre_name, mood_name, beat_folder = futures[future]
+                folder_name = beat_folder['name']
+                if future.cancelled():
+                    continue
+                try:
+                    outcome, payload = future.result()
+                except Exception as e:
+                    logging.error(f"❌ Errore elaborando la cartella {folder_name}: {str(e)}")
+                    outcome = 'failed'
                 
-                # Elenca beat folders per questo mood
-                beat_folders = drive_service.files().list(
-                    q=f"'{mood['id']}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
-                    fields="files(id, name)",
-                    pageSize=1000
-                ).execute().get('files', [])
+                if outcome == 'ready':
+                    pending_beats.append(payload)
+                    if len(pending_beats) >= MIGRATION_INSERT_BATCH_SIZE:
+                        flush_pending_beats()
+                elif outcome == 'updated':
+                    updated_count += 1
+                elif outcome == 'failed':
+                    failed_count += 1
+                else:
+                    skipped_count += 1
                 
-                beat_folders = sorted(beat_folders, key=lambda x: x['name'].strip().lower())
+                if outcome == 'failed':
+                    failed_folders[beat_folder['id']] = {'genre': genre_name, 'mood': mood_name, 'name': folder_name}
+                else:
+                    completed_folder_ids.add(beat_folder['id'])
                 
-                for beat_folder in beat_folders:
-                    beat_folder_name = beat_folder['name']
-                    sanitized_folder = sanitize_name(beat_folder_name).lower().replace(' ', '_')
-                    
-                    # Elenca file nella cartella beat
-                    files = drive_service.files().list(
-                        q=f"'{beat_folder['id']}' in parents and trashed=false",
-                        fields="files(id, name)",
-                        pageSize=10
-                    ).execute().get('files', [])
-                    
-                    # Trova nome beat
-                    beat_name = None
-                    for file in files:
-                        potential_name = extract_beat_name(file['name'])
-                        if potential_name:
-                            beat_name = sanitize_name(potential_name)
-                            break
-
-                    if not beat_name:
-                        logging.warning(f"⚠️ Nessun nome beat valido trovato in {beat_folder_name}")
-                        skipped_count += 1
-                        continue
-
-                    # Controlla se il beat esiste già
-                    existing_beat = session.query(Beat).filter_by(
-                        genre=genre_name,
-                        mood=mood_name,
-                        folder=beat_folder_name,
-                        title=beat_name
-                    ).first()
-                    if existing_beat:
-                        logging.info(f"⏭️ Beat già presente nel database: {beat_name}")
-                        skipped_count += 1
-                        continue
-
-                    # ID unico per il beat
-                    beat_id = f"{sanitized_genre}_{sanitized_mood}_{sanitized_folder}"
-                    readable_beat_name = beat_name.lower().replace(' ', '_').replace("'", "")
-                    beat_id = f"{beat_id}_{readable_beat_name}"
-                    
-                    logging.info(f"🎵 Processando beat: {beat_name} (ID: {beat_id})")
-                    
-                    # Inizializza chiavi R2
-                    preview_key = None
-                    file_key = None
-                    image_key = None
-                    valid_beat = True
-                    
-                    # Processa tutti i file del beat
-                    for file in files:
-                        file_name = file['name']
-                        
-                        # Trova suffisso corrispondente
-                        matched_suffix = None
-                        for suffix in SUFFIX_MAP:
-                            if file_name.lower().endswith(suffix.lower()):
-                                matched_suffix = suffix
-                                break
-                        
-                        if not matched_suffix:
-                            continue
-                        
-                        # Verifica corrispondenza nome
-                        if not re.match(f"^{re.escape(beat_name)}{matched_suffix}$", file_name, re.IGNORECASE):
-                            logging.warning(f"⚠️ Nome file non corrisponde: {file_name}")
-                            valid_beat = False
-                            continue
-                        
-                        # Genera chiave R2
-                        target_dir = SUFFIX_MAP[matched_suffix]
-                        r2_key = f"{target_dir}/{beat_name}{matched_suffix}"
-
-                        # Controlla se esiste già su R2
-                        if r2_key_exists_check(r2_client, r2_key):
-                            logging.info(f"⏭️ File già presente su R2: {r2_key}")
-                            # Salva chiave anche se già presente
-                            if matched_suffix == "_full.wav":
-                                file_key = f"{target_dir}/{beat_name}_full.wav"
-                            elif matched_suffix == "_spoiler.wav":
-                                preview_key = f"{target_dir}/{beat_name}_spoiler.mp3"
-                            elif matched_suffix in ["_pic.jpg", "_pic.jpeg"]:
-                                image_key = f"{target_dir}/{beat_name}{matched_suffix}"
-                            continue
-                        
-                        # Download file
-                        try:
-                            file_data = download_drive_file(drive_service, file['id'])
-                            content_type = get_content_type_from_filename(file_name)
-                            
-                            # Conversione MP3 per preview
-                            if matched_suffix == "_spoiler.wav":
-                                mp3_data = convert_wav_to_mp3_direct(file_data)
-                                if mp3_data:
-                                    r2_key = f"{target_dir}/{beat_name}_spoiler.mp3"
-                                    content_type = 'audio/mpeg'
-                                    file_data = mp3_data
-                                    logging.info("🎵 Convertita preview in MP3")
-                                else:
-                                    logging.error("❌ Conversione preview fallita")
-                            
-                            # Upload su R2
-                            if upload_to_r2_direct(r2_client, file_data, r2_key, content_type):
-                                logging.info(f"✅ Upload completato: {r2_key}")
-                                
-                                # Salva chiavi per database
-                                if matched_suffix == "_full.wav":
-                                    file_key = f"{target_dir}/{beat_name}_full.wav"
-                                elif matched_suffix == "_spoiler.wav":
-                                    preview_key = f"{target_dir}/{beat_name}_spoiler.mp3"
-                                elif matched_suffix in ["_pic.jpg", "_pic.jpeg"]:
-                                    image_key = f"{target_dir}/{beat_name}{matched_suffix}"
-                            else:
-                                valid_beat = False
-                        except Exception as e:
-                            logging.error(f"❌ Errore processando {file_name}: {str(e)}")
-                            valid_beat = False
-                    
-                    # Verifica completezza del beat
-                    if not file_key or not preview_key or not image_key:
-                        logging.warning(f"⚠️ Beat incompleto: {beat_name}")
-                        valid_beat = False
-                    
-                    if not valid_beat:
-                        skipped_count += 1
-                    else:
-                        # Inserisci nel database
-                        beat_data = {
-                            'genre': genre_name,
-                            'mood': mood_name,
-                            'folder': beat_folder_name,
-                            'title': beat_name,
-                            'preview_key': preview_key,
-                            'file_key': file_key,
-                            'image_key': image_key,
-                            'price': 19.99,
-                            'original_price': None,
-                            'is_exclusive': 0,
-                            'is_discounted': 0,
-                            'discount_percent': 0,
-                            'available': 1,
-                            'reserved_by_user_id': None,
-                            'reserved_at': None,
-                            'reservation_expires_at': None
-                        }
-                        
-                        success, message = create_beat_from_migration(beat_data)
-                        if success:
-                            processed_count += 1
-                            logging.info(f"✅ Beat inserito nel database: {beat_name}")
-                        else:
-                            logging.error(f"❌ Errore inserimento database: {beat_name} - {message}")
-                            skipped_count += 1
-        
-        session.close()
+                progress = 25 + (completed / total_jobs) * 60  # 25-85% per le cartelle beat
+                update_progress(operation_id, int(progress), f"Elaborate {completed}/{total_jobs} cartelle beat")
+                
+                # Annullamento: le cartelle non ancora avviate vengono scartate, quelle in corso terminano
+                if is_cancel_requested(operation_id) and not cancelled:
+                    cancelled = True
+                    logging.warning("🛑 Annullamento richiesto, attendo le cartelle già in elaborazione...")
+                    for pending_future in futures:
+                        pending_future.cancel()
+        
+        # Inserisci gli ultimi beat rimasti in coda
+        flush_pending_beats()
+        
+        # Le cartelle fallite restano nel journal fino a un'elaborazione riuscita
+        record_migration_failures(failed_folders, completed_folder_ids & set(previously_failed))
+        
+        if cancelled:
+            result_message = (f"Migrazione annullata: beat processati {processed_count}, aggiornati {updated_count}, "
+                              f"saltati {skipped_count + failed_count}, "
+                              f"non elaborati {total_jobs - processed_count - updated_count - skipped_count - failed_count}. "
+                              f"{_drive_rate_limiter.summary()}")
+            logging.warning(f"🛑 {result_message}")
+            raise OperationCancelled(result_message)
         
         # Risultati finali
         update_progress(operation_id, 90, "Finalizzazione...")
-        total_beats = processed_count + skipped_count
+        
+        # Il token avanza sempre: le cartelle fallite sono registrate nel journal e ritentate al prossimo aggiornamento
+        set_sync_value(DRIVE_CHANGES_TOKEN_KEY, new_page_token)
+        if failed_folders:
+            logging.warning(f"⚠️ {len(failed_folders)} cartelle non elaborate: verranno ritentate al prossimo aggiornamento")
+        
+        total_beats = processed_count + updated_count + skipped_count + failed_count
         
         if total_beats == 0:
+            if incremental:
+                result_message = "Nessuna modifica su Google Drive dall'ultimo aggiornamento"
+                update_progress(operation_id, 100, "Migrazione completata!", result_message)
+                return True, result_message
             update_progress(operation_id, 100, "Errore: Nessun beat trovato", "")
             return False, "Nessun beat trovato nella struttura Google Drive"
         
-        success_rate = (processed_count/total_beats)*100 if total_beats > 0 else 0
-        result_message = f"Beat processati: {processed_count}, saltati: {skipped_count}, successo: {success_rate:.1f}%"
+        success_rate = ((processed_count + updated_count)/total_beats)*100 if total_beats > 0 else 0
+        sync_mode = "incrementale" if incremental else "completa"
+        result_message = (f"Beat processati: {processed_count}, aggiornati: {updated_count}, saltati: {skipped_count + failed_count}, "
+                          f"successo: {success_rate:.1f}% (scansione {sync_mode}). {_drive_rate_limiter.summary()}")
         
         update_progress(operation_id, 100, "Migrazione completata!", result_message)
         logging.info("="*60)
@@ -1393,12 +3091,297 @@ def migrate_to_r2_integrated(operation_id):
         
         return True, result_message
         
+    except OperationCancelled:
+        raise
     except Exception as e:
         error_msg = f"Errore durante la migrazione: {str(e)}"
         logging.error(f"❌ {error_msg}")
         update_progress(operation_id, 100, "Errore migrazione", error_msg)
         return False, error_msg
 
+# Stime per il piano di migrazione (dry run)
+MIGRATION_ESTIMATED_BYTES_PER_SECOND = float(os.environ.get("MIGRATION_ESTIMATED_BYTES_PER_SECOND", str(10 * 1024 * 1024)))
+MIGRATION_ESTIMATED_TRANSCODE_SECONDS = float(os.environ.get("MIGRATION_ESTIMATED_TRANSCODE_SECONDS", "5"))  # Per preview
+# Il piano viene calcolato da un job in background, solo su richiesta, e salvato su file
+# condiviso da tutti i worker: le pagine mostrano l'ultimo piano calcolato
+MIGRATION_PLAN_PATH = os.environ.get("MIGRATION_PLAN_PATH", os.path.join(tempfile.gettempdir(), "admin-web-migration-plan.json"))
+
+# Suffisso atteso per ciascun campo del beat, per segnalare le cartelle incomplete
+MIGRATION_REQUIRED_FILES = {"file_key": "_full.wav", "preview_key": "_spoiler.wav", "image_key": "_pic.jpg"}
+
+def plan_migration(drive_service_factory=None):
+    """Calcola cosa farebbe la migrazione senza trasferire byte (dry run).
+
+    Legge solo metadati: albero Drive (query batch), inventario delle chiavi
+    R2, beat presenti nel database e journal della migrazione. Le decisioni
+    sui file seguono quelle di process_beat_folder, senza le HEAD sugli
+    oggetti privi di impronta (considerati attuali).
+    """
+    from model import get_existing_beat_keys, load_migration_journal
+
+    drive_service = (drive_service_factory or get_drive_service)()
+    r2_client = get_r2_client()
+
+    beat_jobs = list_beat_folder_jobs(drive_service)
+    key_index = R2KeyIndex(r2_client, sorted(set(SUFFIX_MAP.values())))
+    existing_beats = get_existing_beat_keys()
+    journal = load_migration_journal()
+
+    plan = {
+        'beat_folders': len(beat_jobs),
+        'beats_to_insert': [],
+        'uploads': [],
+        'transcodes': [],
+        'incomplete_folders': [],
+        'name_mismatches': [],
+        'up_to_date': 0,
+    }
+
+    for genre_name, mood_name, beat_folder in beat_jobs:
+        folder_path = f"{genre_name}/{mood_name}/{beat_folder['name']}"
+        beat_name, matched_files, mismatched_names = match_beat_files(beat_folder['files'])
+        if not beat_name:
+            plan['incomplete_folders'].append({'path': folder_path, 'reason': "Nessun nome beat valido"})
+            continue
+
+        for file_name in mismatched_names:
+            plan['name_mismatches'].append({'path': folder_path, 'file': file_name, 'beat': beat_name})
+
+        journal_uploads = journal.get(beat_folder['id'], {}).get('uploads', {})
+        key_fields = set()
+        folder_changes = 0
+        for file, matched_suffix, target_dir, r2_key in matched_files:
+            key_fields.add(MIGRATION_KEY_FIELDS[matched_suffix])
+            raw_copy = matched_suffix != "_spoiler.wav"
+            replace = r2_key in key_index
+            if replace:
+                is_current, _ = r2_object_matches_source(
+                    None, key_index, r2_key, drive_file_fingerprint(file), journal_uploads.get(r2_key), raw_copy
+                )
+                if is_current:
+                    continue
+            folder_changes += 1
+            step = {'r2_key': r2_key, 'bytes': int(file.get('size') or 0), 'replace': replace}
+            plan['uploads' if raw_copy else 'transcodes'].append(step)
+
+        missing = [suffix for field, suffix in MIGRATION_REQUIRED_FILES.items() if field not in key_fields]
+        beat_exists = (genre_name, mood_name, beat_folder['name'], beat_name) in existing_beats
+        if not beat_exists:
+            if missing:
+                plan['incomplete_folders'].append({'path': folder_path, 'reason': f"File mancanti: {', '.join(missing)}"})
+            elif not mismatched_names:
+                plan['beats_to_insert'].append({'path': folder_path, 'title': beat_name})
+        elif not folder_changes:
+            plan['up_to_date'] += 1
+
+    # Byte da scaricare da Drive (per le preview il WAV sorgente, l'MP3 caricato è molto più piccolo)
+    bytes_to_transfer = sum(step['bytes'] for step in plan['uploads'] + plan['transcodes'])
+    transfer_seconds = bytes_to_transfer / MIGRATION_ESTIMATED_BYTES_PER_SECOND
+    transcode_seconds = len(plan['transcodes']) * MIGRATION_ESTIMATED_TRANSCODE_SECONDS / MIGRATION_CPU_WORKERS
+    plan['counts'] = {
+        'beats_to_insert': len(plan['beats_to_insert']),
+        'uploads': len(plan['uploads']),
+        'transcodes': len(plan['transcodes']),
+        'replacements': sum(1 for step in plan['uploads'] + plan['transcodes'] if step['replace']),
+        'incomplete_folders': len(plan['incomplete_folders']),
+        'name_mismatches': len(plan['name_mismatches']),
+    }
+    plan['bytes_to_transfer'] = bytes_to_transfer
+    plan['estimated_seconds'] = round(max(transfer_seconds, transcode_seconds))
+    plan['r2_objects'] = len(key_index)
+    plan['generated_at'] = datetime.now(timezone.utc).isoformat()
+    return plan
+
+def save_migration_plan(plan):
+    """Salva il piano calcolato (scrittura atomica: i worker non leggono mai un file a metà)"""
+    temporary_path = f"{MIGRATION_PLAN_PATH}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as plan_file:
+        json.dump(plan, plan_file)
+    os.replace(temporary_path, MIGRATION_PLAN_PATH)
+
+def load_migration_plan():
+    """Ultimo piano calcolato, o None se manca (mai calcolato o invalidato)"""
+    try:
+        with open(MIGRATION_PLAN_PATH, 'r', encoding='utf-8') as plan_file:
+            return json.load(plan_file)
+    except (OSError, ValueError):
+        return None
+
+def invalidate_migration_plan():
+    """Scarta il piano salvato (dopo una migrazione, un reset o una pulizia dello storage)"""
+    try:
+        os.remove(MIGRATION_PLAN_PATH)
+    except FileNotFoundError:
+        pass
+
+@database_job("migration-plan", lock=_migration_plan_lock)
+def run_migration_plan_job(operation_id):
+    """Job di calcolo del piano di migrazione"""
+    update_progress(operation_id, 10, "Calcolo del piano di migrazione...")
+    plan = plan_migration()
+    save_migration_plan(plan)
+    counts = plan['counts']
+    return True, (f"Piano calcolato: {counts['beats_to_insert']} beat da inserire, "
+                  f"{counts['uploads'] + counts['transcodes']} file da trasferire")
+
+@app.route("/admin/migration-plan", methods=["GET"])
+def migration_plan():
+    """Dry run della migrazione: ultimo piano calcolato (missing se non ce n'è uno).
+
+    Se un ricalcolo è in corso la risposta include il suo operation_id.
+    """
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    try:
+        plan = load_migration_plan()
+        operation_id = _migration_plan_lock.active_operation_id()
+        if plan is None:
+            return jsonify({"success": True, "missing": True, "operation_id": operation_id})
+        return jsonify(dict(plan, success=True, operation_id=operation_id))
+    except Exception as e:
+        logging.error(f"❌ Errore lettura piano di migrazione: {str(e)}")
+        return jsonify({"success": False, "error": f"Errore lettura piano: {str(e)}"}), 500
+
+@app.route("/admin/migration-plan", methods=["POST"])
+def refresh_migration_plan():
+    """Accoda il ricalcolo del piano di migrazione (o restituisce quello già in corso)"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    try:
+        operation_id = submit_database_job("migration-plan") or _migration_plan_lock.active_operation_id()
+        if not operation_id:
+            return jsonify({"success": False, "error": "Ricalcolo del piano non disponibile, riprovare"}), 409
+        return jsonify({"success": True, "operation_id": operation_id, "message": "Calcolo del piano avviato"}), 202
+    except Exception as e:
+        logging.error(f"❌ Errore avvio calcolo piano di migrazione: {str(e)}")
+        return jsonify({"success": False, "error": f"Errore calcolo piano: {str(e)}"}), 500
+
+# Riconciliazione dello storage R2 con il database
+R2_RECONCILE_PREFIXES = tuple(sorted(set(SUFFIX_MAP.values()))) + ("public/bundle_images",)
+R2_ORPHAN_GRACE_SECONDS = int(os.environ.get("R2_ORPHAN_GRACE_SECONDS", str(7 * 24 * 3600)))  # Età minima per eliminare un orfano
+R2_DELETE_BATCH_SIZE = 1000  # Limite di chiavi per singola delete_objects
+R2_RECONCILE_REPORT_SAMPLE = 20  # Chiavi di esempio riportate nel messaggio finale
+R2_ORPHAN_DELETE_MAX_SHARE = float(os.environ.get("R2_ORPHAN_DELETE_MAX_SHARE", "0.5"))  # Quota massima di oggetti eliminabili senza force
+
+def delete_r2_keys_batched(s3_client, keys):
+    """Elimina le chiavi a blocchi di R2_DELETE_BATCH_SIZE; restituisce (eliminate, errori)"""
+    deleted = 0
+    errors = []
+    keys = list(keys)
+    for start in range(0, len(keys), R2_DELETE_BATCH_SIZE):
+        batch = keys[start:start + R2_DELETE_BATCH_SIZE]
+        try:
+            response = s3_client.delete_objects(
+                Bucket=R2_BUCKET_NAME,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+            )
+        except Exception as e:
+            errors.extend({'Key': key, 'Message': str(e)} for key in batch)
+            continue
+        batch_errors = response.get('Errors', [])
+        errors.extend(batch_errors)
+        deleted += len(batch) - len(batch_errors)
+    return deleted, errors
+
+@database_job("r2-reconcile", cancellable=True)
+def reconcile_r2_storage(operation_id, delete_orphans=False, force=False):
+    """Confronta le chiavi R2 con quelle referenziate da beats e bundles.
+
+    Gli oggetti non referenziati sono orfani: con delete_orphans vengono
+    eliminati quelli più vecchi di R2_ORPHAN_GRACE_SECONDS (i più recenti
+    possono appartenere a un bundle in creazione o a una migrazione in corso).
+    Senza force l'eliminazione viene rifiutata se il database non ha beat o
+    se gli orfani superano R2_ORPHAN_DELETE_MAX_SHARE degli oggetti elencati
+    (database vuoto o puntato altrove, non storage da ripulire).
+    Le chiavi referenziate assenti su R2 vengono riportate come mancanti.
+    """
+    from model import get_referenced_r2_keys
+
+    update_progress(operation_id, 10, "Inventario file su Cloudflare R2...")
+    r2_client = get_r2_client()
+    key_index = R2KeyIndex(r2_client, R2_RECONCILE_PREFIXES)
+
+    update_progress(operation_id, 40, "Lettura chiavi referenziate dal database...")
+    referenced = get_referenced_r2_keys()
+    # File derivati: forme d'onda accanto alle preview e versioni ridimensionate delle immagini
+    derived = set()
+    for key in referenced['preview']:
+        derived.add(get_waveform_key(key))
+    for key in referenced['image']:
+        derived.update(image_derivative_keys(key))
+    required = set().union(*referenced.values())
+    known = required | derived
+
+    orphans = sorted(key for key in key_index.keys() if key not in known)
+    missing = sorted(key for key in required if key.startswith(R2_RECONCILE_PREFIXES) and key not in key_index)
+
+    cutoff = datetime.now(timezone.utc).timestamp() - R2_ORPHAN_GRACE_SECONDS
+    expired = [key for key in orphans
+               if (key_index.get(key) or {}).get('LastModified') and key_index.get(key)['LastModified'].timestamp() < cutoff]
+    orphan_bytes = sum((key_index.get(key) or {}).get('Size', 0) for key in orphans)
+
+    for key in orphans[:R2_RECONCILE_REPORT_SAMPLE]:
+        logging.info(f"🗑️ Orfano su R2: {key}")
+    for key in missing[:R2_RECONCILE_REPORT_SAMPLE]:
+        logging.warning(f"⚠️ Mancante su R2: {key}")
+
+    summary = (f"Oggetti R2: {len(key_index)}, orfani: {len(orphans)} ({orphan_bytes / (1024 * 1024):.1f} MB, "
+               f"{len(expired)} oltre il periodo di tolleranza), mancanti: {len(missing)}")
+
+    if delete_orphans and expired:
+        # file_key è obbligatorio: nessuna chiave file significa nessun beat nel database
+        if not force and not referenced['file']:
+            return False, f"Eliminazione bloccata: il database non contiene beat. {summary}"
+        if not force and len(expired) > R2_ORPHAN_DELETE_MAX_SHARE * len(key_index):
+            return False, (f"Eliminazione bloccata: {len(expired)} orfani su {len(key_index)} oggetti "
+                           f"superano il {R2_ORPHAN_DELETE_MAX_SHARE:.0%}. {summary}")
+        if is_cancel_requested(operation_id):
+            raise OperationCancelled(f"Pulizia annullata. {summary}")
+        update_progress(operation_id, 70, f"Eliminazione di {len(expired)} orfani...")
+        deleted, errors = delete_r2_keys_batched(r2_client, expired)
+        for error in errors[:R2_RECONCILE_REPORT_SAMPLE]:
+            logging.error(f"❌ Eliminazione fallita {error.get('Key')}: {error.get('Message')}")
+        summary += f". Eliminati: {deleted}, errori: {len(errors)}"
+        if errors:
+            return False, summary
+
+    if missing:
+        summary += f". Esempi mancanti: {', '.join(missing[:5])}"
+    logging.info(f"📊 Riconciliazione R2: {summary}")
+    return True, summary
+
+@app.route("/admin/r2-reconcile", methods=["POST"])
+def r2_reconcile():
+    """Accoda la riconciliazione dello storage R2 (con eliminazione orfani se richiesta, force per superare i controlli)"""
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Non autorizzato"}), 401
+    
+    payload = request.get_json(silent=True) or {}
+    try:
+        operation_id = submit_database_job(
+            "r2-reconcile",
+            delete_orphans=bool(payload.get('delete_orphans')),
+            force=bool(payload.get('force'))
+        )
+        if not operation_id:
+            return jsonify({
+                "success": False,
+                "error": "Un'altra operazione sul database è già in corso",
+                "operation_id": get_active_db_job_id()
+            }), 409
+        
+        return jsonify({
+            "success": True,
+            "operation_id": operation_id,
+            "message": "Riconciliazione avviata"
+        }), 202
+    except Exception as e:
+        error_msg = f"Errore interno: {str(e)}"
+        logging.error(error_msg)
+        return jsonify({"success": False, "error": error_msg}), 500
+
 @app.route("/api/cleanup-bundle-image", methods=["POST"])
 def cleanup_bundle_image():
     """API endpoint per pulire immagini temporanee quando si annulla la creazione del bundle"""
@@ -1421,7 +3404,7 @@ def cleanup_bundle_image():
             return jsonify({"success": False, "error": "Chiave immagine non valida"}), 400
         
         # Elimina l'immagine da R2
-        if delete_from_r2(image_key):
+        if delete_image_with_derivatives(image_key):
             logging.info(f"Immagine temporanea eliminata: {image_key}")
             return jsonify({
                 "success": True,
@@ -1452,14 +3435,7 @@ def check_bundle_image_exists():
         
         # Verifica se l'immagine esiste su R2
         try:
-            s3_client = boto3.client(
-                's3',
-                endpoint_url=R2_ENDPOINT_URL,
-                aws_access_key_id=R2_ACCESS_KEY_ID,
-                aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-                config=Config(signature_version='s3v4'),
-                region_name='auto'
-            )
+            s3_client = get_r2_client()
             
             s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=image_key)
             return jsonify({"success": True, "exists": True})
@@ -1470,6 +3446,71 @@ def check_bundle_image_exists():
         logging.error(f"Errore durante la verifica dell'immagine: {str(e)}")
         return jsonify({"success": False, "error": f"Errore interno del server: {str(e)}"}), 500
 
+# Prefissi R2 con immagini originali di cui generare i derivati
+IMAGE_BACKFILL_PREFIXES = ("public/images", "public/bundle_images")
+IMAGE_ORIGINAL_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+@app.cli.command("backfill-image-derivatives")
+@click.option("--dry-run", is_flag=True, help="Elenca le immagini senza derivati senza generarli")
+def backfill_image_derivatives_command(dry_run):
+    """Genera i derivati mancanti delle immagini già su R2 (beat e bundle).
+
+    Uso: flask --app admin_web backfill-image-derivatives [--dry-run]
+    """
+    r2_client = get_r2_client()
+    key_index = R2KeyIndex(r2_client, IMAGE_BACKFILL_PREFIXES)
+    missing = [
+        key for key in sorted(key_index.keys())
+        if key.lower().endswith(IMAGE_ORIGINAL_EXTENSIONS) and not is_image_derivative_key(key)
+        and not all(derivative_key in key_index for derivative_key in image_derivative_keys(key))
+    ]
+    click.echo(f"🖼️ Immagini senza derivati: {len(missing)}")
+    if dry_run:
+        for key in missing:
+            click.echo(f"  {key}")
+        return
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=MIGRATION_IO_WORKERS, thread_name_prefix="image-backfill") as executor:
+        futures = {executor.submit(backfill_image_derivatives, r2_client, key): key for key in missing}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            if future.result() is None:
+                failed += 1
+                click.echo(f"❌ {futures[future]}")
+            else:
+                click.echo(f"✅ [{completed}/{len(missing)}] {futures[future]}")
+    click.echo(f"🎉 Derivati generati per {len(missing) - failed} immagini, {failed} errori")
+
+@app.cli.command("run-database-job")
+@click.argument("job_name", type=click.Choice(sorted(DATABASE_JOBS)))
+@click.argument("operation_id")
+@click.option("--kwargs", "job_kwargs", default="{}", help="Argomenti del job in JSON")
+def run_database_job_command(job_name, operation_id, job_kwargs):
+    """Esegue un'operazione sul database in un processo dedicato.
+
+    Avviato da submit_database_job, che passa il lock già acquisito tramite il
+    descrittore ADMIN_JOB_LOCK_FD; lanciato a mano acquisisce il lock da sé.
+    Uso: flask --app admin_web run-database-job update-database <operation_id> [--kwargs '{"incremental": true}']
+    """
+    lock = DATABASE_JOB_LOCKS[job_name]
+    lock_fd = os.environ.get("ADMIN_JOB_LOCK_FD")
+    if lock_fd:
+        lock.adopt(int(lock_fd))
+    elif not lock.acquire(operation_id):
+        raise click.ClickException("Un'altra operazione con lo stesso lock è già in corso")
+    else:
+        queue_operation(operation_id, job_name)
+    run_database_job(operation_id, job_name, json.loads(job_kwargs))
+    progress = get_progress(operation_id)
+    click.echo(f"{progress['status']}: {progress['details'] or ''}")
+
+# Operazioni rimaste in corso da un avvio precedente (container riavviato, processo del job terminato)
+for _job_lock in (_db_job_lock, _migration_plan_lock):
+    try:
+        fail_orphaned_operations(_job_lock)
+    except Exception as e:
+        logging.warning(f"⚠️ Impossibile verificare le operazioni interrotte: {str(e)}")
+
 if __name__ == "__main__":
     # Configurazione per Railway deployment
     port = int(os.environ.get("PORT", 5000))
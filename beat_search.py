@@ -0,0 +1,265 @@
+"""Ricerca dei beat per titolo, genere, mood e cartella, con autocompletamento.
+
+Su PostgreSQL la ricerca usa il tsvector indicizzato definito in model.py e
+l'autocompletamento i titoli che iniziano con il testo digitato (indice btree
+su lower(title)). Sugli altri database mantiene in memoria un
+indice invertito parola → beat, caricato alla prima ricerca e aggiornato in
+modo incrementale: vengono letti solo i beat con id maggiore dell'ultimo
+indicizzato, mentre le cancellazioni (numero di beat diverso dall'atteso)
+fanno ricaricare l'indice. Titolo, genere, mood e cartella identificano il
+beat e non vengono modificati dopo l'inserimento, quindi inserimenti e
+cancellazioni sono le sole modifiche da seguire. L'autocompletamento in
+memoria completa l'ultima parola digitata con le parole dell'indice.
+"""
+
+import os
+import re
+import time
+import heapq
+import logging
+import threading
+from bisect import bisect_left
+
+from sqlalchemy import select, func, desc, case
+
+from model import SessionLocal, Beat, engine, search_tokens, beat_search_tsquery, beat_search_document
+
+SEARCH_RESULTS_LIMIT = 50
+SUGGEST_RESULTS_LIMIT = 10
+# Ogni quanto l'indice in memoria verifica se i beat sono cambiati (anche da altri worker)
+SEARCH_INDEX_REFRESH_SECONDS = float(os.environ.get("SEARCH_INDEX_REFRESH_SECONDS", "5"))
+
+# Peso di una parola per campo; le corrispondenze solo per prefisso valgono meno
+SEARCH_FIELD_WEIGHTS = (("title", 3.0), ("folder", 1.5), ("genre", 1.0), ("mood", 1.0))
+SEARCH_PREFIX_FACTOR = 0.75
+SEARCH_TITLE_PREFIX_BONUS = 2.0
+
+BEAT_SEARCH_COLUMNS = (Beat.id, Beat.title, Beat.genre, Beat.mood, Beat.folder)
+
+
+class BeatSearchIndex:
+    """Indice invertito in memoria dei beat, per i database senza ricerca full-text"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}            # beat_id -> dict con id, title, genre, mood, folder
+        self._titles = {}          # beat_id -> titolo in minuscolo, per il bonus sul prefisso del titolo
+        self._postings = {}        # parola -> {beat_id: peso}
+        self._sorted_tokens = []   # parole ordinate, per la ricerca per prefisso
+        self._tokens_dirty = False
+        self._max_id = 0
+        self._checked_at = 0.0
+
+    def invalidate(self, rebuild=False):
+        """Forza la verifica dei beat alla prossima ricerca (rebuild: ricarica tutto l'indice)"""
+        with self._lock:
+            self._checked_at = 0.0
+            if rebuild:
+                self._clear()
+
+    def _clear(self):
+        self._docs = {}
+        self._titles = {}
+        self._postings = {}
+        self._sorted_tokens = []
+        self._tokens_dirty = False
+        self._max_id = 0
+
+    def _add(self, row):
+        doc = {"id": row.id, "title": row.title, "genre": row.genre, "mood": row.mood, "folder": row.folder}
+        self._docs[row.id] = doc
+        self._titles[row.id] = row.title.lower()
+        for field, weight in SEARCH_FIELD_WEIGHTS:
+            for token in search_tokens(doc[field]):
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    self._tokens_dirty = True
+                postings[row.id] = max(postings.get(row.id, 0.0), weight)
+        self._max_id = max(self._max_id, row.id)
+
+    def refresh(self):
+        """Allinea l'indice al database, al massimo una volta ogni SEARCH_INDEX_REFRESH_SECONDS"""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at and now - self._checked_at < SEARCH_INDEX_REFRESH_SECONDS:
+                return
+            self._checked_at = now
+            with SessionLocal() as session:
+                max_id, count = session.execute(select(func.max(Beat.id), func.count(Beat.id))).one()
+                if (max_id or 0) > self._max_id:
+                    for row in session.execute(select(*BEAT_SEARCH_COLUMNS).where(Beat.id > self._max_id)):
+                        self._add(row)
+                if count != len(self._docs):
+                    # Beat cancellati (o tabella ricreata): l'indice viene ricaricato
+                    self._clear()
+                    for row in session.execute(select(*BEAT_SEARCH_COLUMNS)):
+                        self._add(row)
+            if self._tokens_dirty:
+                self._sorted_tokens = sorted(self._postings)
+                self._tokens_dirty = False
+
+    def _matches(self, token):
+        """{beat_id: peso} per una parola, incluse (con peso minore) le parole che la estendono.
+
+        Il dizionario restituito può essere quello dell'indice: va trattato in sola lettura.
+        """
+        exact = self._postings.get(token)
+        position = bisect_left(self._sorted_tokens, token)
+        extensions = []
+        while position < len(self._sorted_tokens) and self._sorted_tokens[position].startswith(token):
+            if self._sorted_tokens[position] != token:
+                extensions.append(self._postings[self._sorted_tokens[position]])
+            position += 1
+        if not extensions:
+            return exact or {}
+        matches = {}
+        for postings in extensions:
+            for beat_id, weight in postings.items():
+                weight *= SEARCH_PREFIX_FACTOR
+                if weight > matches.get(beat_id, 0.0):
+                    matches[beat_id] = weight
+        if exact:
+            matches.update(exact)
+        return matches
+
+    def _scores(self, query):
+        tokens = search_tokens(query)
+        if not tokens:
+            return {}
+        # Ogni parola vale anche come prefisso (ricerca mentre si scrive), come su PostgreSQL.
+        # L'intersezione parte dalla parola più selettiva
+        token_matches = sorted((self._matches(token) for token in set(tokens)), key=len)
+        scores = token_matches[0]
+        for matches in token_matches[1:]:
+            scores = {beat_id: score + matches[beat_id] for beat_id, score in scores.items() if beat_id in matches}
+            if not scores:
+                return {}
+        return scores
+
+    def search(self, query, limit):
+        """Beat più rilevanti per la ricerca: tutte le parole devono corrispondere"""
+        self.refresh()
+        with self._lock:
+            scores = self._scores(query)
+            normalized_query = query.strip().lower()
+            titles = self._titles
+
+            def rank(item):
+                beat_id, score = item
+                if titles[beat_id].startswith(normalized_query):
+                    score += SEARCH_TITLE_PREFIX_BONUS
+                return score, -beat_id
+
+            return [dict(self._docs[beat_id]) for beat_id, _ in heapq.nlargest(limit, scores.items(), key=rank)]
+
+    def complete(self, prefix, limit):
+        """Completamenti dell'ultima parola di prefix, dai più frequenti.
+
+        Le parole precedenti restringono i completamenti a quelli presenti nei
+        beat che le contengono; ogni suggerimento è il testo digitato con
+        l'ultima parola completata.
+        """
+        words = list(re.finditer(r"\w+", prefix))
+        if not words:
+            return []
+        head = prefix[:words[-1].start()]
+        last = words[-1].group().lower()
+        self.refresh()
+        with self._lock:
+            allowed = self._scores(head) if search_tokens(head) else None
+            if allowed is not None and not allowed:
+                return []
+            candidates = []
+            position = bisect_left(self._sorted_tokens, last)
+            while position < len(self._sorted_tokens) and self._sorted_tokens[position].startswith(last):
+                token = self._sorted_tokens[position]
+                postings = self._postings[token]
+                if allowed is None:
+                    score = sum(postings.values())
+                else:
+                    score = sum(weight for beat_id, weight in postings.items() if beat_id in allowed)
+                if score:
+                    candidates.append((token, score))
+                position += 1
+        # A parità di punteggio resta l'ordine alfabetico (nlargest è stabile)
+        return [head + token for token, _ in heapq.nlargest(limit, candidates, key=lambda item: item[1])]
+
+    def matching_ids(self, query):
+        """Id (ordinati) di tutti i beat che corrispondono alla ricerca"""
+        self.refresh()
+        with self._lock:
+            return sorted(self._scores(query))
+
+
+_local_index = BeatSearchIndex()
+
+
+def uses_database_search():
+    return engine.dialect.name == "postgresql"
+
+
+def _search_database(query, limit):
+    tsquery = beat_search_tsquery(query)
+    document = beat_search_document()
+    title_prefix = case((Beat.title.istartswith(query.strip(), autoescape=True), 1), else_=0)
+    with SessionLocal() as session:
+        rows = session.execute(
+            select(*BEAT_SEARCH_COLUMNS)
+            .where(document.op("@@")(tsquery))
+            .order_by(desc(title_prefix), desc(func.ts_rank(document, tsquery)), Beat.id)
+            .limit(limit)
+        ).all()
+    return [row._asdict() for row in rows]
+
+
+def _suggest_database(prefix, limit):
+    # lower(title) LIKE 'prefisso%' usa l'indice btree ix_beats_title_lower_prefix (text_pattern_ops)
+    # anche per 1-2 caratteri, dove l'indice trigram non aiuta
+    pattern = re.sub(r"([/%_])", r"/\1", prefix.strip().lower()) + "%"
+    with SessionLocal() as session:
+        return list(session.execute(
+            select(Beat.title)
+            .where(func.lower(Beat.title).like(pattern, escape="/"))
+            .distinct()
+            .order_by(Beat.title)
+            .limit(limit)
+        ).scalars())
+
+
+def search_beats(query, limit=SEARCH_RESULTS_LIMIT):
+    """Beat che corrispondono alla ricerca, dal più rilevante: dict con id, title, genre, mood, folder"""
+    if not search_tokens(query):
+        return []
+    if uses_database_search():
+        return _search_database(query, limit)
+    return _local_index.search(query, limit)
+
+
+def suggest_beats(prefix, limit=SUGGEST_RESULTS_LIMIT):
+    """Autocompletamento del testo digitato: lista di testi completi da proporre.
+
+    Su PostgreSQL i titoli che iniziano con prefix, altrimenti prefix con
+    l'ultima parola completata dalle parole dell'indice in memoria.
+    """
+    if not search_tokens(prefix):
+        return []
+    if uses_database_search():
+        return _suggest_database(prefix, limit)
+    return _local_index.complete(prefix, limit)
+
+
+def catalog_candidate_ids(query):
+    """Id dei beat che corrispondono alla ricerca per il catalogo paginato.
+
+    None su PostgreSQL, dove la ricerca è una condizione SQL di get_beats_page.
+    """
+    if uses_database_search() or not search_tokens(query):
+        return None
+    return _local_index.matching_ids(query)
+
+
+def notify_beats_changed(rebuild=False):
+    """Da chiamare dopo inserimenti (o, con rebuild, cancellazioni) di beat in questo processo"""
+    _local_index.invalidate(rebuild)
+    logging.debug("🔎 Indice di ricerca beat da aggiornare")
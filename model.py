@@ -1,8 +1,14 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, create_engine, ForeignKey, BigInteger, DateTime
+from sqlalchemy import Column, Integer, String, Text, Float, Boolean, create_engine, ForeignKey, BigInteger, DateTime, Index, insert, select, update, inspect, text, func, literal_column, or_, case, true
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 from sqlalchemy.pool import QueuePool
 from datetime import datetime, timezone
 import os
+import re
+import json
+import time
+import uuid
+import threading
+from bisect import bisect_left
 from dotenv import load_dotenv
 
 # Carica le variabili d'ambiente dal file .env
@@ -30,6 +36,12 @@ Base = declarative_base()
 
 class Beat(Base):
     __tablename__ = "beats"
+    __table_args__ = (
+        # Identità di un beat migrato da Drive: rende idempotenti le migrazioni ripetute
+        Index("uq_beats_genre_mood_folder_title", "genre", "mood", "folder", "title", unique=True),
+        Index("ix_beats_is_exclusive", "is_exclusive"),
+        Index("ix_beats_drive_folder_id", "drive_folder_id"),
+    )
     
     id = Column(Integer, primary_key=True)
     genre = Column(String(50), nullable=False)
@@ -39,6 +51,8 @@ class Beat(Base):
     preview_key = Column(String(255), nullable=False)
     file_key = Column(String(255), nullable=False)
     image_key = Column(String(255), nullable=False)
+    waveform_key = Column(String(255), nullable=True)  # Picchi della forma d'onda della preview (JSON su R2)
+    drive_folder_id = Column(String(100), nullable=True)  # Cartella beat di Drive di origine (stabile alle rinomine)
     price = Column(Float, nullable=False, default=19.99)
     original_price = Column(Float, nullable=True)
     is_exclusive = Column(Integer, nullable=False, default=0)   # 0 = False, 1 = True
@@ -56,6 +70,10 @@ class Beat(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Beat venduti per tipo di ordine (es. esclusivi venduti nelle statistiche)
+        Index("ix_orders_order_type_beat_id", "order_type", "beat_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     transaction_id = Column(String(255), unique=True, nullable=False)
@@ -94,6 +112,10 @@ class Bundle(Base):
 class BundleBeat(Base):
     """Tabella di associazione tra bundle e beat"""
     __tablename__ = "bundle_beats"
+    __table_args__ = (
+        Index("ix_bundle_beats_bundle_id", "bundle_id"),
+        Index("ix_bundle_beats_beat_id", "beat_id"),
+    )
     
     id = Column(Integer, primary_key=True)
     bundle_id = Column(Integer, ForeignKey("bundles.id"), nullable=False)
@@ -115,33 +137,99 @@ class BundleOrder(Base):
     transaction_id = Column(String(100), nullable=True)
     created_at = Column(DateTime, nullable=True)
 
+class SyncState(Base):
+    """Stato persistente delle sincronizzazioni (es. page token del feed Changes di Drive)"""
+    __tablename__ = "sync_state"
+    
+    key = Column(String(100), primary_key=True)
+    value = Column(String(500), nullable=True)
+    updated_at = Column(DateTime, nullable=True)
+
+class MigrationJournal(Base):
+    """Journal della migrazione: passi completati per ogni cartella beat di Drive"""
+    __tablename__ = "migration_journal"
+    
+    drive_folder_id = Column(String(100), primary_key=True)
+    steps = Column(Text, nullable=False, default="{}")  # JSON: {"uploads": {chiave_r2: impronta_drive}, "inserted_at": ..., "failed": {...}}
+    updated_at = Column(DateTime, nullable=True)
+
+class SchemaMigration(Base):
+    """Versioni dello schema già applicate al database"""
+    __tablename__ = "schema_migrations"
+    
+    version = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, nullable=True)
+
 def get_session():
     """Restituisce una sessione per interagire con il database"""
     return SessionLocal()
 
-def get_database_stats():
-    """Ottiene statistiche del database"""
+# Statistiche della dashboard: cache in memoria per processo, valida finché non cambia la
+# generazione condivisa in sync_state (rinnovata da ogni scrittura, in qualunque processo)
+DATABASE_STATS_CACHE_SECONDS = int(os.environ.get("DATABASE_STATS_CACHE_SECONDS", "30"))
+DATABASE_STATS_GENERATION_KEY = "database_stats_generation"
+
+_database_stats_cache = {"stats": None, "expires_at": 0, "generation": None}
+_database_stats_lock = threading.Lock()
+
+def _count_where(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+def _query_database_stats():
+    """Tutte le statistiche in un'unica query: conteggi condizionali su beats e bundles, più i beat esclusivi venduti"""
+    beat_stats = select(
+        func.count(Beat.id).label("total_beats"),
+        _count_where(Beat.is_exclusive == 1).label("exclusive_beats"),
+    ).subquery()
+    bundle_stats = select(
+        func.count(Bundle.id).label("total_bundles"),
+        _count_where(Bundle.is_active == 1).label("active_bundles"),
+    ).subquery()
+    sold_exclusive_count = (
+        select(func.count(Order.id))
+        .join(Beat, Beat.id == Order.beat_id)
+        .where(Order.order_type == "beat", Beat.is_exclusive == 1)
+        .scalar_subquery()
+    )
+    with SessionLocal() as session:
+        row = session.execute(
+            select(beat_stats, bundle_stats, sold_exclusive_count.label("sold_exclusive_count"))
+            .select_from(beat_stats.join(bundle_stats, true()))
+        ).one()
+    return {key: int(value or 0) for key, value in row._asdict().items()}
+
+def get_database_stats(refresh=False):
+    """Ottiene statistiche del database (cache di DATABASE_STATS_CACHE_SECONDS, refresh per rileggerle).
+
+    La cache vale solo se la generazione condivisa non è cambiata: leggerla è un
+    lookup per chiave primaria, al posto della query aggregata.
+    """
     try:
-        with SessionLocal() as session:
-            total_beats = session.query(Beat).count()
-            exclusive_beats = session.query(Beat).filter(Beat.is_exclusive == 1).count()
-            total_bundles = session.query(Bundle).count()
-            active_bundles = session.query(Bundle).filter(Bundle.is_active == 1).count()
-            
-            # Conteggio beat esclusivi venduti
-            sold_exclusive_count = session.query(Order).filter(
-                Order.order_type == "beat"
-            ).join(Beat).filter(Beat.is_exclusive == 1).count()
-            
-            return {
-                "total_beats": total_beats,
-                "exclusive_beats": exclusive_beats,
-                "total_bundles": total_bundles,
-                "active_bundles": active_bundles,
-                "sold_exclusive_count": sold_exclusive_count
-            }
+        # Letta prima della query: una scrittura durante la query cambia la generazione e il risultato verrà riletto
+        generation = get_sync_value(DATABASE_STATS_GENERATION_KEY)
+        with _database_stats_lock:
+            if (not refresh and _database_stats_cache["stats"] and generation == _database_stats_cache["generation"]
+                    and time.time() < _database_stats_cache["expires_at"]):
+                return dict(_database_stats_cache["stats"])
+        stats = _query_database_stats()
     except Exception as e:
         return {"error": str(e)}
+    with _database_stats_lock:
+        _database_stats_cache["stats"] = stats
+        _database_stats_cache["generation"] = generation
+        _database_stats_cache["expires_at"] = time.time() + DATABASE_STATS_CACHE_SECONDS
+    return dict(stats)
+
+def invalidate_database_stats():
+    """Scarta le statistiche in cache in tutti i processi: da chiamare dopo ogni scrittura su beats, bundles o orders"""
+    with _database_stats_lock:
+        _database_stats_cache["stats"] = None
+    try:
+        set_sync_value(DATABASE_STATS_GENERATION_KEY, uuid.uuid4().hex)
+    except Exception as e:
+        # Gli altri processi rileggono comunque le statistiche alla scadenza della loro cache
+        print(f"Errore aggiornamento generazione statistiche: {e}")
 
 def get_exclusive_beats_sold():
     """Ottiene lista dei beat esclusivi venduti"""
@@ -167,6 +255,383 @@ def get_exclusive_beats_sold():
     except Exception as e:
         return {"error": str(e)}
 
+BUNDLE_LIST_COLUMNS = (Bundle.id, Bundle.name, Bundle.description, Bundle.individual_price, Bundle.bundle_price,
+                       Bundle.discount_percent, Bundle.is_active, Bundle.created_at, Bundle.image_key)
+BUNDLE_BEAT_COLUMNS = (Beat.id, Beat.title, Beat.price, Beat.original_price, Beat.is_exclusive,
+                       Beat.is_discounted, Beat.genre, Beat.mood)
+
+def get_bundles_with_beats():
+    """Bundle (dal più recente) con i rispettivi beat, in due query indipendenti dal numero di bundle.
+
+    Ogni bundle è un dict con le colonne di BUNDLE_LIST_COLUMNS, "beats_count"
+    calcolato in SQL e "beats" (dict con le colonne di BUNDLE_BEAT_COLUMNS).
+    """
+    beats_count = (
+        select(BundleBeat.bundle_id, func.count(BundleBeat.id).label("beats_count"))
+        .group_by(BundleBeat.bundle_id)
+        .subquery()
+    )
+    with SessionLocal() as session:
+        bundle_rows = session.execute(
+            select(*BUNDLE_LIST_COLUMNS, func.coalesce(beats_count.c.beats_count, 0).label("beats_count"))
+            .outerjoin(beats_count, beats_count.c.bundle_id == Bundle.id)
+            .order_by(Bundle.created_at.desc())
+        ).all()
+        beat_rows = session.execute(
+            select(BundleBeat.bundle_id, *BUNDLE_BEAT_COLUMNS)
+            .join(Beat, Beat.id == BundleBeat.beat_id)
+            .order_by(BundleBeat.id)
+        ).all() if bundle_rows else []
+    
+    bundles = [dict(row._asdict(), beats=[]) for row in bundle_rows]
+    bundles_by_id = {bundle["id"]: bundle for bundle in bundles}
+    for row in beat_rows:
+        beat = row._asdict()
+        bundle = bundles_by_id.get(beat.pop("bundle_id"))
+        if bundle is not None:
+            bundle["beats"].append(beat)
+    return bundles
+
+def get_sync_value(key):
+    """Legge un valore dallo stato di sincronizzazione (None se assente)"""
+    with SessionLocal() as session:
+        state = session.get(SyncState, key)
+        return state.value if state else None
+
+def set_sync_value(key, value):
+    """Salva (o rimuove, se value è None) un valore nello stato di sincronizzazione"""
+    with SessionLocal() as session:
+        state = session.get(SyncState, key)
+        if value is None:
+            if state:
+                session.delete(state)
+        elif state:
+            state.value = value
+            state.updated_at = datetime.now(timezone.utc)
+        else:
+            session.add(SyncState(key=key, value=value, updated_at=datetime.now(timezone.utc)))
+        session.commit()
+
+def set_beat_waveform_key(genre, mood, folder, title, waveform_key):
+    """Salva la chiave della forma d'onda di un beat già presente"""
+    try:
+        with engine.begin() as connection:
+            connection.execute(
+                update(Beat.__table__)
+                .where(Beat.genre == genre, Beat.mood == mood, Beat.folder == folder, Beat.title == title)
+                .values(waveform_key=waveform_key)
+            )
+        return True
+    except Exception as e:
+        print(f"Errore salvataggio forma d'onda per {title}: {e}")
+        return False
+
+# Ricerca testuale dei beat su titolo, genere, mood e cartella.
+# Su PostgreSQL il documento di ricerca è un tsvector indicizzato (GIN, vedi le
+# migrazioni): l'espressione deve restare identica a quella dell'indice.
+BEAT_SEARCH_CONFIG = "simple"
+BEAT_SEARCH_DOCUMENT_SQL = (
+    f"(setweight(to_tsvector('{BEAT_SEARCH_CONFIG}', title), 'A') || "
+    f"setweight(to_tsvector('{BEAT_SEARCH_CONFIG}', folder), 'B') || "
+    f"setweight(to_tsvector('{BEAT_SEARCH_CONFIG}', genre || ' ' || mood), 'C'))"
+)
+
+def search_tokens(text):
+    """Parole di un testo per la ricerca: minuscole, solo caratteri alfanumerici"""
+    return re.findall(r"\w+", (text or "").lower())
+
+def beat_search_tsquery(query):
+    """tsquery PostgreSQL per la ricerca: tutte le parole, ciascuna anche come prefisso (o None)"""
+    tokens = search_tokens(query)
+    if not tokens:
+        return None
+    return func.to_tsquery(BEAT_SEARCH_CONFIG, " & ".join(f"{token}:*" for token in tokens))
+
+def beat_search_document():
+    return literal_column(BEAT_SEARCH_DOCUMENT_SQL)
+
+def _beat_filter_conditions(filters, use_text_search=True):
+    """Condizioni SQL per i filtri del catalogo (vedi get_beats_page)"""
+    conditions = []
+    if filters.get("q") and use_text_search:
+        tsquery = beat_search_tsquery(filters["q"]) if engine.dialect.name == "postgresql" else None
+        if tsquery is not None:
+            # Parole (anche parziali) in qualunque campo, oppure sottostringa del titolo (indice trigram)
+            conditions.append(or_(beat_search_document().op("@@")(tsquery), Beat.title.ilike(f"%{filters['q']}%")))
+        else:
+            conditions.append(Beat.title.ilike(f"%{filters['q']}%"))
+    if filters.get("genre"):
+        conditions.append(Beat.genre == filters["genre"])
+    if filters.get("mood"):
+        conditions.append(Beat.mood == filters["mood"])
+    for name, column in (("exclusive", Beat.is_exclusive), ("discounted", Beat.is_discounted), ("available", Beat.available)):
+        if filters.get(name) is not None:
+            conditions.append(column == filters[name])
+    if filters.get("min_price") is not None:
+        conditions.append(Beat.price >= filters["min_price"])
+    if filters.get("max_price") is not None:
+        conditions.append(Beat.price <= filters["max_price"])
+    return conditions
+
+def get_beats_page(filters=None, after_id=None, limit=50, candidate_ids=None):
+    """Una pagina del catalogo beat in ordine di id, con paginazione keyset (id > after_id).
+
+    filters può contenere q (ricerca testuale), genre, mood, exclusive,
+    discounted, available (0/1), min_price e max_price. candidate_ids (lista
+    ordinata) sostituisce la ricerca SQL di q con gli id già trovati da un
+    indice di ricerca esterno. Restituisce (beat, next_after_id), dove
+    next_after_id è None se non ci sono altre pagine.
+    """
+    conditions = _beat_filter_conditions(filters or {}, use_text_search=candidate_ids is None)
+    with SessionLocal() as session:
+        if candidate_ids is None:
+            query = select(Beat).where(*conditions).order_by(Beat.id.asc()).limit(limit + 1)
+            if after_id:
+                query = query.where(Beat.id > after_id)
+            beats = session.execute(query).scalars().all()
+        else:
+            # Gli id candidati vengono verificati a blocchi, finché la pagina non è piena
+            remaining_ids = candidate_ids[bisect_left(candidate_ids, (after_id or 0) + 1):]
+            chunk_size = max(limit + 1, 500)
+            beats = []
+            for start in range(0, len(remaining_ids), chunk_size):
+                beats.extend(session.execute(
+                    select(Beat)
+                    .where(Beat.id.in_(remaining_ids[start:start + chunk_size]), *conditions)
+                    .order_by(Beat.id.asc())
+                    .limit(limit + 1 - len(beats))
+                ).scalars().all())
+                if len(beats) > limit:
+                    break
+    if len(beats) > limit:
+        return beats[:limit], beats[limit - 1].id
+    return beats, None
+
+def get_beat_filter_options():
+    """Generi e mood presenti nel catalogo, per i filtri: {"genres": [...], "moods": [...]}"""
+    with SessionLocal() as session:
+        rows = session.execute(select(Beat.genre, Beat.mood).distinct()).all()
+    return {
+        "genres": sorted({row.genre for row in rows}),
+        "moods": sorted({row.mood for row in rows}),
+    }
+
+def get_beats_for_update(beat_ids):
+    """Carica con un'unica query IN i beat da modificare: {id: riga con title, price, original_price, is_discounted}"""
+    if not beat_ids:
+        return {}
+    with SessionLocal() as session:
+        rows = session.execute(
+            select(Beat.id, Beat.title, Beat.price, Beat.original_price, Beat.is_discounted)
+            .where(Beat.id.in_(set(beat_ids)))
+        ).all()
+    return {row.id: row for row in rows}
+
+def bulk_update_beats(rows):
+    """Aggiorna i beat per chiave primaria con un UPDATE executemany in un'unica transazione.
+
+    Ogni riga è un dict con "id" e le colonne da aggiornare. Restituisce (aggiornati, errore).
+    """
+    if not rows:
+        return 0, None
+    try:
+        with SessionLocal() as session:
+            session.execute(update(Beat), rows)
+            session.commit()
+        invalidate_database_stats()
+        return len(rows), None
+    except Exception as e:
+        return 0, str(e)
+
+def get_referenced_r2_keys():
+    """Chiavi R2 referenziate dal database, per tipo: {"file", "preview", "image", "waveform"}"""
+    with SessionLocal() as session:
+        beat_rows = session.execute(select(Beat.file_key, Beat.preview_key, Beat.image_key, Beat.waveform_key)).all()
+        bundle_images = session.execute(select(Bundle.image_key).where(Bundle.image_key.isnot(None))).scalars().all()
+    return {
+        "file": {row.file_key for row in beat_rows if row.file_key},
+        "preview": {row.preview_key for row in beat_rows if row.preview_key},
+        "image": {row.image_key for row in beat_rows if row.image_key} | {key for key in bundle_images if key},
+        "waveform": {row.waveform_key for row in beat_rows if row.waveform_key},
+    }
+
+def _find_duplicate_beat(connection):
+    """Una tupla (genre, mood, folder, title) duplicata, se esiste (impedisce l'indice univoco)"""
+    return connection.execute(
+        select(Beat.genre, Beat.mood, Beat.folder, Beat.title)
+        .group_by(Beat.genre, Beat.mood, Beat.folder, Beat.title)
+        .having(func.count() > 1)
+        .limit(1)
+    ).first()
+
+def get_existing_beat_keys():
+    """Restituisce in un'unica query i beat già presenti: {(genre, mood, folder, title): drive_folder_id}"""
+    with SessionLocal() as session:
+        rows = session.execute(select(Beat.genre, Beat.mood, Beat.folder, Beat.title, Beat.drive_folder_id))
+        return {(row.genre, row.mood, row.folder, row.title): row.drive_folder_id for row in rows}
+
+def set_beat_drive_folder_id(genre, mood, folder, title, drive_folder_id):
+    """Associa un beat già presente alla sua cartella di Drive"""
+    try:
+        with engine.begin() as connection:
+            connection.execute(
+                update(Beat.__table__)
+                .where(Beat.genre == genre, Beat.mood == mood, Beat.folder == folder, Beat.title == title)
+                .values(drive_folder_id=drive_folder_id)
+            )
+        return True
+    except Exception as e:
+        print(f"Errore associazione cartella Drive per {title}: {e}")
+        return False
+
+# Colonne di un beat che derivano dalla cartella di Drive, aggiornate quando viene rinominata
+MIGRATION_SOURCE_COLUMNS = ("genre", "mood", "folder", "title", "preview_key", "file_key", "image_key", "waveform_key")
+
+def _insert_ignoring_conflicts(table):
+    """INSERT ... ON CONFLICT DO NOTHING per i dialetti che lo supportano"""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(table)
+    return dialect_insert(table).on_conflict_do_nothing()
+
+def bulk_insert_migrated_beats(beats_data):
+    """Inserisce in blocco i beat migrati in un'unica transazione.
+
+    Un beat la cui cartella di Drive è già associata a una riga (cartella o
+    beat rinominati, spostati in un altro mood) aggiorna quella riga (nomi e
+    chiavi R2, non prezzo né stato di vendita) invece di aggiungerne una
+    seconda. I beat già presenti (stessa tupla genre/mood/folder/title) vengono
+    ignorati grazie all'indice univoco. Restituisce (salvati, messaggio), dove
+    salvati conta inseriti e aggiornati; è None in caso di errore.
+    """
+    if not beats_data:
+        return 0, "Nessun beat da inserire"
+    
+    columns = [column.name for column in Beat.__table__.columns if column.name != "id"]
+    rows = [{column: beat_data.get(column) for column in columns} for beat_data in beats_data]
+    for row in rows:
+        for column in ("is_exclusive", "is_discounted", "discount_percent"):
+            if row[column] is None:
+                row[column] = 0
+        if row["available"] is None:
+            row["available"] = 1
+    
+    try:
+        with engine.begin() as connection:
+            folder_ids = {row["drive_folder_id"] for row in rows if row["drive_folder_id"]}
+            # Riga per cartella di Drive; con più righe (rinomine di prima dell'associazione) la più recente
+            beat_ids_by_folder = dict(connection.execute(
+                select(Beat.drive_folder_id, func.max(Beat.id))
+                .where(Beat.drive_folder_id.in_(folder_ids))
+                .group_by(Beat.drive_folder_id)
+            ).all()) if folder_ids else {}
+            renamed_rows = [row for row in rows if row["drive_folder_id"] in beat_ids_by_folder]
+            new_rows = [row for row in rows if row["drive_folder_id"] not in beat_ids_by_folder]
+            
+            # Il nuovo nome può essere già occupato da un altro beat: la riga non viene toccata
+            taken_identities = {
+                (row.genre, row.mood, row.folder, row.title): row.id
+                for row in connection.execute(
+                    select(Beat.id, Beat.genre, Beat.mood, Beat.folder, Beat.title)
+                    .where(Beat.title.in_({row["title"] for row in renamed_rows}))
+                )
+            } if renamed_rows else {}
+            renamed = 0
+            for row in renamed_rows:
+                beat_id = beat_ids_by_folder[row["drive_folder_id"]]
+                identity = (row["genre"], row["mood"], row["folder"], row["title"])
+                if taken_identities.get(identity, beat_id) != beat_id:
+                    print(f"Beat rinominato non aggiornato, nome già in uso: {identity}")
+                    continue
+                connection.execute(
+                    update(Beat.__table__)
+                    .where(Beat.id == beat_id)
+                    .values({column: row[column] for column in MIGRATION_SOURCE_COLUMNS})
+                )
+                renamed += 1
+            
+            inserted = 0
+            if new_rows:
+                result = connection.execute(
+                    _insert_ignoring_conflicts(Beat.__table__).returning(Beat.__table__.c.id),
+                    new_rows
+                )
+                inserted = len(result.all())
+        invalidate_database_stats()
+        return inserted + renamed, (f"{inserted} beat inseriti, {renamed} rinominati, "
+                                    f"{len(rows) - inserted - renamed} già presenti")
+    except Exception as e:
+        return None, str(e)
+
+def load_migration_journal():
+    """Carica in un'unica query il journal della migrazione: {drive_folder_id: passi}"""
+    with SessionLocal() as session:
+        return {entry.drive_folder_id: json.loads(entry.steps or "{}") for entry in session.query(MigrationJournal)}
+
+def _merge_journal_steps(session, drive_folder_id, uploads=None, inserted=False, failed=None, resolved=False):
+    entry = session.get(MigrationJournal, drive_folder_id)
+    if entry is None:
+        entry = MigrationJournal(drive_folder_id=drive_folder_id, steps="{}")
+        session.add(entry)
+    steps = json.loads(entry.steps or "{}")
+    if uploads:
+        steps.setdefault("uploads", {}).update(uploads)
+    if inserted:
+        steps["inserted_at"] = datetime.now(timezone.utc).isoformat()
+    if failed:
+        steps["failed"] = dict(failed, failed_at=datetime.now(timezone.utc).isoformat())
+    if resolved:
+        steps.pop("failed", None)
+    entry.steps = json.dumps(steps)
+    entry.updated_at = datetime.now(timezone.utc)
+
+def record_migration_upload(drive_folder_id, r2_key, source_fingerprint):
+    """Registra nel journal l'upload completato di un file di una cartella beat con l'impronta della sorgente"""
+    try:
+        with SessionLocal() as session:
+            _merge_journal_steps(session, drive_folder_id, uploads={r2_key: source_fingerprint})
+            session.commit()
+        return True
+    except Exception as e:
+        print(f"Errore scrittura journal migrazione per {drive_folder_id}: {e}")
+        return False
+
+def record_migration_inserted(drive_folder_ids):
+    """Registra nel journal, in un'unica transazione, l'inserimento a DB delle cartelle beat"""
+    try:
+        with SessionLocal() as session:
+            for drive_folder_id in drive_folder_ids:
+                _merge_journal_steps(session, drive_folder_id, inserted=True)
+            session.commit()
+        return True
+    except Exception as e:
+        print(f"Errore scrittura journal migrazione: {e}")
+        return False
+
+def record_migration_failures(failed_folders, resolved_folder_ids=()):
+    """Registra nel journal, in un'unica transazione, le cartelle beat fallite e quelle di nuovo a posto.
+
+    failed_folders: {drive_folder_id: {"genre", "mood", "name"}}, da ritentare
+    alla prossima migrazione anche se il feed Changes non le riporta.
+    """
+    if not failed_folders and not resolved_folder_ids:
+        return True
+    try:
+        with SessionLocal() as session:
+            for drive_folder_id, folder in failed_folders.items():
+                _merge_journal_steps(session, drive_folder_id, failed=folder)
+            for drive_folder_id in resolved_folder_ids:
+                if drive_folder_id not in failed_folders:
+                    _merge_journal_steps(session, drive_folder_id, resolved=True)
+            session.commit()
+        return True
+    except Exception as e:
+        print(f"Errore scrittura journal migrazione: {e}")
+        return False
+
 def create_beat_from_migration(beat_data):
     """Crea un beat dal processo di migrazione"""
     try:
@@ -191,8 +656,170 @@ def create_beat_from_migration(beat_data):
             )
             session.add(beat)
             session.commit()
-            return True, "Beat creato con successo"
+        invalidate_database_stats()
+        return True, "Beat creato con successo"
     except Exception as e:
         return False, str(e)
 
+# Migrazioni dello schema, solo in avanti
+#
+# Ogni migrazione è (versione, nome, funzione) e la funzione riceve la connessione
+# della transazione in corso. Le versioni applicate sono registrate in
+# schema_migrations e non vengono più eseguite: per modificare lo schema si
+# aggiunge una nuova voce in fondo, senza toccare le precedenti. Su un database
+# vuoto la prima migrazione crea già lo schema completo del modello, quindi le
+# successive devono essere idempotenti (checkfirst, colonne solo se mancanti).
+# Le colonne nuove vanno aggiunte nullable (o con server_default) ed
+# eventualmente valorizzate con un UPDATE nella stessa migrazione.
+
+def _add_missing_columns(connection, table):
+    """Aggiunge alla tabella le colonne del modello che non esistono ancora"""
+    existing_columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    added_columns = []
+    for column in table.columns:
+        if column.name in existing_columns:
+            continue
+        if not column.nullable and column.server_default is None:
+            raise ValueError(f"La colonna {table.name}.{column.name} non è nullable e non ha un server_default")
+        column_type = column.type.compile(dialect=connection.dialect)
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+        if column.server_default is not None:
+            ddl += f" DEFAULT {column.server_default.arg}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+        connection.execute(text(ddl))
+        added_columns.append(column.name)
+    return added_columns
+
+def _migration_create_tables(connection):
+    Base.metadata.create_all(connection, checkfirst=True)
+
+def _migration_beats_waveform_key(connection):
+    _add_missing_columns(connection, Beat.__table__)
+
+def _migration_beat_identity_index(connection):
+    # Con duplicati l'indice univoco (genre, mood, folder, title) non viene creato: la migrazione resta da applicare
+    duplicate = _find_duplicate_beat(connection)
+    if duplicate:
+        print(f"Impossibile creare l'indice univoco dei beat, duplicato esistente: {tuple(duplicate)}")
+        return False
+    for index in Beat.__table__.indexes:
+        if index.unique:
+            index.create(connection, checkfirst=True)
+
+def _migration_query_indexes(connection):
+    for table in (Beat.__table__, Order.__table__, BundleBeat.__table__):
+        for index in table.indexes:
+            if not index.unique:
+                index.create(connection, checkfirst=True)
+
+def _migration_beats_title_trigram(connection):
+    # Ricerca per sottostringa (title ILIKE '%q%'): solo PostgreSQL ha gli indici trigram
+    if connection.dialect.name != "postgresql":
+        return
+    # L'estensione può richiedere privilegi che l'utente non ha: la ricerca funziona
+    # anche senza indice, quindi si salta la migrazione (ritentata al prossimo avvio)
+    try:
+        with connection.begin_nested():
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except Exception as e:
+        print(f"Estensione pg_trgm non disponibile, indice trigram dei titoli non creato: {e}")
+        return False
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_beats_title_trgm ON beats USING gin (title gin_trgm_ops)"
+    ))
+
+def _migration_beats_search_document(connection):
+    # Documento di ricerca (titolo, cartella, genere, mood) indicizzato per la ricerca full-text
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_beats_search_document ON beats USING gin ({BEAT_SEARCH_DOCUMENT_SQL})"
+    ))
+
+def _migration_beats_title_prefix(connection):
+    # Autocompletamento (lower(title) LIKE 'prefisso%'): btree con text_pattern_ops, utile anche
+    # per prefissi di 1-2 caratteri, che non producono trigrammi
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_beats_title_lower_prefix ON beats (lower(title) text_pattern_ops)"
+    ))
+
+def _migration_beats_drive_folder_id(connection):
+    # Cartella di Drive di origine di ogni beat, per riconoscere le rinomine; i beat già
+    # migrati vengono associati tramite il journal (upload del master registrati per cartella)
+    _add_missing_columns(connection, Beat.__table__)
+    for index in Beat.__table__.indexes:
+        if index.name == "ix_beats_drive_folder_id":
+            index.create(connection, checkfirst=True)
+    for entry in connection.execute(select(MigrationJournal.drive_folder_id, MigrationJournal.steps)):
+        uploaded_keys = list(json.loads(entry.steps or "{}").get("uploads", {}))
+        if uploaded_keys:
+            connection.execute(
+                update(Beat.__table__)
+                .where(Beat.drive_folder_id.is_(None), Beat.file_key.in_(uploaded_keys))
+                .values(drive_folder_id=entry.drive_folder_id)
+            )
+
+# Migrazioni dello schema, in ordine di versione. Le versioni applicate sono un insieme,
+# non un numero crescente: una migrazione saltata dal proprio controllo (restituisce
+# False) resta da applicare e viene ritentata a ogni avvio, mentre le successive
+# procedono. Per questo una migrazione che può essere saltata non deve essere un
+# prerequisito di quelle che la seguono.
+SCHEMA_MIGRATIONS = [
+    (1, "create_tables", _migration_create_tables),
+    (2, "beats_waveform_key", _migration_beats_waveform_key),
+    (3, "beat_identity_index", _migration_beat_identity_index),
+    (4, "query_indexes", _migration_query_indexes),
+    (5, "beats_title_trigram", _migration_beats_title_trigram),
+    (6, "beats_search_document", _migration_beats_search_document),
+    (7, "beats_title_prefix", _migration_beats_title_prefix),
+    (8, "beats_drive_folder_id", _migration_beats_drive_folder_id),
+]
+
+# Chiave dell'advisory lock PostgreSQL che serializza le migrazioni tra processi
+SCHEMA_MIGRATIONS_LOCK_ID = 7305501
+
+def _lock_schema_migrations(connection):
+    # Il lock dura fino alla fine della transazione: un solo processo applica ogni migrazione
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SCHEMA_MIGRATIONS_LOCK_ID})
+
+def run_schema_migrations():
+    """Applica in ordine, una transazione per ciascuna, le migrazioni non ancora registrate.
+
+    Sono da applicare tutte le versioni assenti dall'insieme registrato, anche
+    precedenti all'ultima applicata. Una migrazione che restituisce False è
+    stata saltata dal proprio controllo (es. beat duplicati) e non viene
+    registrata, così viene ritentata al prossimo avvio. Un errore interrompe la
+    sequenza e viene rilanciato; le migrazioni già completate restano registrate.
+    Restituisce i nomi delle migrazioni applicate (lista vuota se lo schema è aggiornato).
+    """
+    with engine.begin() as connection:
+        _lock_schema_migrations(connection)
+        SchemaMigration.__table__.create(connection, checkfirst=True)
+        applied_versions = set(connection.execute(select(SchemaMigration.version)).scalars())
+
+    applied_names = []
+    for version, name, migration in SCHEMA_MIGRATIONS:
+        if version in applied_versions:
+            continue
+        with engine.begin() as connection:
+            _lock_schema_migrations(connection)
+            # Riletto sotto lock: un altro processo può averla appena applicata
+            already_applied = connection.execute(
+                select(SchemaMigration.version).where(SchemaMigration.version == version)
+            ).first()
+            if already_applied:
+                continue
+            if migration(connection) is False:
+                print(f"Migrazione {version} ({name}) saltata, verrà ritentata al prossimo avvio")
+                continue
+            connection.execute(insert(SchemaMigration.__table__).values(
+                version=version, name=name, applied_at=datetime.now(timezone.utc)
+            ))
+            applied_names.append(name)
+    return applied_names
+
 print("Model loaded successfully!")
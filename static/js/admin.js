@@ -812,11 +812,11 @@ class BeatManager {
 
       console.log('📨 Risposta server status:', response.status); // Debug
       
-      if (!response.ok) {
+      // Gli errori di validazione (400) arrivano come JSON con l'elenco completo in details
+      const result = await response.json().catch(() => null);
+      if (!result) {
         throw new Error(`HTTP ${response.status}: ${response.statusText}`);
       }
-      
-      const result = await response.json();
       console.log('📊 Risultato server:', result); // Debug
 
       if (result.success) {
@@ -914,6 +914,87 @@ class BeatManager {
   }
 }
 
+// Upload diretto delle immagini bundle su R2: il server firma un URL PUT,
+// il browser invia il file al bucket e il server verifica l'oggetto caricato.
+// Se l'upload diretto non è possibile (es. CORS non configurato sul bucket)
+// si torna al caricamento tramite il server.
+function sendWithProgress(method, url, body, headers, onProgress) {
+  return new Promise((resolve, reject) => {
+    const xhr = new XMLHttpRequest();
+
+    xhr.upload.addEventListener('progress', (e) => {
+      if (e.lengthComputable && onProgress) {
+        onProgress((e.loaded / e.total) * 100);
+      }
+    });
+
+    xhr.addEventListener('load', () => {
+      if (xhr.status >= 200 && xhr.status < 300) {
+        resolve(xhr);
+      } else {
+        reject(new Error(`HTTP ${xhr.status}`));
+      }
+    });
+
+    xhr.addEventListener('error', () => reject(new Error('Network error')));
+
+    xhr.open(method, url);
+    Object.entries(headers || {}).forEach(([name, value]) => xhr.setRequestHeader(name, value));
+    xhr.send(body);
+  });
+}
+
+async function uploadBundleImage(file, previousImageKey, onProgress) {
+  const response = await fetch('/api/bundle-image-upload-url', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, content_type: file.type, size: file.size })
+  });
+  const ticket = await response.json();
+  if (!ticket.success) {
+    throw new Error(ticket.error || 'Errore durante il caricamento');
+  }
+
+  try {
+    await sendWithProgress(ticket.method || 'PUT', ticket.upload_url, file, ticket.headers, onProgress);
+  } catch (directError) {
+    console.warn('⚠️ Upload diretto su R2 non riuscito, uso il server:', directError);
+    return uploadBundleImageViaServer(file, previousImageKey, onProgress);
+  }
+
+  const finalize = await fetch('/api/finalize-bundle-image', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ image_key: ticket.image_key, previous_image_key: previousImageKey || '' })
+  });
+  const result = await finalize.json();
+  if (!result.success) {
+    throw new Error(result.error || 'Errore durante il caricamento');
+  }
+  return result;
+}
+
+async function uploadBundleImageViaServer(file, previousImageKey, onProgress) {
+  const formData = new FormData();
+  formData.append('image', file);
+  if (previousImageKey) {
+    formData.append('previous_image_key', previousImageKey);
+  }
+
+  const xhr = await sendWithProgress('POST', '/api/upload-bundle-image', formData, null, onProgress);
+  let result;
+  try {
+    result = JSON.parse(xhr.responseText);
+  } catch (parseError) {
+    console.error('Failed to parse upload response:', parseError);
+    throw new Error('Risposta del server non valida');
+  }
+  if (!result.success) {
+    throw new Error(result.error || 'Errore durante il caricamento');
+  }
+  return result;
+}
+
 // Image upload handler for bundles
 class ImageUploadManager {
   constructor() {
@@ -1129,36 +1210,21 @@ class ImageUploadManager {
         <div class="upload-progress" style="width: 0%; height: 4px; background: #007aff; margin: 20px auto; border-radius: 2px; max-width: 200px; display: block;"></div>
       `;
 
-      // Create form data
-      const formData = new FormData();
-      formData.append('image', file);
-
       // If there's already an image uploaded, send its key for deletion
       const imageKeyInput = document.querySelector('input[name="image_key"]');
-      if (imageKeyInput && imageKeyInput.value) {
-        formData.append('previous_image_key', imageKeyInput.value);
-        console.log('Will delete previous image:', imageKeyInput.value);
+      const previousImageKey = imageKeyInput ? imageKeyInput.value : '';
+      if (previousImageKey) {
+        console.log('Will delete previous image:', previousImageKey);
       }
 
-      // Upload with progress tracking
-      const xhr = await this.uploadWithProgress('/api/upload-bundle-image', formData, (progress) => {
+      // Upload with progress tracking (direct to R2, server fallback)
+      const result = await uploadBundleImage(file, previousImageKey, (progress) => {
         const progressBar = uploadArea.querySelector('.upload-progress');
         if (progressBar) {
           progressBar.style.width = `${progress}%`;
         }
       });
-
-      console.log('Upload response status:', xhr.status);
-      console.log('Upload response text:', xhr.responseText);
-      
-      let result;
-      try {
-        result = JSON.parse(xhr.responseText);
-        console.log('Upload result:', result);
-      } catch (parseError) {
-        console.error('Failed to parse upload response:', parseError);
-        throw new Error('Risposta del server non valida');
-      }
+      console.log('Upload result:', result);
 
       if (result.success) {
         console.log('✅ Upload successful!');
@@ -1234,32 +1300,6 @@ class ImageUploadManager {
     }
   }
 
-  async uploadWithProgress(url, formData, onProgress) {
-    return new Promise((resolve, reject) => {
-      const xhr = new XMLHttpRequest();
-      
-      xhr.upload.addEventListener('progress', (e) => {
-        if (e.lengthComputable) {
-          const progress = (e.loaded / e.total) * 100;
-          onProgress(progress);
-        }
-      });
-
-      xhr.addEventListener('load', () => {
-        if (xhr.status >= 200 && xhr.status < 300) {
-          resolve(xhr);
-        } else {
-          reject(new Error(`HTTP ${xhr.status}`));
-        }
-      });
-
-      xhr.addEventListener('error', () => reject(new Error('Network error')));
-      
-      xhr.open('POST', url);
-      xhr.send(formData);
-    });
-  }
-
   showImagePreview(imageUrl) {
     console.log('🖼️ showImagePreview called with URL:', imageUrl);
     const uploadArea = document.getElementById('image-upload-area');
@@ -1417,6 +1457,129 @@ document.addEventListener('DOMContentLoaded', () => {
   console.log('🎵 Enhanced Beat Management System initialized successfully!');
 });
 
+// Catalogo beat paginato: le pagine successive arrivano da /api/beats quando
+// la fine della lista entra nello schermo, con gli stessi filtri della pagina
+function initBeatCatalogPaging() {
+  const sentinel = document.getElementById('beat-list-sentinel');
+  if (!sentinel || !('IntersectionObserver' in window)) return;
+
+  let loading = false;
+  const observer = new IntersectionObserver(async (entries) => {
+    if (!entries.some(entry => entry.isIntersecting) || loading || !sentinel.dataset.nextAfter) return;
+    loading = true;
+    try {
+      const params = new URLSearchParams(window.location.search);
+      params.set('after', sentinel.dataset.nextAfter);
+      const response = await fetch(`/api/beats?${params.toString()}`);
+      const result = await response.json();
+      if (!result.success) {
+        throw new Error(result.error || 'Errore caricamento beat');
+      }
+      sentinel.insertAdjacentHTML('beforebegin', result.html);
+      sentinel.dataset.nextAfter = result.next_after || '';
+      if (!result.next_after) {
+        sentinel.innerHTML = '';
+        observer.disconnect();
+      } else {
+        // Se la lista non riempie ancora lo schermo la sentinella resta visibile: forza un nuovo controllo
+        observer.unobserve(sentinel);
+        observer.observe(sentinel);
+      }
+      if (window.beatManager) {
+        window.beatManager.loadBeatsFromDOM();
+      }
+    } catch (error) {
+      console.error('Errore caricamento pagina catalogo:', error);
+      toastManager.show('Impossibile caricare altri beat', 'error');
+      observer.disconnect();
+    } finally {
+      loading = false;
+    }
+  }, { rootMargin: '600px' });
+
+  observer.observe(sentinel);
+}
+
+document.addEventListener('DOMContentLoaded', initBeatCatalogPaging);
+
+// Ricerca beat: autocompletamento del catalogo e filtro della lista beat dei bundle.
+// Le richieste partono dopo una breve pausa di digitazione e le risposte
+// arrivate fuori ordine vengono scartate.
+function initBeatSuggestions() {
+  const input = document.querySelector('input[list="beat-suggestions"]');
+  const datalist = document.getElementById('beat-suggestions');
+  if (!input || !datalist) return;
+
+  let sequence = 0;
+  let timer = null;
+  input.addEventListener('input', () => {
+    clearTimeout(timer);
+    const query = input.value.trim();
+    if (!query) {
+      datalist.innerHTML = '';
+      return;
+    }
+    timer = setTimeout(async () => {
+      const current = ++sequence;
+      try {
+        const response = await fetch(`${input.dataset.suggestUrl}?q=${encodeURIComponent(query)}`);
+        const result = await response.json();
+        if (current !== sequence || !result.success) return;
+        datalist.innerHTML = '';
+        result.suggestions.forEach(suggestion => {
+          const option = document.createElement('option');
+          option.value = suggestion;
+          datalist.appendChild(option);
+        });
+      } catch (error) {
+        console.error('Errore autocompletamento beat:', error);
+      }
+    }, 150);
+  });
+}
+
+function initBundleBeatSearch() {
+  const input = document.querySelector('.bundle-beat-search');
+  if (!input) return;
+
+  const items = document.querySelectorAll('.beat-selection-item[data-beat-id]');
+  let sequence = 0;
+  let timer = null;
+  const showBeats = (visibleIds) => {
+    items.forEach(item => {
+      const checked = item.querySelector('input[type="checkbox"]')?.checked;
+      // I beat già selezionati restano sempre visibili
+      item.style.display = !visibleIds || checked || visibleIds.has(item.dataset.beatId) ? '' : 'none';
+    });
+  };
+
+  input.addEventListener('input', () => {
+    clearTimeout(timer);
+    const query = input.value.trim();
+    if (!query) {
+      sequence++;
+      showBeats(null);
+      return;
+    }
+    timer = setTimeout(async () => {
+      const current = ++sequence;
+      try {
+        const response = await fetch(`/api/beats/search?q=${encodeURIComponent(query)}&limit=1000`);
+        const result = await response.json();
+        if (current !== sequence || !result.success) return;
+        showBeats(new Set(result.results.map(beat => String(beat.id))));
+      } catch (error) {
+        console.error('Errore ricerca beat:', error);
+      }
+    }, 150);
+  });
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+  initBeatSuggestions();
+  initBundleBeatSearch();
+});
+
 // Export for potential external use
 window.BeatManagement = {
   toastManager,
@@ -1494,6 +1657,143 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 
 // Database Operations
+// Le operazioni sul database girano in background: il server restituisce un
+// operation_id e il client ne riceve il progresso via Server-Sent Events
+// (con polling come fallback) fino al completamento.
+let currentOperationId = null;
+
+async function startDatabaseOperation(url, payload) {
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(payload || {})
+  });
+
+  const result = await response.json();
+  if (!result.success || !result.operation_id) {
+    throw new Error(result.error || 'Impossibile avviare l\'operazione');
+  }
+  return result.operation_id;
+}
+
+const OPERATION_FINAL_STATES = ['completed', 'failed', 'cancelled'];
+
+function streamOperationEvents(operationId, onProgress) {
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`/admin/operations/${operationId}/events`);
+
+    source.onmessage = (event) => {
+      const status = JSON.parse(event.data);
+      if (onProgress) onProgress(status);
+
+      if (OPERATION_FINAL_STATES.includes(status.state)) {
+        source.close();
+        resolve(status);
+      }
+    };
+
+    // Il server chiude gli stream dopo un tempo massimo: si riapre uno stream nuovo
+    source.addEventListener('reconnect', () => {
+      source.close();
+      streamOperationEvents(operationId, onProgress).then(resolve, reject);
+    });
+
+    source.onerror = () => {
+      source.close();
+      reject(new Error('Stream SSE interrotto'));
+    };
+  });
+}
+
+async function pollOperation(operationId, onProgress) {
+  while (true) {
+    const response = await fetch(`/admin/operations/${operationId}`);
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const status = await response.json();
+    if (onProgress) onProgress(status);
+
+    if (OPERATION_FINAL_STATES.includes(status.state)) {
+      return status;
+    }
+    await new Promise(resolve => setTimeout(resolve, 1000));
+  }
+}
+
+async function waitForOperation(operationId, onProgress) {
+  currentOperationId = operationId;
+  const cancelButton = document.getElementById('cancel-operation-btn');
+  // Il pulsante Annulla compare solo per le operazioni che controllano le richieste di annullamento
+  const trackProgress = (status) => {
+    if (cancelButton) cancelButton.style.display = status.cancellable ? 'inline-flex' : 'none';
+    if (onProgress) onProgress(status);
+  };
+
+  try {
+    if (window.EventSource) {
+      try {
+        return await streamOperationEvents(operationId, trackProgress);
+      } catch (error) {
+        console.warn('⚠️ SSE non disponibile, passo al polling:', error);
+      }
+    }
+    return await pollOperation(operationId, trackProgress);
+  } finally {
+    currentOperationId = null;
+    if (cancelButton) cancelButton.style.display = 'none';
+  }
+}
+
+// Riaggancia un'operazione già in corso (es. avviata da un'altra scheda)
+async function resumeDatabaseOperation(operationId) {
+  loadingManager.showOverlay();
+
+  try {
+    const result = await waitForOperation(operationId, renderOperationProgress);
+    toastManager.show(result.details || result.status, result.state === 'completed' ? 'success' : 'error', {
+      title: 'Operazione Database Terminata',
+      duration: 8000
+    });
+    setTimeout(() => {
+      window.location.reload();
+    }, 2000);
+  } catch (error) {
+    console.error('❌ Resume operation error:', error);
+    loadingManager.hideOverlay();
+  }
+}
+
+async function cancelDatabaseOperation() {
+  if (!currentOperationId) return;
+
+  try {
+    const response = await fetch(`/admin/operations/${currentOperationId}/cancel`, { method: 'POST' });
+    const result = await response.json();
+    const statusText = document.querySelector('.status-text');
+    if (result.success && statusText) {
+      statusText.textContent = 'Annullamento in corso...';
+    } else if (!result.success) {
+      toastManager.show(result.error, 'error', { title: 'Annullamento non disponibile' });
+    }
+  } catch (error) {
+    console.error('❌ Cancel operation error:', error);
+  }
+}
+
+function renderOperationProgress(status) {
+  const progressBar = document.querySelector('.progress-fill');
+  const progressText = document.querySelector('.progress-text');
+  const statusText = document.querySelector('.status-text');
+
+  if (progressBar) progressBar.style.width = `${status.progress}%`;
+  if (progressText) progressText.textContent = `${Math.round(status.progress)}%`;
+  if (statusText && status.status) statusText.textContent = status.status;
+}
+
 async function updateDatabase() {
   const button = document.getElementById('update-db-btn');
   if (!button) return;
@@ -1501,133 +1801,69 @@ async function updateDatabase() {
   loadingManager.showButtonLoading(button);
   loadingManager.showOverlay();
 
-  // Show progress bar
   const progressBar = document.querySelector('.progress-fill');
-  const progressText = document.querySelector('.progress-text');
-  const statusText = document.querySelector('.status-text');
-  
-  if (progressBar && progressText && statusText) {
-    progressBar.style.width = '0%';
-    progressText.textContent = '0%';
-    statusText.textContent = 'Scansione in corso su Google Drive...';
-    
-    // Simulate progress updates for better UX
-    let progress = 0;
-    const progressInterval = setInterval(() => {
-      progress += Math.random() * 5;
-      if (progress > 90) progress = 90; // Don't go over 90% until real completion
-      
-      progressBar.style.width = `${progress}%`;
-      progressText.textContent = `${Math.round(progress)}%`;
-      
-      if (progress > 30) statusText.textContent = 'Processando file da Google Drive...';
-      if (progress > 60) statusText.textContent = 'Caricamento su Cloudflare R2...';
-      if (progress > 80) statusText.textContent = 'Aggiornamento database...';
-    }, 500);
+  renderOperationProgress({ progress: 0, status: 'Scansione in corso su Google Drive...' });
 
-    try {
-      console.log('🔄 Starting database update...');
-      
-      const response = await fetch('/admin/update-database', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        }
-      });
+  try {
+    console.log('🔄 Starting database update...');
+
+    const operationId = await startDatabaseOperation('/admin/update-database', { mode: 'incremental' });
+    const result = await waitForOperation(operationId, renderOperationProgress);
+
+    if (result.state === 'completed') {
+      renderOperationProgress({ progress: 100, status: 'Aggiornamento completato!' });
 
-      const result = await response.json();
-      
-      // Clear progress simulation
-      clearInterval(progressInterval);
-      
-      if (result.success) {
-        // Complete progress
-        progressBar.style.width = '100%';
-        progressText.textContent = '100%';
-        statusText.textContent = 'Aggiornamento completato!';
-        
-        setTimeout(() => {
-          loadingManager.hideOverlay();
-          loadingManager.hideButtonLoading(button);
-          
-          toastManager.show(result.message || 'Database aggiornato con successo!', 'success', {
-            title: 'Aggiornamento Completato',
-            duration: 5000
-          });
-          
-          // Show details if available
-          if (result.details) {
-            console.log('📊 Update details:', result.details);
-            toastManager.show(result.details, 'info', {
-              title: 'Dettagli Aggiornamento',
-              duration: 8000
-            });
-          }
-          
-          // Refresh page to show updated stats
-          setTimeout(() => {
-            window.location.reload();
-          }, 2000);
-        }, 1000);
-      } else {
-        throw new Error(result.error || 'Errore durante l\'aggiornamento del database');
-      }
-      
-    } catch (error) {
-      clearInterval(progressInterval);
-      console.error('❌ Database update error:', error);
-      
-      // Show error in progress bar
-      progressBar.style.width = '100%';
-      progressBar.style.backgroundColor = '#ff3b30';
-      progressText.textContent = 'Errore!';
-      statusText.textContent = 'Errore durante l\'aggiornamento';
-      
       setTimeout(() => {
         loadingManager.hideOverlay();
         loadingManager.hideButtonLoading(button);
-        
-        toastManager.show(error.message || 'Errore durante l\'aggiornamento del database', 'error', {
-          title: 'Errore Aggiornamento Database',
-          duration: 8000
+
+        toastManager.show('Database aggiornato con successo!', 'success', {
+          title: 'Aggiornamento Completato',
+          duration: 5000
         });
-      }, 1000);
-    }
-  } else {
-    // Fallback without progress bar
-    try {
-      const response = await fetch('/admin/update-database', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
+
+        // Show details if available
+        if (result.details) {
+          console.log('📊 Update details:', result.details);
+          toastManager.show(result.details, 'info', {
+            title: 'Dettagli Aggiornamento',
+            duration: 8000
+          });
         }
-      });
 
-      const result = await response.json();
-      
-      if (result.success) {
-        loadingManager.hideOverlay();
-        loadingManager.hideButtonLoading(button);
-        
-        toastManager.show(result.message || 'Database aggiornato con successo!', 'success', {
-          title: 'Aggiornamento Completato'
-        });
-        
+        // Refresh page to show updated stats
         setTimeout(() => {
           window.location.reload();
         }, 2000);
-      } else {
-        throw new Error(result.error || 'Errore durante l\'aggiornamento del database');
-      }
-      
-    } catch (error) {
-      console.error('❌ Database update error:', error);
-      toastManager.show(error.message || 'Errore durante l\'aggiornamento del database', 'error', {
-        title: 'Errore Aggiornamento Database'
-      });
-      loadingManager.hideButtonLoading(button);
+      }, 1000);
+    } else if (result.state === 'cancelled') {
       loadingManager.hideOverlay();
+      loadingManager.hideButtonLoading(button);
+      toastManager.show(result.details || 'Aggiornamento annullato', 'warning', {
+        title: 'Aggiornamento Annullato',
+        duration: 8000
+      });
+    } else {
+      throw new Error(result.details || 'Errore durante l\'aggiornamento del database');
     }
+
+  } catch (error) {
+    console.error('❌ Database update error:', error);
+
+    // Show error in progress bar
+    if (progressBar) progressBar.style.backgroundColor = '#ff3b30';
+    renderOperationProgress({ progress: 100, status: 'Errore durante l\'aggiornamento' });
+
+    setTimeout(() => {
+      loadingManager.hideOverlay();
+      loadingManager.hideButtonLoading(button);
+      if (progressBar) progressBar.style.backgroundColor = '';
+
+      toastManager.show(error.message || 'Errore durante l\'aggiornamento del database', 'error', {
+        title: 'Errore Aggiornamento Database',
+        duration: 8000
+      });
+    }, 1000);
   }
 }
 
@@ -1651,72 +1887,36 @@ async function resetDatabase() {
 
   loadingManager.showButtonLoading(button);
   loadingManager.showOverlay();
+  renderOperationProgress({ progress: 0, status: 'Reset database in corso...' });
 
   try {
     console.log('🔄 Starting database reset...');
-    
-    // Update progress manually since reset doesn't use SSE
-    const progressBar = document.querySelector('.progress-fill');
-    const progressText = document.querySelector('.progress-text');
-    const statusText = document.querySelector('.status-text');
-    
-    if (progressBar && progressText && statusText) {
-      progressBar.style.width = '0%';
-      progressText.textContent = '0%';
-      statusText.textContent = 'Reset database in corso...';
-      
-      // Simulate progress during reset
-      let progress = 0;
-      const progressInterval = setInterval(() => {
-        progress += 10;
-        if (progress <= 90) {
-          progressBar.style.width = `${progress}%`;
-          progressText.textContent = `${progress}%`;
-          statusText.textContent = progress < 50 ? 'Eliminazione tabelle...' : 'Ricreazione schema...';
-        }
-      }, 200);
-      
-      const response = await fetch('/admin/reset-database', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        }
-      });
 
-      clearInterval(progressInterval);
+    const operationId = await startDatabaseOperation('/admin/reset-database');
+    const result = await waitForOperation(operationId, renderOperationProgress);
+    console.log('📊 Reset result:', result);
 
-      if (!response.ok) {
-        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-      }
+    if (result.state === 'completed') {
+      renderOperationProgress({ progress: 100, status: 'Reset completato!' });
 
-      const result = await response.json();
-      console.log('📊 Reset result:', result);
-      
-      if (result.success) {
-        // Complete progress
-        progressBar.style.width = '100%';
-        progressText.textContent = '100%';
-        statusText.textContent = 'Reset completato!';
-        
-        // Update statistics in real time
-        updateDatabaseStats();
-        
+      // Update statistics in real time
+      updateDatabaseStats();
+
+      setTimeout(() => {
+        loadingManager.hideOverlay();
+        loadingManager.hideButtonLoading(button);
+
+        toastManager.show(result.details || 'Database resettato con successo!', 'success', {
+          title: 'Reset Completato'
+        });
+
+        // Refresh page to show updated stats
         setTimeout(() => {
-          loadingManager.hideOverlay();
-          loadingManager.hideButtonLoading(button);
-          
-          toastManager.show(result.message || 'Database resettato con successo!', 'success', {
-            title: 'Reset Completato'
-          });
-          
-          // Refresh page to show updated stats
-          setTimeout(() => {
-            window.location.reload();
-          }, 2000);
-        }, 1000);
-      } else {
-        throw new Error(result.error || 'Errore durante il reset del database');
-      }
+          window.location.reload();
+        }, 2000);
+      }, 1000);
+    } else {
+      throw new Error(result.details || 'Errore durante il reset del database');
     }
 
   } catch (error) {
@@ -1729,6 +1929,171 @@ async function resetDatabase() {
   }
 }
 
+async function reconcileStorage(deleteOrphans, force = false) {
+  const button = document.getElementById(deleteOrphans ? 'r2-cleanup-btn' : 'r2-reconcile-btn');
+  if (!button) return;
+
+  if (deleteOrphans && !force) {
+    const confirmed = await modalManager.confirm(
+      'Conferma Pulizia Storage',
+      'Eliminare da R2 i file non referenziati dal database più vecchi del periodo di tolleranza?',
+      {
+        confirmText: 'Sì, Elimina',
+        cancelText: 'Annulla'
+      }
+    );
+    if (!confirmed) {
+      return;
+    }
+  }
+
+  loadingManager.showButtonLoading(button);
+  loadingManager.showOverlay();
+  renderOperationProgress({ progress: 0, status: 'Analisi storage R2...' });
+
+  let blocked = null;
+  try {
+    const operationId = await startDatabaseOperation('/admin/r2-reconcile', { delete_orphans: deleteOrphans, force });
+    const result = await waitForOperation(operationId, renderOperationProgress);
+
+    // Il server rifiuta eliminazioni sospette (database vuoto, troppi orfani) finché non si conferma con force
+    if (deleteOrphans && !force && (result.details || '').startsWith('Eliminazione bloccata')) {
+      blocked = result.details;
+      return;
+    }
+
+    toastManager.show(result.details || result.status, result.state === 'completed' ? 'success' : 'error', {
+      title: deleteOrphans ? 'Pulizia Storage R2' : 'Analisi Storage R2',
+      duration: 10000
+    });
+  } catch (error) {
+    console.error('❌ Storage reconciliation error:', error);
+    toastManager.show(error.message || 'Errore durante l\'analisi dello storage', 'error', {
+      title: 'Errore Storage R2'
+    });
+  } finally {
+    loadingManager.hideButtonLoading(button);
+    loadingManager.hideOverlay();
+  }
+
+  if (blocked) {
+    const forced = await modalManager.confirm(
+      'Eliminazione Bloccata',
+      `${blocked} Procedere comunque con l'eliminazione?`,
+      {
+        confirmText: 'Elimina Comunque',
+        cancelText: 'Annulla'
+      }
+    );
+    if (forced) {
+      await reconcileStorage(true, true);
+    }
+  }
+}
+
+// Migration plan (dry run): what the next update would do, metadata only
+const MIGRATION_PLAN_LIST_LIMIT = 20;
+
+function formatPlanBytes(bytes) {
+  const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+  let value = bytes;
+  let unit = 0;
+  while (value >= 1024 && unit < units.length - 1) {
+    value /= 1024;
+    unit++;
+  }
+  return `${value.toFixed(unit === 0 ? 0 : 1)} ${units[unit]}`;
+}
+
+function formatPlanDuration(seconds) {
+  if (seconds < 60) return `${seconds}s`;
+  const minutes = Math.floor(seconds / 60);
+  if (minutes < 60) return `${minutes}m ${seconds % 60}s`;
+  return `${Math.floor(minutes / 60)}h ${minutes % 60}m`;
+}
+
+function renderPlanList(containerId, items, formatItem) {
+  const container = document.getElementById(containerId);
+  if (!container) return;
+
+  container.replaceChildren();
+  items.slice(0, MIGRATION_PLAN_LIST_LIMIT).forEach(item => {
+    const row = document.createElement('li');
+    row.textContent = formatItem(item);
+    container.appendChild(row);
+  });
+  if (items.length > MIGRATION_PLAN_LIST_LIMIT) {
+    const more = document.createElement('li');
+    more.className = 'plan-more';
+    more.textContent = `... e altri ${items.length - MIGRATION_PLAN_LIST_LIMIT}`;
+    container.appendChild(more);
+  }
+  container.closest('.plan-group').style.display = items.length ? '' : 'none';
+}
+
+function renderMigrationPlan(plan) {
+  const summary = document.getElementById('plan-summary');
+  const counts = plan.counts;
+  document.getElementById('plan-beats-to-insert').textContent = counts.beats_to_insert;
+  document.getElementById('plan-uploads').textContent = counts.uploads;
+  document.getElementById('plan-transcodes').textContent = counts.transcodes;
+  document.getElementById('plan-problems').textContent = counts.incomplete_folders + counts.name_mismatches;
+
+  if (!counts.beats_to_insert && !counts.uploads && !counts.transcodes) {
+    summary.textContent = `Tutto aggiornato: ${plan.beat_folders} cartelle beat su Drive, ${plan.r2_objects} file su R2.`;
+  } else {
+    summary.textContent = `${formatPlanBytes(plan.bytes_to_transfer)} da trasferire` +
+      (counts.replacements ? ` (${counts.replacements} file da sostituire)` : '') +
+      `, tempo stimato ${formatPlanDuration(plan.estimated_seconds)}.`;
+  }
+  summary.textContent += ` Piano calcolato il ${new Date(plan.generated_at).toLocaleString('it-IT')}.`;
+
+  renderPlanList('plan-list-insert', plan.beats_to_insert, item => item.path);
+  renderPlanList('plan-list-files', plan.uploads.concat(plan.transcodes),
+    item => `${item.r2_key} (${formatPlanBytes(item.bytes)}${item.replace ? ', sostituzione' : ''})`);
+  renderPlanList('plan-list-incomplete', plan.incomplete_folders, item => `${item.path}: ${item.reason}`);
+  renderPlanList('plan-list-mismatches', plan.name_mismatches, item => `${item.path}: ${item.file} (atteso ${item.beat})`);
+}
+
+// Il server restituisce l'ultimo piano calcolato; il ricalcolo gira in background solo su richiesta (refresh)
+async function loadMigrationPlan(refresh = false) {
+  const section = document.getElementById('migration-plan');
+  if (!section) return;
+
+  const summary = document.getElementById('plan-summary');
+  summary.textContent = refresh ? 'Calcolo del piano in corso...' : 'Caricamento del piano...';
+
+  try {
+    let operationId = refresh ? await startDatabaseOperation('/admin/migration-plan') : null;
+    if (!operationId) {
+      const response = await fetch('/admin/migration-plan');
+      const plan = await response.json();
+      if (!response.ok || !plan.success) {
+        throw new Error(plan.error || `HTTP ${response.status}`);
+      }
+
+      if (plan.missing) {
+        summary.textContent = 'Nessun piano calcolato: premere Ricalcola per confrontare Google Drive con database e R2.';
+      } else {
+        renderMigrationPlan(plan);
+      }
+      operationId = plan.operation_id;
+      if (operationId) summary.textContent += ' Calcolo del piano in corso...';
+    }
+
+    if (operationId) {
+      const status = await pollOperation(operationId);
+      if (status.state !== 'completed') {
+        throw new Error(status.details || status.status);
+      }
+      await loadMigrationPlan();
+    }
+  } catch (error) {
+    console.error('❌ Migration plan error:', error);
+    summary.textContent = `Impossibile calcolare il piano: ${error.message}`;
+  }
+}
+
 // Function to update database statistics in real time
 async function updateDatabaseStats() {
   try {
@@ -1771,4 +2136,4 @@ async function updateDatabaseStats() {
   }
 }
 
-// Database operations are now synchronous - no progress tracking needed
\ No newline at end of file
+// Database operations run as background jobs - see waitForOperation()
\ No newline at end of file